@@ -0,0 +1,291 @@
+"""
+Check that the stepped and swept platformer movement produce the same states as the original per-pixel movement
+"""
+
+import os
+import argparse
+from datetime import datetime
+
+from model.level import Level, TILE_DIM
+from model_platformer.player import PlayerPlatformer, HALF_TURTLE_WIDTH, HALF_TILE_WIDTH
+from model_platformer.state import StatePlatformer
+from model_platformer.action import ActionPlatformer
+
+LEVEL_STRUCTURAL_LAYERS_DIR = "level_structural_layers"
+NON_PLATFORMER_GAMES = ['maze']  # levels played with maze rules
+
+
+class OriginalPlayerPlatformer:
+    # The original per-pixel platformer movement (collide and next_state copied unchanged from before the movement
+    # refactor), kept as the oracle both the stepped and the swept movement are checked against
+
+    def __init__(self, img, level):
+        self.gravity = 4 if level.get_game() == 'sample' else 5
+        self.steps = 8 if level.get_game() == 'sample' else 10
+        self.max_vel = 7 * self.gravity if level.get_game() == 'kid_icarus' else 8 * self.gravity
+
+        self.half_player_h = HALF_TILE_WIDTH
+        self.half_player_w = HALF_TURTLE_WIDTH if img == 'turtle' else HALF_TILE_WIDTH
+
+        self.level = level
+
+    def collide(self, x, y, tile_coords):
+        ret = None
+        for tile_coord in tile_coords:
+            x_overlap = tile_coord[0] < (x + self.half_player_w) and (tile_coord[0] + TILE_DIM) > (x - self.half_player_w)
+            y_overlap = tile_coord[1] < (y + self.half_player_h) and (tile_coord[1] + TILE_DIM) > (y - self.half_player_h)
+            if x_overlap and y_overlap:
+                if ret is None:
+                    ret = tile_coord
+                else:
+                    if (x - (tile_coord[0] + TILE_DIM//2))**2 + (y - (tile_coord[1] + TILE_DIM//2))**2 < (x - (ret[0] + TILE_DIM//2))**2 + (y - (ret[1] + TILE_DIM//2))**2:
+                        ret = tile_coord
+        return ret
+
+    def next_state(self, state, action):
+        new_state = state.clone()
+
+        new_state.is_start = False
+
+        if new_state.goal_reached or new_state.is_dead:
+            return new_state
+
+        # Get level bounds
+        min_x, max_x = 0 + self.half_player_w, self.level.get_width() - self.half_player_w
+        min_y, max_y = 0 + self.half_player_h, self.level.get_height() - self.half_player_h
+
+        # Account for gravity
+        new_state.movey += self.gravity
+        if new_state.movey > self.max_vel:
+            new_state.movey = self.max_vel
+
+        if action.left and not action.right:
+            new_state.movex = -self.steps
+        elif action.right and not action.left:
+            new_state.movex = self.steps
+        else:
+            new_state.movex = 0
+
+        if action.jump and new_state.onground:
+            new_state.movey = -self.max_vel
+
+        new_state.onground = False
+        new_state.hit_bonus_coord = ''
+
+        use_kid_icarus_rules = self.level.get_game() == "kid_icarus"
+
+        # Move in x direction
+        for ii in range(abs(new_state.movex)):
+            old_x = new_state.x
+            if new_state.movex < 0:
+                new_state.x -= 1
+            elif new_state.movex > 0:
+                new_state.x += 1
+
+            # Handle hazard tile collisions
+            hazard_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_hazard_coords())
+            if hazard_collision_coord is not None:
+                new_state.is_dead = True
+                new_state.is_start = False
+                return new_state
+
+            # Handle block tile collisions
+            tile_collision_coord = self.collide(new_state.x, new_state.y,
+                                                self.level.get_platform_coords() +
+                                                self.level.get_bonus_coords() +
+                                                self.level.get_wall_coords())
+
+            # kid icarus wrap
+            if use_kid_icarus_rules:
+                min_x = 0 + int(TILE_DIM * 1.5)
+                max_x = self.level.get_width() - int(TILE_DIM * 1.5)
+                kid_icarus_level_width = int(self.level.get_width() - 2 * TILE_DIM)
+
+                # check if wrap would collide on other side
+                if tile_collision_coord is None:
+                    if new_state.x <= min_x:
+                        tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, self.level.get_platform_coords() + self.level.get_bonus_coords() + self.level.get_wall_coords())
+                    if new_state.x >= max_x:
+                        tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, self.level.get_platform_coords() + self.level.get_bonus_coords() + self.level.get_wall_coords())
+
+                # handle wrap
+                if tile_collision_coord is None:
+                    if new_state.x < TILE_DIM:
+                        new_state.x += kid_icarus_level_width
+                    if new_state.x >= self.level.get_width() - TILE_DIM:
+                        new_state.x -= kid_icarus_level_width
+
+            if not use_kid_icarus_rules:
+                # Handle moving off the screen
+                move_off_screen_left = new_state.x < min_x
+                move_off_screen_right = new_state.x > max_x
+                move_off_screen_x = move_off_screen_left or move_off_screen_right
+
+                if move_off_screen_x:
+                    tile_collision_coord = True # no tile, but act like a tile was collided with
+        
+            if tile_collision_coord is not None:
+                new_state.x = old_x
+                new_state.movex = 0
+                break
+
+        # Move in y direction
+        for jj in range(abs(new_state.movey)):
+            old_y = new_state.y
+            if new_state.movey < 0:
+                new_state.y -= 1
+            elif new_state.movey > 0:
+                new_state.y += 1
+
+            hazard_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_hazard_coords())
+            if hazard_collision_coord is not None:
+                new_state.is_dead = True
+                new_state.is_start = False
+                return new_state
+
+            # Collide with one-way block tile from above
+            block_tile_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_platform_coords() + self.level.get_wall_coords())
+            bonus_tile_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_bonus_coords())
+            one_way_platform_tile_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_one_way_platform_coords())
+
+            # kid icarus wrap
+            if use_kid_icarus_rules:
+                min_x = 0 + int(TILE_DIM * 1.5)
+                max_x = self.level.get_width() - int(TILE_DIM * 1.5)
+                kid_icarus_level_width = int(self.level.get_width() - 2 * TILE_DIM)
+
+                # check if wrap would collide on other side
+                if block_tile_collision_coord is None:
+                    if new_state.x <= min_x:
+                        block_tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, self.level.get_platform_coords() + self.level.get_wall_coords())
+                    if new_state.x >= max_x:
+                        block_tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, self.level.get_platform_coords() + self.level.get_wall_coords())
+
+                if bonus_tile_collision_coord is None:
+                    if new_state.x <= min_x:
+                        bonus_tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, self.level.get_bonus_coords())
+                    if new_state.x >= max_x:
+                        bonus_tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, self.level.get_bonus_coords())
+
+                if one_way_platform_tile_collision_coord is None:
+                    if new_state.x <= min_x:
+                        one_way_platform_tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, self.level.get_one_way_platform_coords())
+                    if new_state.x >= max_x:
+                        one_way_platform_tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, self.level.get_one_way_platform_coords())
+
+            hit_one_way_platform_tile_from_above = one_way_platform_tile_collision_coord is not None and new_state.movey > 0 and old_y + self.half_player_h <= one_way_platform_tile_collision_coord[1]
+            collide = block_tile_collision_coord is not None or bonus_tile_collision_coord is not None or hit_one_way_platform_tile_from_above
+
+            move_off_screen_y = new_state.y < min_y
+
+            if collide or move_off_screen_y:
+                new_state.y = old_y
+                new_state.onground = new_state.movey > 0
+                new_state.movey = 0
+
+                # if bonus tile was hit from below
+                if bonus_tile_collision_coord is not None and new_state.y >= bonus_tile_collision_coord[1] + TILE_DIM:
+                    if new_state.x >= bonus_tile_collision_coord[0] + TILE_DIM:
+                        new_state.hit_bonus_coord = 'NW'
+                    elif new_state.x < bonus_tile_collision_coord[0]:
+                        new_state.hit_bonus_coord = 'NE'
+                    else:
+                        new_state.hit_bonus_coord = 'N'
+
+            # Player is dead if it falls off the screen (e.g. down a pit)
+            if new_state.y >= self.level.get_height():
+                new_state.y = self.level.get_height() - 1
+                new_state.is_dead = True
+                break
+
+        # Check if goal reached
+        goal_tile_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_goal_coords())
+        new_state.goal_reached = goal_tile_collision_coord is not None
+
+        return new_state
+
+
+def get_all_game_levels():
+    game_levels = []
+    for game in sorted(os.listdir(LEVEL_STRUCTURAL_LAYERS_DIR)):
+        game_dir = os.path.join(LEVEL_STRUCTURAL_LAYERS_DIR, game)
+        if not os.path.isdir(game_dir) or game in NON_PLATFORMER_GAMES:
+            continue
+        for filename in sorted(os.listdir(game_dir)):
+            if filename.endswith(".txt"):
+                game_levels.append("%s/%s" % (game, filename[:-len(".txt")]))
+    return game_levels
+
+
+def check_level(game, level, player_img):
+    level_obj = Level.generate_level_from_file(game, level)
+    original_player = OriginalPlayerPlatformer(player_img, level_obj)
+    players = {  # {movement: player checked against the original per-pixel movement}
+        'stepped': PlayerPlatformer(player_img, level_obj, use_swept_movement=False),
+        'swept': PlayerPlatformer(player_img, level_obj, use_swept_movement=True)
+    }
+    action_set = ActionPlatformer.allActions()
+
+    # Compare the next states for every action from every state reachable with the original movement
+    start_state_key = players['swept'].get_start_state().to_key()
+    unexplored_states = set([start_state_key])
+    explored_states = set()
+    mismatches = []  # [(movement, state_key, action_str, original_next_state_key, next_state_key)]
+
+    while len(unexplored_states) > 0:
+        cur_state_key = unexplored_states.pop()
+        explored_states.add(cur_state_key)
+        cur_state = StatePlatformer.from_key(cur_state_key)
+
+        for action in action_set:
+            original_next_state_key = original_player.next_state(cur_state, action).to_key()
+
+            for movement, player in players.items():
+                next_state_key = player.next_state(cur_state, action).to_key()
+                if next_state_key != original_next_state_key:
+                    mismatches.append((movement, cur_state_key, action.to_str(), original_next_state_key,
+                                       next_state_key))
+
+            if original_next_state_key not in explored_states:
+                unexplored_states.add(original_next_state_key)
+
+    return len(explored_states), mismatches
+
+
+def main(game_levels, player_imgs):
+
+    if game_levels is None:
+        game_levels = get_all_game_levels()
+
+    num_failed = 0
+
+    for game_level in game_levels:
+        game, level = game_level.split('/')
+        for player_img in player_imgs:
+            start_time = datetime.now()
+            num_states, mismatches = check_level(game, level, player_img)
+            runtime = str(datetime.now() - start_time)
+
+            status = "OK" if len(mismatches) == 0 else "FAILED"
+            print("%s (%s): %s - %d states, %d mismatches (runtime: %s)" % (game_level, player_img, status,
+                                                                            num_states, len(mismatches), runtime))
+            for movement, state_key, action_str, original_key, movement_key in mismatches[:10]:
+                print("  state: %s, action: %s" % (str(state_key), action_str))
+                print("    original: %s" % str(original_key))
+                print("    %s: %s" % (movement, str(movement_key)))
+
+            num_failed += 0 if len(mismatches) == 0 else 1
+
+    print("Levels checked: %d" % (len(game_levels) * len(player_imgs)))
+    print("Levels failed: %d" % num_failed)
+    return num_failed == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check stepped and swept movement against the original per-pixel movement')
+    parser.add_argument('--game_levels', type=str, nargs='+', help='List of game/level (default: all levels)', default=None)
+    parser.add_argument('--player_imgs', type=str, nargs='+', help='Player images to check', default=['block', 'turtle'])
+    args = parser.parse_args()
+
+    all_same = main(args.game_levels, args.player_imgs)
+    exit(0 if all_same else 1)
@@ -0,0 +1,229 @@
+"""
+Cluster near-duplicate metatiles of the combined tileset of the given levels (MinHash/LSH over normalized edge sets)
+"""
+
+import os
+import argparse
+import numpy as np
+from datetime import datetime
+
+import extract_metatiles
+import get_metatile_id_map
+import extract_constraints
+import gen_prolog
+from model.metatile import Metatile
+from model.metatile_library import MetatileLibrary
+from utils import error_exit, get_filepath, read_pickle, write_pickle, read_txt
+
+MINHASH_PRIME = (1 << 31) - 1  # hash permutations are (a * x + b) % MINHASH_PRIME
+MINHASH_SEED = 0
+
+
+def get_edge_set(metatile):
+    # Normalized edges of the metatile: {(source state record, dest state record, action bitmask)}
+    graph = metatile.graph
+    edge_set = set()
+    for (source, dest), action_bitmask in zip(graph.edges.tolist(), graph.actions.tolist()):
+        edge_set.add((graph.state_records[source], graph.state_records[dest], action_bitmask))
+    return edge_set
+
+
+def get_minhash_signatures(edge_sets, num_perm):
+    # signatures[i][j] = min of hash permutation j over the edges of edge_sets[i] (edge sets must not be empty)
+    random_state = np.random.RandomState(MINHASH_SEED)
+    a = random_state.randint(1, MINHASH_PRIME, size=num_perm).astype(np.int64)
+    b = random_state.randint(0, MINHASH_PRIME, size=num_perm).astype(np.int64)
+    signatures = np.zeros((len(edge_sets), num_perm), dtype=np.int64)
+    for i, edge_set in enumerate(edge_sets):
+        edge_ids = np.array([hash(edge) for edge in edge_set], dtype=np.int64) % MINHASH_PRIME
+        signatures[i] = ((a[:, np.newaxis] * edge_ids[np.newaxis, :] + b[:, np.newaxis]) % MINHASH_PRIME).min(axis=1)
+    return signatures
+
+
+def get_candidate_pairs(metatile_types, signatures, bands):
+    # LSH: metatiles of the same type whose signatures agree on all rows of at least one band are candidates.
+    # Returns {i: set of candidate j}
+    rows = signatures.shape[1] // bands
+    buckets = {}  # {(type, band, band signature): [i]}
+    for i, signature in enumerate(signatures.tolist()):
+        for band in range(bands):
+            bucket = (metatile_types[i], band, tuple(signature[band * rows:(band + 1) * rows]))
+            if buckets.get(bucket) is None:
+                buckets[bucket] = []
+            buckets[bucket].append(i)
+
+    candidates = {}
+    for i in range(len(signatures)):
+        candidates[i] = set()
+    for bucket_metatiles in buckets.values():
+        for i in bucket_metatiles:
+            candidates[i].update(bucket_metatiles)
+    for i in range(len(signatures)):
+        candidates[i].discard(i)
+    return candidates
+
+
+def jaccard_similarity(edge_set_a, edge_set_b):
+    return len(edge_set_a & edge_set_b) / len(edge_set_a | edge_set_b)
+
+
+def cluster_metatiles(unique_metatiles, threshold, num_perm, bands):
+    # Greedily clusters the metatiles with the most edges first: each unclustered metatile represents a new cluster,
+    # which takes the unclustered LSH candidates whose edge sets have at least the given jaccard similarity with it.
+    # Metatiles without edges are never clustered. Returns the clustered metatiles (the representatives, with the games
+    # and levels of their cluster, in unique_metatiles order) and {content hash: representative content hash}
+    edge_sets = [get_edge_set(metatile) for metatile in unique_metatiles]
+    clusterable = [i for i in range(len(unique_metatiles)) if len(edge_sets[i]) > 0]
+    candidates = {}
+    if threshold < 1 and len(clusterable) > 0:
+        signatures = get_minhash_signatures([edge_sets[i] for i in clusterable], num_perm)
+        clusterable_candidates = get_candidate_pairs([unique_metatiles[i].type for i in clusterable], signatures, bands)
+        for j, i in enumerate(clusterable):
+            candidates[i] = [clusterable[k] for k in sorted(clusterable_candidates[j])]
+
+    representatives = [None] * len(unique_metatiles)  # representatives[i] = index of metatile i's representative
+    for i in sorted(range(len(unique_metatiles)), key=lambda i: -len(edge_sets[i])):
+        if representatives[i] is not None:
+            continue
+        representatives[i] = i
+        for j in candidates.get(i, []):
+            if representatives[j] is None and jaccard_similarity(edge_sets[i], edge_sets[j]) >= threshold:
+                representatives[j] = i
+
+    cluster_games_levels = {}  # {representative index: (games, levels)}
+    for i, metatile in enumerate(unique_metatiles):
+        games, levels = cluster_games_levels.get(representatives[i], ([], []))
+        games += [game for game in metatile.get_games() if game not in games]
+        levels += [level for level in metatile.get_levels() if level not in levels]
+        cluster_games_levels[representatives[i]] = (games, levels)
+
+    clustered_metatiles = []
+    representative_hashes = {}
+    for i, metatile in enumerate(unique_metatiles):
+        representative_hashes[metatile.get_content_hash()] = unique_metatiles[representatives[i]].get_content_hash()
+        if representatives[i] == i:
+            games, levels = cluster_games_levels[i]
+            clustered_metatile = Metatile(metatile.type, metatile.graph, games=games, levels=levels)
+            clustered_metatile.content_hash = metatile.get_content_hash()
+            clustered_metatiles.append(clustered_metatile)
+    return clustered_metatiles, representative_hashes
+
+
+def get_clustered_metatile_coords_dict(metatile_coords_dict, clustered_metatiles, representative_hashes):
+    # Replaces the metatile str keys of a {metatile_str: coords} dict with the str of their cluster's representative
+    clustered_metatile_strs = {}
+    for clustered_metatile in clustered_metatiles:
+        clustered_metatile_strs[clustered_metatile.get_content_hash()] = clustered_metatile.to_str()
+
+    clustered_metatile_coords_dict = {}
+    for metatile_str, coords in metatile_coords_dict.items():
+        representative_hash = representative_hashes[Metatile.from_str(metatile_str).get_content_hash()]
+        clustered_metatile_str = clustered_metatile_strs[representative_hash]
+        if clustered_metatile_coords_dict.get(clustered_metatile_str) is None:
+            clustered_metatile_coords_dict[clustered_metatile_str] = []
+        clustered_metatile_coords_dict[clustered_metatile_str] += coords
+    return clustered_metatile_coords_dict
+
+
+def get_grounding_time(prolog_file, level_w, level_h):
+    # Seconds clingo takes to ground the prolog file for a level_w x level_h level (None if clingo is not installed)
+    try:
+        import clingo
+    except ImportError:
+        return None
+    start_time = datetime.now()
+    ctl = clingo.Control()
+    ctl.load(prolog_file)
+    ctl.add("base", [], "dim_width(0..%d). dim_height(0..%d). tile(TX,TY) :- dim_width(TX), dim_height(TY)." %
+            (level_w - 1, level_h - 1))
+    ctl.ground([("base", [])])
+    return (datetime.now() - start_time).total_seconds()
+
+
+def main(game_levels, save_filename, player_img, thresholds, num_perm, bands, level_w, level_h):
+
+    print("Clustering near-duplicate metatiles of the given levels: %s ..." % str(game_levels))
+
+    if num_perm % bands != 0:
+        error_exit("num_perm (%d) must be a multiple of bands (%d)" % (num_perm, bands))
+
+    # Get the combined unique metatiles and metatile_coords dicts of the levels
+    metatile_library = MetatileLibrary(player_img)
+    metatile_coords_dict_file_format = "level_saved_files_%s/metatile_coords_dicts/%s/%s.pickle"
+    metatile_coords_dicts = {}
+    level_names = []
+    for game_level in game_levels:
+        game, level = game_level.split('/')
+        if not metatile_library.has_level(game, level):
+            error_exit("Missing metatile library entry for %s. Run 'python main.py <environment> %s %s --process'" %
+                       (level, game, level))
+        metatile_coords_dict_file = metatile_coords_dict_file_format % (player_img, game, level)
+        if not os.path.exists(metatile_coords_dict_file):
+            error_exit("Missing metatile_coords_dict_file for %s." % level)
+        metatile_coords_dicts[level] = read_pickle(metatile_coords_dict_file)
+        level_names.append(level)
+
+    save_filename = "_".join(level_names) if save_filename is None else save_filename
+    unique_metatiles = metatile_library.get_unique_metatiles([game_level.split('/') for game_level in game_levels])
+
+    # Cluster the tileset with each similarity threshold and generate its prolog file
+    tradeoffs = []  # [(threshold, num metatiles, num prolog statements, grounding time, prolog file)]
+    for threshold in thresholds:
+        start_time = datetime.now()
+        clustered_metatiles, representative_hashes = cluster_metatiles(unique_metatiles, threshold, num_perm, bands)
+        print("threshold %.2f: %d unique metatiles => %d clustered metatiles (%s)" % (
+            threshold, len(unique_metatiles), len(clustered_metatiles), str(datetime.now() - start_time)))
+
+        clustered_filename = "%s_cluster%d" % (save_filename, int(round(threshold * 100)))
+        clustered_metatiles_file = extract_metatiles.get_unique_metatiles_file(clustered_filename, player_img)
+        write_pickle(clustered_metatiles_file, clustered_metatiles)
+        cluster_map_file = get_filepath("level_saved_files_%s/metatile_clusters" % player_img,
+                                        "%s.pickle" % clustered_filename)
+        write_pickle(cluster_map_file, representative_hashes)
+
+        clustered_metatile_coords_dict_files = []
+        for level, metatile_coords_dict in metatile_coords_dicts.items():
+            clustered_metatile_coords_dict = get_clustered_metatile_coords_dict(metatile_coords_dict,
+                                                                                clustered_metatiles,
+                                                                                representative_hashes)
+            clustered_metatile_coords_dict_file = get_filepath(
+                "level_saved_files_%s/metatile_coords_dicts/%s" % (player_img, clustered_filename), "%s.pickle" % level)
+            write_pickle(clustered_metatile_coords_dict_file, clustered_metatile_coords_dict)
+            clustered_metatile_coords_dict_files.append(clustered_metatile_coords_dict_file)
+
+        id_metatile_map_file, metatile_id_map_file, runtime = get_metatile_id_map.main(
+            save_filename=clustered_filename, unique_metatiles_file=clustered_metatiles_file, player_img=player_img)
+        constraints_file, runtime = extract_constraints.main(
+            save_filename=clustered_filename, metatile_id_map_file=metatile_id_map_file,
+            id_metatile_map_file=id_metatile_map_file, metatile_coords_dict_files=clustered_metatile_coords_dict_files,
+            player_img=player_img)
+        prolog_file, runtime = gen_prolog.main(tile_constraints_file=constraints_file, debug=False, print_pl=False,
+                                               save=True)
+
+        num_prolog_statements = len(read_txt(prolog_file).splitlines())
+        grounding_time = get_grounding_time(prolog_file, level_w, level_h)
+        tradeoffs.append((threshold, len(clustered_metatiles), num_prolog_statements, grounding_time, prolog_file))
+
+    print("---- Tileset Size vs. Grounding Time (%dx%d level) ----" % (level_w, level_h))
+    for threshold, num_metatiles, num_prolog_statements, grounding_time, prolog_file in tradeoffs:
+        grounding_time_str = "n/a (clingo not installed)" if grounding_time is None else "%.2fs" % grounding_time
+        print("threshold %.2f: %d metatiles, %d prolog statements, grounding time %s: %s" % (
+            threshold, num_metatiles, num_prolog_statements, grounding_time_str, prolog_file))
+
+    return tradeoffs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cluster near-duplicate metatiles of the combined tileset of the given levels')
+    parser.add_argument('game_levels', type=str, nargs='+', help='List of game/level')
+    parser.add_argument('--save_filename', type=str, help='File name to save clustered tilesets to', default=None)
+    parser.add_argument('--player_img', type=str, help="Player image", default='block')
+    parser.add_argument('--thresholds', type=float, nargs='+', help="Jaccard similarity thresholds of the edge sets of merged metatiles", default=[1.0, 0.9, 0.8, 0.7])
+    parser.add_argument('--num_perm', type=int, help="Number of MinHash permutations", default=128)
+    parser.add_argument('--bands', type=int, help="Number of LSH bands (num_perm must be a multiple of bands)", default=32)
+    parser.add_argument('--level_w', type=int, help="Level width (in tiles) used to measure grounding time", default=20)
+    parser.add_argument('--level_h', type=int, help="Level height (in tiles) used to measure grounding time", default=10)
+    args = parser.parse_args()
+
+    main(args.game_levels, args.save_filename, args.player_img, args.thresholds, args.num_perm, args.bands,
+         args.level_w, args.level_h)
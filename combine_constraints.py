@@ -8,30 +8,34 @@ import extract_metatiles
 import get_metatile_id_map
 import extract_constraints
 import gen_prolog
-from utils import error_exit
+from model.metatile_library import MetatileLibrary
+from utils import error_exit, read_pickle, write_pickle, get_filepath
 
 
-def main(game_levels, save_filename, player_img):
+def get_combined_tileset_file(save_filename, player_img):
+    # {'game_levels': [game/level], 'coord_tile_ids_map': {coord: tile_ids}} of a combined tileset (see --incremental)
+    return get_filepath("level_saved_files_%s/combined_tilesets" % player_img, "%s.pickle" % save_filename)
 
-    print("Creating combined tile constraints file for the given levels: %s ..." % str(game_levels))
+
+def get_metatile_coords_dict_files(game_levels, player_img, metatile_library):
 
     # Saved filename formats
-    state_graph_file_format = "level_saved_files_%s/enumerated_state_graphs/%s/%s.gpickle"
     metatile_coords_dict_file_format = "level_saved_files_%s/metatile_coords_dicts/%s/%s.pickle"
-    state_graph_files = []
+    level_unique_metatiles_file_format = "level_saved_files_%s/unique_metatiles/%s.pickle"
     metatile_coords_dict_files = []
     level_names = []
 
-    # Get state graph and metatile_coord_dict files for each level
+    # Get metatile library entry and metatile_coord_dict files for each level
     for game_level in game_levels:
         game, level = game_level.split('/')
-        state_graph_file = state_graph_file_format % (player_img, game, level)
         metatile_coords_dict_file = metatile_coords_dict_file_format % (player_img, game, level)
 
-        if not os.path.exists(state_graph_file):
-            error_exit("Missing state graph for %s." % level)
-        else:
-            state_graph_files.append(state_graph_file)
+        if not metatile_library.has_level(game, level):
+            # Level processed before the metatile library existed: register its saved unique metatiles
+            level_unique_metatiles_file = level_unique_metatiles_file_format % (player_img, level)
+            if not os.path.exists(level_unique_metatiles_file):
+                error_exit("Missing metatile library entry for %s." % level)
+            metatile_library.register_level(game, level, read_pickle(level_unique_metatiles_file))
 
         if not os.path.exists(metatile_coords_dict_file):
             error_exit("Missing metatile_coords_dict_file for %s." % level)
@@ -40,13 +44,137 @@ def main(game_levels, save_filename, player_img):
 
         level_names.append(level)
 
+    return metatile_coords_dict_files, level_names
+
+
+def check_not_minimized(game_levels, metatile_library):
+    # The metatile states of a minimized level are bisimulation block representatives that only link to the blocks of
+    # the same level (see minimize_state_graph.py), so a minimized level can not be combined with other levels
+    if len(game_levels) < 2:
+        return
+    for game_level in game_levels:
+        game, level = game_level.split('/')
+        if metatile_library.is_minimized(game, level):
+            error_exit("Level %s was processed with --minimize and can not be combined with other levels. Re-run "
+                       "'python main.py <environment> %s %s --process' without --minimize first" %
+                       (game_level, game, level))
+
+
+def add_levels(game_levels, save_filename, player_img):
+    # Adds the given levels to the combined tileset saved as save_filename: existing tile_ids are kept, the levels' new
+    # metatiles get the next tile_ids, only the new levels' adjacencies are added and the prolog file gets a delta
+
+    print("Adding the given levels to combined tileset %s: %s ..." % (save_filename, str(game_levels)))
+
+    combined_tileset_file = get_combined_tileset_file(save_filename, player_img)
+    if not os.path.exists(combined_tileset_file):
+        error_exit("Missing combined tileset for %s. Run 'python combine_constraints.py <game/level> ... "
+                   "--save_filename %s' first" % (save_filename, save_filename))
+    combined_tileset = read_pickle(combined_tileset_file)
+    for game_level in game_levels:
+        if game_level in combined_tileset['game_levels']:
+            error_exit("Level %s is already in combined tileset %s" % (game_level, save_filename))
+
+    metatile_library = MetatileLibrary(player_img)
+    metatile_coords_dict_files, level_names = get_metatile_coords_dict_files(game_levels, player_img, metatile_library)
+    check_not_minimized(combined_tileset['game_levels'] + list(game_levels), metatile_library)
+
+    # Load in the combined tileset files
+    unique_metatiles_file = extract_metatiles.get_unique_metatiles_file(save_filename, player_img)
+    id_metatile_map_file = get_metatile_id_map.get_id_metatile_map_file(player_img, save_filename)
+    metatile_id_map_file = get_metatile_id_map.get_metatile_id_map_file(player_img, save_filename)
+    tile_constraints_file = get_filepath("level_saved_files_%s/metatile_constraints" % player_img,
+                                         "%s.pickle" % save_filename)
+    unique_metatiles = read_pickle(unique_metatiles_file)
+    id_metatile_map = read_pickle(id_metatile_map_file)
+    metatile_id_map = read_pickle(metatile_id_map_file)
+    tile_id_constraints_dict = read_pickle(tile_constraints_file)
+
+    # Tile_ids are numbered in unique_metatiles order (see get_metatile_id_map.py)
+    content_hash_indices = {}  # {metatile content hash: index in unique_metatiles}
+    for i, metatile in enumerate(unique_metatiles):
+        content_hash_indices[metatile.get_content_hash()] = i
+
+    new_tile_ids = []
+    added_adjacencies = {}  # {(tile_id, DIRECTION): [adjacent tile_ids]}
+    for game_level, metatile_coords_dict_file in zip(game_levels, metatile_coords_dict_files):
+        game, level = game_level.split('/')
+        num_tile_ids = len(unique_metatiles)
+
+        # Add the level's metatiles to the tileset
+        for metatile in metatile_library.get_unique_metatiles([(game, level)]):
+            i = content_hash_indices.get(metatile.get_content_hash())
+            if i is None:  # new metatile
+                i = len(unique_metatiles)
+                tile_id = "t%d" % (i + 1)
+                unique_metatiles.append(metatile)
+                content_hash_indices[metatile.get_content_hash()] = i
+                tile_id_constraints_dict[tile_id] = extract_constraints.get_tile_constraints(metatile)
+                metatile_str = metatile.to_str()
+                new_tile_ids.append(tile_id)
+            else:  # existing metatile: add the level to its games and levels (and to its metatile str)
+                tile_id = "t%d" % (i + 1)
+                tile_metatile = unique_metatiles[i]
+                if game not in tile_metatile.games:
+                    tile_metatile.games.append(game)
+                if level not in tile_metatile.levels:
+                    tile_metatile.levels.append(level)
+                tile_id_constraints_dict[tile_id]['games'] = tile_metatile.get_games()
+                tile_id_constraints_dict[tile_id]['levels'] = tile_metatile.get_levels()
+                content_str = extract_constraints.get_metatile_content_str(id_metatile_map[tile_id])
+                metatile_str = "%s, 'games': %s, 'levels': %s}" % (content_str, str(tile_metatile.games),
+                                                                   str(tile_metatile.levels))
+                del metatile_id_map[id_metatile_map[tile_id]]
+            id_metatile_map[tile_id] = metatile_str
+            metatile_id_map[metatile_str] = tile_id
+
+        # Add the level's adjacencies
+        level_coord_tile_ids_map = extract_constraints.get_coord_tile_ids_map(metatile_id_map,
+                                                                              [read_pickle(metatile_coords_dict_file)])
+        level_added_adjacencies = extract_constraints.add_coord_tile_ids_adjacencies(
+            tile_id_constraints_dict, combined_tileset['coord_tile_ids_map'], level_coord_tile_ids_map)
+        for key, adjacent_ids in level_added_adjacencies.items():
+            added_adjacencies[key] = added_adjacencies.get(key, []) + adjacent_ids
+        combined_tileset['game_levels'].append(game_level)
+
+        print("Added %s: %d new metatiles, %d new adjacency pairs" % (
+            level, len(unique_metatiles) - num_tile_ids,
+            sum([len(adjacent_ids) for adjacent_ids in level_added_adjacencies.values()])))
+
+    write_pickle(unique_metatiles_file, unique_metatiles)
+    write_pickle(id_metatile_map_file, id_metatile_map)
+    write_pickle(metatile_id_map_file, metatile_id_map)
+    write_pickle(tile_constraints_file, tile_id_constraints_dict)
+    write_pickle(combined_tileset_file, combined_tileset)
+
+    # Append the prolog statements of the new tiles and adjacencies to the combined prolog file
+    prolog_file, prolog_delta_file, runtime = gen_prolog.add_prolog_delta(tile_constraints_file=tile_constraints_file,
+                                                                          new_tile_ids=new_tile_ids,
+                                                                          added_adjacencies=added_adjacencies,
+                                                                          delta_filename="_".join(level_names))
+
+    return prolog_file
+
+
+def main(game_levels, save_filename, player_img, incremental):
+
+    if incremental:
+        if save_filename is None:
+            error_exit("--save_filename of the combined tileset to add the levels to is required with --incremental")
+        return add_levels(game_levels, save_filename, player_img)
+
+    print("Creating combined tile constraints file for the given levels: %s ..." % str(game_levels))
+
+    metatile_library = MetatileLibrary(player_img)
+    metatile_coords_dict_files, level_names = get_metatile_coords_dict_files(game_levels, player_img, metatile_library)
+    check_not_minimized(game_levels, metatile_library)
+
     save_filename = "_".join(level_names) if save_filename is None else save_filename
 
-    # Get unique metatiles for the combined levels
-    unique_metatiles_file, metatile_coords_dict_file, runtime = extract_metatiles.main(save_filename=save_filename,
-                                                                                       player_img=player_img,
-                                                                                       print_stats=False,
-                                                                                       state_graph_files=state_graph_files)
+    # Get unique metatiles for the combined levels (union of the levels' metatiles in the metatile library)
+    unique_metatiles = metatile_library.get_unique_metatiles([game_level.split('/') for game_level in game_levels])
+    unique_metatiles_file = extract_metatiles.get_unique_metatiles_file(save_filename, player_img)
+    write_pickle(unique_metatiles_file, unique_metatiles)
 
     # Get id_metatile and metatile_id maps for the combined levels
     id_metatile_map_file, metatile_id_map_file, runtime = get_metatile_id_map.main(save_filename=save_filename,
@@ -60,6 +188,12 @@ def main(game_levels, save_filename, player_img):
                                                                   metatile_coords_dict_files=metatile_coords_dict_files,
                                                                   player_img=player_img)
 
+    # Save the combined tileset's coords so that levels can be added to it with --incremental
+    coord_tile_ids_map = extract_constraints.get_coord_tile_ids_map(
+        read_pickle(metatile_id_map_file), [read_pickle(file) for file in metatile_coords_dict_files])
+    write_pickle(get_combined_tileset_file(save_filename, player_img),
+                 {'game_levels': list(game_levels), 'coord_tile_ids_map': coord_tile_ids_map})
+
     # Generate prolog file for the combined level constraints
     prolog_file, runtime = gen_prolog.main(tile_constraints_file=combined_constraints_file, debug=False, print_pl=False, save=True)
 
@@ -71,6 +205,8 @@ if __name__ == "__main__":
     parser.add_argument('game_levels', type=str, nargs='+', help='List of game/level')
     parser.add_argument('--save_filename', type=str, help='File name to save combined tile constraints to', default=None)
     parser.add_argument('--player_img', type=str, help="Player image", default='block')
+    parser.add_argument('--incremental', const=True, nargs='?', type=bool, default=False,
+                        help='Add the given levels to the existing combined tileset --save_filename (keeps its tile_ids)')
     args = parser.parse_args()
 
-    main(args.game_levels, args.save_filename, args.player_img)
+    main(args.game_levels, args.save_filename, args.player_img, args.incremental)
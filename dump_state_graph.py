@@ -4,25 +4,25 @@ Dump info about the precomputed state graph.
 
 # Note: use pypy3 to run; use pip_pypy3 to install third-party packages (e.g. networkx)
 
-import networkx as nx
 import argparse
 
+from model.state_graph import StateGraph
+
 
 def main(state_graph_file, dot):
 
     # Load in state graph
-    state_graph = nx.read_gpickle(state_graph_file)
+    state_graph = StateGraph.read(state_graph_file)
+    states = [state_graph.get_state(node) for node in range(state_graph.num_states())]
 
     if dot:
         print('digraph G {')
         print('  node [ shape="circle" fixedsize="true" width="1" ];')
 
-        nodeids = {}
-        for nodei, node in enumerate(state_graph.nodes):
+        for nodei, state in enumerate(states):
             nodeid = 'n%d' % nodei
-            nodeids[node] = nodeid
 
-            nodedata = eval(node)
+            nodedata = eval(state.to_str())
             nodeattr = ''
             nodeattr += ' pos="%f,%f!"' % (nodedata['x'] / 1.5 + nodedata['movex'] / 6.0, nodedata['y'] / -3.0 + nodedata['movey'] / -8.0)
             nodeattr += ' label="%d,%d;%d,%d"' % (nodedata['x'], nodedata['y'], nodedata['movex'], nodedata['movey'])
@@ -37,23 +37,22 @@ def main(state_graph_file, dot):
 
             print('  %s [%s ];' % (nodeid, nodeattr))
 
-        for edge in state_graph.edges:
-            nodeid0 = nodeids[edge[0]]
-            nodeid1 = nodeids[edge[1]]
-            print('  %s -> %s;' % (nodeid0, nodeid1))
+        for nodei in range(state_graph.num_states()):
+            for next_nodei, action_strs, weight in state_graph.out_edges(nodei):
+                print('  n%d -> n%d;' % (nodei, next_nodei))
 
         print('}')
 
     else:
         # Print
-        for node in state_graph.nodes:
-            print(node)
+        for state in states:
+            print(state.to_str())
 
-        for node in state_graph.nodes:
+        for nodei, state in enumerate(states):
             print()
-            print(node)
-            for edge in state_graph.out_edges(node):
-                print(' ' * 10, '->', ','.join(state_graph.edges[edge]["action"]), '->', edge[1])
+            print(state.to_str())
+            for next_nodei, action_strs, weight in state_graph.out_edges(nodei):
+                print(' ' * 10, '->', ','.join(action_strs), '->', states[next_nodei].to_str())
 
 
 if __name__ == "__main__":
@@ -9,9 +9,15 @@ import networkx as nx
 import re
 import datetime
 import argparse
+import pickle
+import shutil
+import numpy as np
+from math import ceil
+from concurrent.futures import ProcessPoolExecutor
 
-from model.level import Level
-from utils import get_filepath, euclidean_distance
+from model.level import Level, TILE_DIM
+from model.state_graph import StateGraph
+from utils import get_filepath, get_directory, read_pickle, euclidean_distance, error_exit
 
 # game specifics
 if os.getenv('MAZE'):
@@ -19,22 +25,35 @@ if os.getenv('MAZE'):
     from model_maze.player import PlayerMaze as Player
     from model_maze.state import StateMaze as State
     from model_maze.action import ActionMaze as Action
+    from model_maze.grid_player import GridPlayerMaze
 else:
     print('***** USING PLATFORMER RULES *****')
     from model_platformer.player import PlayerPlatformer as Player
     from model_platformer.state import StatePlatformer as State
     from model_platformer.action import ActionPlatformer as Action
+    from model_platformer.transition_cache import TransitionCache
+    from model_platformer.batch_player import BatchPlayerPlatformer
 
+MIN_FRONTIER_BATCH_SIZE = 64
+FRONTIER_BATCHES_PER_WORKER = 4
+CHECKPOINT_FILE = "checkpoint.pickle"
+EDGES_FILE = "edges.pickle"
+DEFAULT_CHECKPOINT_INTERVAL = 10000
+BATCH_PHYSICS_SIZE = 4096
+WINDOW_OVERLAP_TILES = 1  # columns of tiles each enumeration window shares with each of its neighbors
 
-def get_state_graph_file(game_name, level_name, player_img):
-    game_state_graph_directory = "level_saved_files_%s/enumerated_state_graphs/%s" % (player_img, game_name)
-    save_filename = "%s.gpickle" % level_name
+
+def get_state_graph_file(game_name, level_name, player_img, resolution=1):
+    # Coarse (resolution > 1) state graphs are saved apart from the full resolution state graph
+    state_graph_directory = "enumerated_state_graphs" if resolution == 1 else "enumerated_state_graphs_r%d" % resolution
+    game_state_graph_directory = "level_saved_files_%s/%s/%s" % (player_img, state_graph_directory, game_name)
+    save_filename = "%s.csr" % level_name
     state_graph_file = get_filepath(game_state_graph_directory, save_filename)
     return state_graph_file
 
 
 def parse_state_graph_filename(state_graph_file):
-    match = re.match(r'level_saved_files_[^/]+/enumerated_state_graphs/([^/]+)/([a-zA-Z0-9_-]+).gpickle', state_graph_file)
+    match = re.match(r'level_saved_files_[^/]+/(?:enumerated|minimized)_state_graphs(?:_r\d+)?/([^/]+)/([a-zA-Z0-9_-]+)\.(csr|gpickle)', state_graph_file)
     game = match.group(1)
     level = match.group(2)
     return {
@@ -47,54 +66,653 @@ def get_action_set():
     return Action.allActions()
 
 
+def get_next_state_edges(player_model, cur_state_key, action_set, action_strs):
+    # Returns [(next_state_key, [action_strs], distance)] for the distinct next states of cur_state_key. Only one
+    # action of each class of equivalent actions is simulated; the others are aliased to its next state.
+    cur_state = State.from_key(cur_state_key)
+    next_state_keys = [None] * len(action_set)
+    for action_class in player_model.get_action_classes(cur_state, action_set):
+        next_state_key = player_model.next_state(state=cur_state, action=action_set[action_class[0]]).to_key()
+        for action_index in action_class:
+            next_state_keys[action_index] = next_state_key
+    return group_next_state_edges(cur_state_key, next_state_keys, action_strs)
+
+
+def group_next_state_edges(cur_state_key, next_state_keys, action_strs):
+    # Groups the next state key of each action into [(next_state_key, [action_strs], distance)], in the order the
+    # next states are first reached (x and y are the first two fields of a state key)
+    next_state_actions = {}  # {next_state_key: [action_strs]}
+    for next_state_key, action_str in zip(next_state_keys, action_strs):
+        if next_state_actions.get(next_state_key) is None:
+            next_state_actions[next_state_key] = [action_str]
+        else:
+            next_state_actions[next_state_key].append(action_str)
+
+    next_state_edges = []
+    for next_state_key, next_actions in next_state_actions.items():
+        distance = euclidean_distance(cur_state_key[:2], next_state_key[:2])
+        next_state_edges.append((next_state_key, next_actions, distance))
+    return next_state_edges
+
+
 def enumerate_states(player_model, start_state, graph, action_set):
-    start_state_str = start_state.to_str()
-    graph.add_node(start_state_str)
+    # States are tracked by their compact key (State.to_key) during enumeration; the string form is only
+    # produced when the saved graph is read back as a networkx graph (see StateGraph.to_nx_graph)
+    action_strs = [action.to_str() for action in action_set]
 
-    unexplored_states = set([start_state_str])
+    start_state_key = start_state.to_key()
+    graph.add_node(start_state_key)
+
+    unexplored_states = set([start_state_key])
     explored_states = set()
 
     while len(unexplored_states) > 0:
-        cur_state_str = unexplored_states.pop()
-        explored_states.add(cur_state_str)
+        cur_state_key = unexplored_states.pop()
+        explored_states.add(cur_state_key)
+
+        for next_state_key, next_actions, distance in get_next_state_edges(player_model, cur_state_key,
+                                                                           action_set, action_strs):
+            if next_state_key not in explored_states and next_state_key not in unexplored_states:
+                graph.add_node(next_state_key)
+                unexplored_states.add(next_state_key)
+            graph.add_edge(cur_state_key, next_state_key, weight=distance, action=next_actions)
+
+    print('graph size:', len(graph.nodes), len(graph.edges))
+    return graph
+
+
+# Player model of each enumeration worker process (set once per worker by init_enumeration_worker)
+worker_player_model = None
+
+
+def init_enumeration_worker(player_img, level_obj, resolution):
+    global worker_player_model
+    worker_player_model = Player(player_img, level_obj)
+    if resolution > 1:
+        worker_player_model.resolution = resolution
+
 
-        cur_state = State.from_str(cur_state_str)
+def expand_frontier_batch(state_keys):
+    # Runs in a worker process: returns [(state_key, next_state_edges)] for each state key in the batch
+    action_set = get_action_set()
+    action_strs = [action.to_str() for action in action_set]
+    return [(state_key, get_next_state_edges(worker_player_model, state_key, action_set, action_strs))
+            for state_key in state_keys]
+
+
+def get_frontier_batches(frontier, workers):
+    # Split the frontier into a few batches per worker so that slow batches do not leave workers idle
+    batch_size = max(MIN_FRONTIER_BATCH_SIZE, ceil(len(frontier) / (workers * FRONTIER_BATCHES_PER_WORKER)))
+    return [frontier[i:i + batch_size] for i in range(0, len(frontier), batch_size)]
+
+
+def enumerate_states_parallel(player_img, level_obj, start_state, graph, workers, resolution=1):
+    # Breadth-first enumeration: each frontier is expanded by the worker pool and the discovered states are
+    # deduplicated in this (parent) process to form the next frontier. The level and player model are shipped
+    # once per worker through the pool initializer.
+    start_state_key = start_state.to_key()
+    graph.add_node(start_state_key)
+
+    frontier = [start_state_key]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_enumeration_worker,
+                             initargs=(player_img, level_obj, resolution)) as executor:
+        while len(frontier) > 0:
+            next_frontier = []
+            for batch_results in executor.map(expand_frontier_batch, get_frontier_batches(frontier, workers)):
+                for cur_state_key, next_state_edges in batch_results:
+                    for next_state_key, next_actions, distance in next_state_edges:
+                        if next_state_key not in graph:
+                            graph.add_node(next_state_key)
+                            next_frontier.append(next_state_key)
+                        graph.add_edge(cur_state_key, next_state_key, weight=distance, action=next_actions)
+            frontier = next_frontier
+
+    print('graph size:', len(graph.nodes), len(graph.edges))
+    return graph
+
+
+def enumerate_states_batched(batch_player_model, start_state, graph, action_set):
+    # Breadth-first enumeration that computes the next states of each frontier (in batches of up to
+    # BATCH_PHYSICS_SIZE states) with the vectorized platformer physics (see BatchPlayerPlatformer)
+    action_strs = [action.to_str() for action in action_set]
 
-        for action in action_set:
-            next_state = player_model.next_state(state=cur_state, action=action)
-            next_state_str = next_state.to_str()
-            if next_state_str not in explored_states and next_state_str not in unexplored_states:
-                graph.add_node(next_state_str)
-                unexplored_states.add(next_state_str)
+    start_state_key = start_state.to_key()
+    graph.add_node(start_state_key)
 
-            if not graph.has_edge(cur_state_str, next_state_str):
-                distance = euclidean_distance((cur_state.x, cur_state.y), (next_state.x, next_state.y))
-                graph.add_edge(cur_state_str, next_state_str, weight=distance, action=[action.to_str()])
-            else:
-                graph.get_edge_data(cur_state_str, next_state_str)["action"].append(action.to_str())
+    frontier = [start_state_key]
+
+    while len(frontier) > 0:
+        next_frontier = []
+        for i in range(0, len(frontier), BATCH_PHYSICS_SIZE):
+            state_keys = frontier[i:i + BATCH_PHYSICS_SIZE]
+            for cur_state_key, next_state_keys in zip(state_keys, batch_player_model.next_state_keys(state_keys)):
+                for next_state_key, next_actions, distance in group_next_state_edges(cur_state_key, next_state_keys,
+                                                                                     action_strs):
+                    if next_state_key not in graph:
+                        graph.add_node(next_state_key)
+                        next_frontier.append(next_state_key)
+                    graph.add_edge(cur_state_key, next_state_key, weight=distance, action=next_actions)
+        frontier = next_frontier
 
     print('graph size:', len(graph.nodes), len(graph.edges))
     return graph
 
 
-def build_state_graph(player_img, level_obj, state_graph_file):
+def enumerate_states_grid(grid_player_model, start_state, graph, action_set):
+    # Maze enumeration with the next states of every reachable state computed from the level's tile grid at once
+    # (see GridPlayerMaze)
+    action_strs = [action.to_str() for action in action_set]
+    for cur_state_key, next_state_keys in grid_player_model.get_state_transitions(start_state).items():
+        graph.add_node(cur_state_key)
+        for next_state_key, next_actions, distance in group_next_state_edges(cur_state_key, next_state_keys,
+                                                                             action_strs):
+            graph.add_edge(cur_state_key, next_state_key, weight=distance, action=next_actions)
+
+    print('graph size:', len(graph.nodes), len(graph.edges))
+    return graph
+
+
+def get_window_index(state_key, window_width):
+    # Windows are fixed-width column ranges of the level; a state belongs to the window containing its x coord
+    # (x is the first field of both platformer and maze state keys)
+    return state_key[0] // window_width
+
+
+def is_in_window(state_key, window, window_width):
+    # Windows overlap their neighbors by WINDOW_OVERLAP_TILES tiles on each side: a window also expands the states in
+    # the overlap, so moving back and forth across a window boundary does not take a stitching round per crossing
+    min_x = window * window_width - WINDOW_OVERLAP_TILES * TILE_DIM
+    max_x = (window + 1) * window_width + WINDOW_OVERLAP_TILES * TILE_DIM
+    return min_x <= state_key[0] < max_x
+
+
+def get_windows_dir(state_graph_file):
+    return "%s_windows" % os.path.splitext(state_graph_file)[0]
+
+
+def get_window_files(windows_dir, window):
+    # Returns (explored states file, edge stream file) of the window
+    return (os.path.join(windows_dir, "window_%d_explored.pickle" % window),
+            os.path.join(windows_dir, "window_%d_edges.pickle" % window))
+
+
+def enumerate_window(player_model, window, window_width, seed_state_keys, windows_dir, action_set):
+    # Expands the states in the window (overlap included) reachable from the seeds that the window has not expanded
+    # yet. The window's explored states are kept in windows_dir between stitching rounds and its edges are appended
+    # to the window's edge stream (see read_edge_stream), as [(state_key, next_state_key, [action_strs], distance)].
+    # Edges that leave the window are kept and their dest states are returned as exit states, so the windows that
+    # own them can expand them.
+    action_strs = [action.to_str() for action in action_set]
+    explored_states_file, edges_file = get_window_files(windows_dir, window)
+
+    explored_states = set()
+    if os.path.exists(explored_states_file):
+        explored_states = read_pickle(explored_states_file)
+
+    unexplored_states = set([state_key for state_key in seed_state_keys if state_key not in explored_states])
+    edges = []
+    exit_states = set()
+
+    while len(unexplored_states) > 0:
+        cur_state_key = unexplored_states.pop()
+        explored_states.add(cur_state_key)
+
+        for next_state_key, next_actions, distance in get_next_state_edges(player_model, cur_state_key,
+                                                                           action_set, action_strs):
+            edges.append((cur_state_key, next_state_key, next_actions, distance))
+            if not is_in_window(next_state_key, window, window_width):
+                exit_states.add(next_state_key)
+            elif next_state_key not in explored_states and next_state_key not in unexplored_states:
+                unexplored_states.add(next_state_key)
+
+    with open(edges_file, 'ab') as file:
+        pickle.dump(edges, file, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(explored_states_file, 'wb') as file:
+        pickle.dump(explored_states, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return exit_states
+
+
+def expand_window(window_job):
+    # Runs in a worker process: enumerates one window (see enumerate_window)
+    window, window_width, seed_state_keys, windows_dir = window_job
+    return window, enumerate_window(worker_player_model, window, window_width, seed_state_keys, windows_dir,
+                                    get_action_set())
+
+
+def enumerate_states_windowed(player_img, level_obj, player_model, start_state, graph, window_width, workers,
+                              windows_dir, resolution=1):
+    # Enumerates the level one overlapping column window at a time, then stitches the windows together: states that
+    # leave a window seed another round of enumeration in the window that owns them. Every state is expanded by each
+    # window it is reached in, so the stitched graph is the same as the monolithic one (states in an overlap can be
+    # expanded by both windows, which gives the same edges twice). Between rounds, the windows' explored states and
+    # edges are kept in windows_dir, so each enumeration only holds one window's states and the stitching only holds
+    # the seeds. The graph is built from the windows' edge streams. With workers > 1, the windows of a round run in
+    # parallel.
+    start_state_key = start_state.to_key()
+    get_directory(windows_dir)
+    for window_file in os.listdir(windows_dir):  # left over from an interrupted run
+        os.remove(os.path.join(windows_dir, window_file))
+
+    window_seeds = {get_window_index(start_state_key, window_width): set([start_state_key])}  # {window: {keys}}
+    windows = set()
+    num_rounds = 0
+
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_enumeration_worker,
+                                       initargs=(player_img, level_obj, resolution))
+
+    while len(window_seeds) > 0:
+        window_jobs = []
+        for window in sorted(window_seeds.keys()):
+            window_jobs.append((window, window_width, window_seeds[window], windows_dir))
+            windows.add(window)
+        window_seeds = {}
+        num_rounds += 1
+
+        if executor is None:
+            window_results = [(window_job[0], enumerate_window(player_model, *window_job, get_action_set()))
+                              for window_job in window_jobs]
+        else:
+            window_results = executor.map(expand_window, window_jobs)
+
+        for window, exit_states in window_results:
+            for exit_state_key in exit_states:
+                exit_window = get_window_index(exit_state_key, window_width)
+                if window_seeds.get(exit_window) is None:
+                    window_seeds[exit_window] = set()
+                window_seeds[exit_window].add(exit_state_key)
+
+    if executor is not None:
+        executor.shutdown()
+
+    graph.add_node(start_state_key)
+    for window in sorted(windows):
+        explored_states_file, edges_file = get_window_files(windows_dir, window)
+        for cur_state_key, next_state_key, next_actions, distance in read_edge_stream(edges_file):
+            graph.add_edge(cur_state_key, next_state_key, weight=distance, action=next_actions)
+
+    print('windows: %d, stitching rounds: %d' % (len(windows), num_rounds))
+    print('graph size:', len(graph.nodes), len(graph.edges))
+    return graph
+
+
+def get_checkpoint_dir(state_graph_file):
+    return "%s_checkpoint" % os.path.splitext(state_graph_file)[0]
+
+
+def read_edge_stream(edges_file):
+    # The edge stream is a sequence of pickled batches of (state_key, next_state_key, [action_strs], distance)
+    with open(edges_file, 'rb') as file:
+        while True:
+            try:
+                edges = pickle.load(file)
+            except EOFError:
+                break
+            for edge in edges:
+                yield edge
+
+
+def write_checkpoint(checkpoint_dir, edge_stream, pending_edges, explored_states, unexplored_states):
+    # Append the pending edges to the edge stream before replacing the checkpoint, so that a checkpoint always
+    # refers to a fully written prefix of the edge stream
+    pickle.dump(pending_edges, edge_stream, protocol=pickle.HIGHEST_PROTOCOL)
+    edge_stream.flush()
+    os.fsync(edge_stream.fileno())
+
+    checkpoint = {
+        "explored_states": explored_states,
+        "unexplored_states": unexplored_states,
+        "edges_file_size": edge_stream.tell()
+    }
+    checkpoint_file = os.path.join(checkpoint_dir, CHECKPOINT_FILE)
+    with open(checkpoint_file + ".tmp", 'wb') as file:
+        pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(checkpoint_file + ".tmp", checkpoint_file)
+    print("checkpoint: %d explored, %d unexplored" % (len(explored_states), len(unexplored_states)))
+
+
+def enumerate_states_checkpointed(player_model, start_state, graph, action_set, checkpoint_dir, checkpoint_interval,
+                                  resume):
+    # Same search as enumerate_states, but edges are streamed to an append-only file instead of kept in memory, and
+    # the explored and unexplored states are checkpointed every checkpoint_interval expanded states. With resume,
+    # the search continues from the last checkpoint in checkpoint_dir. The graph is built from the edge stream.
+    action_strs = [action.to_str() for action in action_set]
+    checkpoint_file = os.path.join(checkpoint_dir, CHECKPOINT_FILE)
+    edges_file = os.path.join(checkpoint_dir, EDGES_FILE)
+    get_directory(checkpoint_dir)
+
+    if resume and os.path.exists(checkpoint_file):
+        checkpoint = read_pickle(checkpoint_file)
+        explored_states = checkpoint['explored_states']
+        unexplored_states = checkpoint['unexplored_states']
+        # Drop edges written after the last checkpoint; their states are expanded again
+        with open(edges_file, 'ab') as file:
+            file.truncate(checkpoint['edges_file_size'])
+        print("Resuming from checkpoint: %d explored, %d unexplored" % (len(explored_states),
+                                                                        len(unexplored_states)))
+    else:
+        if resume:
+            print("No checkpoint found in %s, starting from the start state" % checkpoint_dir)
+        explored_states = set()
+        unexplored_states = set([start_state.to_key()])
+        open(edges_file, 'wb').close()
+
+    with open(edges_file, 'ab') as edge_stream:
+        pending_edges = []
+        num_expanded = 0
+
+        while len(unexplored_states) > 0:
+            cur_state_key = unexplored_states.pop()
+            explored_states.add(cur_state_key)
+
+            for next_state_key, next_actions, distance in get_next_state_edges(player_model, cur_state_key,
+                                                                               action_set, action_strs):
+                if next_state_key not in explored_states and next_state_key not in unexplored_states:
+                    unexplored_states.add(next_state_key)
+                pending_edges.append((cur_state_key, next_state_key, next_actions, distance))
+
+            num_expanded += 1
+            if num_expanded % checkpoint_interval == 0:
+                write_checkpoint(checkpoint_dir, edge_stream, pending_edges, explored_states, unexplored_states)
+                pending_edges = []
+
+        write_checkpoint(checkpoint_dir, edge_stream, pending_edges, explored_states, unexplored_states)
+
+    graph.add_node(start_state.to_key())
+    for cur_state_key, next_state_key, next_actions, distance in read_edge_stream(edges_file):
+        graph.add_edge(cur_state_key, next_state_key, weight=distance, action=next_actions)
+
+    print('graph size:', len(graph.nodes), len(graph.edges))
+    return graph
+
+
+def collapse_terminal_states(state_graph, action_strs):
+    # Maps every terminal state onto its canonical sink (see State.get_sink_key). Edges into merged states are merged
+    # (with the union of their actions) and re-weighted by the distance to the sink.
+    collapsed_graph = nx.DiGraph()
+    for state_key in state_graph.nodes():
+        collapsed_graph.add_node(State.get_sink_key(state_key))
+
+    for state_key, next_state_key, edge_data in state_graph.edges(data=True):
+        src_key = State.get_sink_key(state_key)
+        dest_key = State.get_sink_key(next_state_key)
+        if collapsed_graph.has_edge(src_key, dest_key):
+            edge_actions = set(collapsed_graph.edges[src_key, dest_key]['action'] + edge_data['action'])
+            collapsed_graph.edges[src_key, dest_key]['action'] = [action_str for action_str in action_strs
+                                                                   if action_str in edge_actions]
+        else:
+            collapsed_graph.add_edge(src_key, dest_key, weight=euclidean_distance(src_key[:2], dest_key[:2]),
+                                     action=list(edge_data['action']))
+
+    print('collapsed terminal states, graph size:', len(collapsed_graph.nodes), len(collapsed_graph.edges))
+    return collapsed_graph
+
+
+def build_state_graph(player_img, level_obj, state_graph_file, use_transition_cache=False, workers=1,
+                      window_tiles=0, checkpoint_interval=0, resume=False, batch_physics=False,
+                      collapse_terminal=False, resolution=1, grid_bfs=False):
     player_model = Player(player_img, level_obj)
+
+    if resolution < 1:
+        error_exit("--resolution must be at least 1")
+    if resolution > 1:
+        if os.getenv('MAZE'):
+            error_exit("coarse resolution enumeration is only supported for platformer rules")
+        # Snapping to a lattice finer than the moves only perturbs the states (and enumerates more of them)
+        move_quantum = player_model.get_move_quantum()
+        if resolution % move_quantum != 0:
+            error_exit("--resolution must be a multiple of %d for %s (%d px steps, %d px gravity)" %
+                       (move_quantum, level_obj.get_game(), player_model.steps, player_model.gravity))
+        player_model.resolution = resolution
+
+    if workers < 1:
+        error_exit("--workers must be at least 1")
+
+    if resume and checkpoint_interval <= 0:
+        checkpoint_interval = DEFAULT_CHECKPOINT_INTERVAL
+    if checkpoint_interval > 0 and (workers > 1 or window_tiles > 0):
+        error_exit("checkpointed enumeration is only supported for single process, non-windowed enumeration")
+
+    if batch_physics:
+        if os.getenv('MAZE'):
+            error_exit("batch physics is only supported for platformer rules")
+        if workers > 1 or window_tiles > 0 or checkpoint_interval > 0 or use_transition_cache:
+            error_exit("batch physics can not be combined with --workers, --window_tiles, checkpoints or the "
+                       "transition cache")
+
+    if grid_bfs:
+        if not os.getenv('MAZE'):
+            error_exit("grid enumeration is only supported for maze rules")
+        if workers > 1 or window_tiles > 0 or checkpoint_interval > 0:
+            error_exit("grid enumeration can not be combined with --workers, --window_tiles or checkpoints")
+
+    # Reuse the transitions saved from previously enumerated levels with the same physics params
+    if use_transition_cache:
+        if os.getenv('MAZE'):
+            error_exit("transition cache is only supported for platformer rules")
+        if workers > 1:
+            error_exit("transition cache is only supported for single process enumeration (--workers 1)")
+        player_model.transition_cache = TransitionCache.load(player_img, player_model.get_physics_params_key())
+
     start_state = player_model.get_start_state()
     action_set = get_action_set()
-    state_graph = enumerate_states(player_model=player_model, start_state=start_state, graph=nx.DiGraph(),
-                                   action_set=action_set)
-    nx.write_gpickle(state_graph, state_graph_file)
-    print("Saved to:", state_graph_file)
+    if grid_bfs:
+        state_graph = enumerate_states_grid(grid_player_model=GridPlayerMaze(player_model, action_set),
+                                            start_state=start_state, graph=nx.DiGraph(), action_set=action_set)
+    elif batch_physics:
+        state_graph = enumerate_states_batched(batch_player_model=BatchPlayerPlatformer(player_model),
+                                               start_state=start_state, graph=nx.DiGraph(), action_set=action_set)
+    elif window_tiles > 0:
+        state_graph = enumerate_states_windowed(player_img=player_img, level_obj=level_obj, player_model=player_model,
+                                                start_state=start_state, graph=nx.DiGraph(),
+                                                window_width=window_tiles * TILE_DIM, workers=workers,
+                                                windows_dir=get_windows_dir(state_graph_file), resolution=resolution)
+    elif checkpoint_interval > 0:
+        state_graph = enumerate_states_checkpointed(player_model=player_model, start_state=start_state,
+                                                    graph=nx.DiGraph(), action_set=action_set,
+                                                    checkpoint_dir=get_checkpoint_dir(state_graph_file),
+                                                    checkpoint_interval=checkpoint_interval, resume=resume)
+    elif workers > 1:
+        state_graph = enumerate_states_parallel(player_img=player_img, level_obj=level_obj, start_state=start_state,
+                                                graph=nx.DiGraph(), workers=workers, resolution=resolution)
+    else:
+        state_graph = enumerate_states(player_model=player_model, start_state=start_state, graph=nx.DiGraph(),
+                                       action_set=action_set)
+    action_strs = [action.to_str() for action in action_set]
+    if collapse_terminal:
+        state_graph = collapse_terminal_states(state_graph, action_strs)
+    StateGraph.from_key_graph(state_graph, action_strs).write(state_graph_file)
+
+    # The saved state graph supersedes the checkpoint (and the windows' explored states and edges)
+    if checkpoint_interval > 0:
+        shutil.rmtree(get_checkpoint_dir(state_graph_file))
+    if window_tiles > 0:
+        shutil.rmtree(get_windows_dir(state_graph_file))
+
+    if use_transition_cache:
+        print(player_model.transition_cache.get_stats_str())
+        player_model.transition_cache.save(player_img)
+
+
+def find_mirrored_level(level_obj, player_img, resolution=1):
+    # Returns the name of an already enumerated level of the same game that is the horizontal mirror of level_obj
+    game_state_graph_directory = os.path.dirname(get_state_graph_file(level_obj.get_game(), level_obj.get_name(),
+                                                                      player_img, resolution))
+    for state_graph_filename in sorted(os.listdir(game_state_graph_directory)):
+        level_name, ext = os.path.splitext(state_graph_filename)
+        if ext != ".csr" or level_name == level_obj.get_name():
+            continue
+        if not os.path.exists("level_structural_layers/%s/%s.txt" % (level_obj.get_game(), level_name)):
+            continue
+        if level_obj.is_mirror_of(Level.generate_level_from_file(level_obj.get_game(), level_name)):
+            return level_name
+    return None
+
+
+def mirror_state_graph(state_graph, level_width):
+    # Reflects every state about the level's vertical center line and swaps the left and right actions. The
+    # platformer physics is symmetric in x, so this is the state graph of the mirrored level (nodes keep their order,
+    # so the start state stays node 0, and edge weights are unchanged).
+    action_set = get_action_set()
+    mirror_action_strs = {}
+    for action in action_set:
+        mirror_action_strs[action.to_str()] = action.mirror().to_str()
+    mirror_action_bits = [state_graph.action_strs.index(mirror_action_strs[action_str])
+                          for action_str in state_graph.action_strs]
+    mirror_action_bitmasks = np.zeros(256, dtype=np.uint8)
+    for action_bitmask in range(256):
+        for i, mirror_bit in enumerate(mirror_action_bits):
+            if action_bitmask & (1 << i):
+                mirror_action_bitmasks[action_bitmask] |= 1 << mirror_bit
+
+    states = np.array([State.key_to_row(State.get_mirror_key(state_graph.get_state_key(node), level_width))
+                       for node in range(state_graph.num_states())], dtype=np.int32)
+    states = states.reshape((state_graph.num_states(), len(state_graph.state_fields)))
+    return StateGraph(list(state_graph.state_fields), list(state_graph.action_strs), states,
+                      np.array(state_graph.offsets), np.array(state_graph.targets),
+                      mirror_action_bitmasks[np.asarray(state_graph.actions)], np.array(state_graph.weights))
+
+
+def repair_mirrored_state_graph(player_model, key_graph, action_set):
+    # The physics is mirror symmetric except for tie breaks at exact tile boundaries: which side of a bonus tile was
+    # hit, and kid icarus wrapping. Re-simulates the states whose transitions can depend on those (states that hit a
+    # bonus tile or can wrap), enumerates any states the new transitions reach, and drops the states that are no
+    # longer reachable from the start state.
+    action_strs = [action.to_str() for action in action_set]
+    start_state_key = next(iter(key_graph.nodes()))
+    frontier = []
+    for state_key in list(key_graph.nodes()):
+        hits_bonus = any([State.from_key(next_state_key).hit_bonus_coord != ''
+                          for next_state_key in key_graph.adj[state_key]])
+        if hits_bonus or player_model.can_wrap(State.from_key(state_key)):
+            key_graph.remove_edges_from(list(key_graph.out_edges(state_key)))
+            frontier.append(state_key)
+
+    num_resimulated_states = 0
+    while len(frontier) > 0:
+        cur_state_key = frontier.pop()
+        num_resimulated_states += 1
+        for next_state_key, next_actions, distance in get_next_state_edges(player_model, cur_state_key, action_set,
+                                                                           action_strs):
+            if next_state_key not in key_graph:
+                key_graph.add_node(next_state_key)
+                frontier.append(next_state_key)
+            key_graph.add_edge(cur_state_key, next_state_key, weight=distance, action=next_actions)
+
+    unreachable_state_keys = set(key_graph.nodes()) - nx.descendants(key_graph, start_state_key) - {start_state_key}
+    key_graph.remove_nodes_from(unreachable_state_keys)
+    print("re-simulated %d states, removed %d unreachable states" % (num_resimulated_states,
+                                                                     len(unreachable_state_keys)))
+    return key_graph
+
 
+def build_mirrored_state_graph(player_img, level_obj, mirror_of_state_graph_file, state_graph_file, resolution=1,
+                               collapse_terminal=False):
+    if os.getenv('MAZE'):
+        error_exit("mirrored state graphs are only supported for platformer rules")
+    if level_obj.get_width() % resolution != 0:
+        error_exit("the level width must be a multiple of --resolution to mirror a state graph")
+    if not os.path.exists(mirror_of_state_graph_file):
+        error_exit("Missing state graph of the mirrored level: %s" % mirror_of_state_graph_file)
 
-def main(game_name, level_name, player_img):
+    print("Mirroring state graph: %s" % mirror_of_state_graph_file)
+    state_graph = mirror_state_graph(StateGraph.read(mirror_of_state_graph_file), level_obj.get_width())
+
+    # The player's start position is offset from the left edge of the start tile, so only players as wide as a tile
+    # start at the mirror of the other level's start state
+    player_model = Player(player_img, level_obj)
+    player_model.resolution = resolution
+    start_state_key = player_model.get_start_state().to_key()
+    if state_graph.get_state_key(0) != start_state_key:
+        error_exit("The start state %s is not the mirror of the start state of %s (player %s is not symmetric about "
+                   "the start tile); enumerate the level instead" % (str(start_state_key), mirror_of_state_graph_file,
+                                                                      player_img))
+
+    action_set = get_action_set()
+    key_graph = repair_mirrored_state_graph(player_model, state_graph.to_key_graph(), action_set)
+    action_strs = [action.to_str() for action in action_set]
+    if collapse_terminal:
+        key_graph = collapse_terminal_states(key_graph, action_strs)
+    print('graph size:', len(key_graph.nodes), len(key_graph.edges))
+    StateGraph.from_key_graph(key_graph, action_strs).write(state_graph_file)
+
+
+def get_tile_reachability(state_graph):
+    # Returns {reachability: set of (tile_x, tile_y)} for the tiles of a state graph's states
+    state_fields = state_graph.state_fields
+    tile_reachability = {'reachable': set(), 'onground': set(), 'goal_reached': set(), 'hit_bonus': set()}
+    for row in state_graph.states.tolist():
+        tile = (int(row[state_fields.index('x')] / TILE_DIM), int(row[state_fields.index('y')] / TILE_DIM))
+        tile_reachability['reachable'].add(tile)
+        if row[state_fields.index('onground')]:
+            tile_reachability['onground'].add(tile)
+        if row[state_fields.index('goal_reached')]:
+            tile_reachability['goal_reached'].add(tile)
+        if row[state_fields.index('hit_bonus_coord')]:
+            tile_reachability['hit_bonus'].add(tile)
+    return tile_reachability
+
+
+def print_reachability_diff(full_state_graph_file, state_graph_file):
+    # Compares the tiles reachable in a coarse resolution state graph with the full resolution state graph
+    if not os.path.exists(full_state_graph_file):
+        print("No full resolution state graph to compare reachability with (%s)" % full_state_graph_file)
+        return
+
+    full_state_graph = StateGraph.read(full_state_graph_file)
+    state_graph = StateGraph.read(state_graph_file)
+    print("----- Reachability Diff (vs. full resolution) -----")
+    print("states: %d (full resolution: %d)" % (state_graph.num_states(), full_state_graph.num_states()))
+    print("edges: %d (full resolution: %d)" % (state_graph.num_edges(), full_state_graph.num_edges()))
+
+    full_tile_reachability = get_tile_reachability(full_state_graph)
+    tile_reachability = get_tile_reachability(state_graph)
+    extra_reachabilities = []
+    for reachability, full_tiles in full_tile_reachability.items():
+        tiles = tile_reachability[reachability]
+        print("%s tiles: %d (full resolution: %d, missing: %s, extra: %s)" % (
+            reachability, len(tiles), len(full_tiles), sorted(full_tiles - tiles), sorted(tiles - full_tiles)))
+        if len(tiles - full_tiles) > 0:
+            extra_reachabilities.append(reachability)
+
+    # Snapping can move the player further than the physics does, so the coarse graph can over-approximate
+    if state_graph.num_states() >= full_state_graph.num_states():
+        print("WARNING: the coarse state graph is not smaller than the full resolution state graph")
+    if len(extra_reachabilities) > 0:
+        print("WARNING: the coarse state graph has %s tiles that the full resolution state graph does not have" %
+              ", ".join(extra_reachabilities))
+
+
+def main(game_name, level_name, player_img, use_transition_cache=False, workers=1, window_tiles=0,
+         checkpoint_interval=0, resume=False, batch_physics=False, collapse_terminal=False, resolution=1,
+         mirror_of=None, detect_mirror=False, grid_bfs=False):
 
     start_time = datetime.datetime.now()
     print("\nEnumerating states for level: " + str(level_name) + " ...")
 
     level_obj = Level.generate_level_from_file(game_name, level_name)
-    state_graph_file = get_state_graph_file(game_name, level_name, player_img)
-    build_state_graph(player_img, level_obj, state_graph_file)
+    state_graph_file = get_state_graph_file(game_name, level_name, player_img, resolution)
+
+    # Reuse the state graph of a level this level mirrors instead of enumerating it
+    if mirror_of is None and detect_mirror and not os.getenv('MAZE'):
+        mirror_of = find_mirrored_level(level_obj, player_img, resolution)
+    if mirror_of is not None:
+        if not level_obj.is_mirror_of(Level.generate_level_from_file(game_name, mirror_of)):
+            error_exit("%s is not a mirror of %s" % (level_name, mirror_of))
+        build_mirrored_state_graph(player_img, level_obj, get_state_graph_file(game_name, mirror_of, player_img,
+                                                                               resolution), state_graph_file,
+                                   resolution, collapse_terminal)
+    else:
+        build_state_graph(player_img, level_obj, state_graph_file, use_transition_cache, workers, window_tiles,
+                          checkpoint_interval, resume, batch_physics, collapse_terminal, resolution, grid_bfs)
+
+    if resolution > 1:
+        print_reachability_diff(get_state_graph_file(game_name, level_name, player_img), state_graph_file)
 
     end_time = datetime.datetime.now()
     runtime = str(end_time - start_time)
@@ -107,6 +725,32 @@ if __name__ == "__main__":
     parser.add_argument('game', type=str, help='Name of the game')
     parser.add_argument('level', type=str, help='Name of the level')
     parser.add_argument('--player_img', type=str, help='Player image', default='block')
+    parser.add_argument('--use_transition_cache', const=True, nargs='?', type=bool, default=False,
+                        help='Load/save cached transitions shared by levels with the same physics params')
+    parser.add_argument('--workers', type=int, help='Number of processes used to expand the enumeration frontier',
+                        default=1)
+    parser.add_argument('--window_tiles', type=int, default=0,
+                        help='Enumerate the level in column windows of this many tiles and stitch them together')
+    parser.add_argument('--checkpoint_interval', type=int, default=0,
+                        help='Checkpoint the enumeration every this many expanded states (streams edges to disk)')
+    parser.add_argument('--resume', const=True, nargs='?', type=bool, default=False,
+                        help='Resume enumeration from the last checkpoint')
+    parser.add_argument('--batch_physics', const=True, nargs='?', type=bool, default=False,
+                        help='Compute the next states of each frontier with vectorized (numpy) platformer physics')
+    parser.add_argument('--collapse_terminal', const=True, nargs='?', type=bool, default=False,
+                        help='Collapse goal reached and dead states onto one sink state per tile')
+    parser.add_argument('--resolution', type=int, default=1,
+                        help='Snap player positions to a lattice of this many pixels (a multiple of the game\'s steps '
+                             'and gravity, e.g. 10, 20 or 40 for super_mario_bros) to enumerate fewer states')
+    parser.add_argument('--mirror_of', type=str, default=None,
+                        help='Mirror the state graph of this (already enumerated) level instead of enumerating')
+    parser.add_argument('--detect_mirror', const=True, nargs='?', type=bool, default=False,
+                        help='Mirror the state graph of an already enumerated level if this level is its mirror')
+    parser.add_argument('--grid_bfs', const=True, nargs='?', type=bool, default=False,
+                        help='Enumerate maze states with array operations over the level tile grid (maze rules only)')
     args = parser.parse_args()
 
-    main(args.game, args.level, args.player_img)
+    main(args.game, args.level, args.player_img, args.use_transition_cache, args.workers, args.window_tiles,
+         args.checkpoint_interval, args.resume, args.batch_physics, args.collapse_terminal,
+         args.resolution, args.mirror_of, args.detect_mirror,
+         args.grid_bfs)
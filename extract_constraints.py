@@ -24,68 +24,134 @@ DIRECTIONS = [LEFT, RIGHT, TOP, BOTTOM, TOP_LEFT, BOTTOM_LEFT, TOP_RIGHT, BOTTOM
 # # [ ] [B] [ ]
 
 
-def get_coord_metatiles_dict(metatile_coords_dicts):
-    # Get all metatiles at each coord
-    coord_metatiles_dict_tmp = {}
-    for metatile_coord_dict in metatile_coords_dicts:
-        for metatile_str, coords in metatile_coord_dict.items():
-            metatile = Metatile.from_str(metatile_str)
-            for coord in coords:
-                if coord_metatiles_dict_tmp.get(coord) is None:
-                    coord_metatiles_dict_tmp[coord] = []
-                coord_metatiles_dict_tmp[coord].append(metatile)
-
-    # Remove duplicate metatiles
-    coord_metatiles_dict = {}
-    for coord, metatiles in coord_metatiles_dict_tmp.items():
-        coord_metatiles_dict[coord] = Metatile.get_unique_metatiles(metatiles)
-    
-    return coord_metatiles_dict
+def get_metatile_content_str(metatile_str):
+    # Part of a metatile str (see Metatile.to_str) with the metatile's type and graph, but not its games and levels
+    return metatile_str[:metatile_str.rindex(", 'games': ")]
 
 
-def get_coord_tile_ids_map(metatile_id_map, coord_metatiles_dict):
-    ordered_metatiles = []
-    ordered_ids = []
-    for metatile_str, id in metatile_id_map.items():
-        ordered_metatiles.append(Metatile.from_str(metatile_str))
-        ordered_ids.append(id)
+def get_coord_tile_ids_map(metatile_id_map, metatile_coords_dicts):
+    # Get the tile_ids of the metatiles at each coord (in the order the metatiles are first listed for the coord)
+    content_str_tile_ids = {}  # {metatile content str: tile_id}
+    for metatile_str, tile_id in metatile_id_map.items():
+        content_str_tile_ids[get_metatile_content_str(metatile_str)] = tile_id
+    content_hash_tile_ids = None  # {metatile content hash: tile_id}, only built if a content str is not found
 
     coord_tile_ids_map = {}
-    for coord, metatiles in coord_metatiles_dict.items():
-        coord_tile_ids_map[coord] = []
-        for metatile in metatiles:
-            tile_id_idx = ordered_metatiles.index(metatile)
-            tile_id = ordered_ids[tile_id_idx]
-            coord_tile_ids_map[coord].append(tile_id)
+    for metatile_coords_dict in metatile_coords_dicts:
+        for metatile_str, coords in metatile_coords_dict.items():
+            tile_id = content_str_tile_ids.get(get_metatile_content_str(metatile_str))
+            if tile_id is None:  # e.g. metatile strs saved with a different graph node order
+                if content_hash_tile_ids is None:
+                    content_hash_tile_ids = {}
+                    for id_metatile_str, id in metatile_id_map.items():
+                        content_hash_tile_ids[Metatile.from_str(id_metatile_str).get_content_hash()] = id
+                tile_id = content_hash_tile_ids[Metatile.from_str(metatile_str).get_content_hash()]
+
+            for coord in coords:
+                if coord_tile_ids_map.get(coord) is None:
+                    coord_tile_ids_map[coord] = []
+                if tile_id not in coord_tile_ids_map[coord]:
+                    coord_tile_ids_map[coord].append(tile_id)
 
     return coord_tile_ids_map
 
 
+def get_tile_constraints(metatile):
+    return {
+        "type": metatile.type,
+        "graph": metatile.graph,
+        "games": metatile.games,
+        "levels": metatile.levels,
+        "adjacent": {
+            TOP: [], BOTTOM: [], LEFT: [], RIGHT: [], TOP_LEFT: [], BOTTOM_LEFT: [], TOP_RIGHT: [], BOTTOM_RIGHT: []
+        }
+    }
+
+
 def populate_tile_id_constraints_adjacencies(tile_id_constraints_dict, coord_tile_ids_map):
+    # Adjacent tile_ids are collected as bitsets over the tile_ids (bit i => i-th tile_id of tile_id_constraints_dict)
+    tile_ids = list(tile_id_constraints_dict.keys())
+    tile_id_indices = {}
+    for i, tile_id in enumerate(tile_ids):
+        tile_id_indices[tile_id] = i
+
+    def get_tile_ids_bitset(ids):
+        bitset = 0
+        for id in ids:
+            bitset |= 1 << tile_id_indices[id]
+        return bitset
+
+    def get_bitset_tile_ids(bitset):
+        ids = []
+        while bitset:
+            lowest_bit = bitset & -bitset
+            ids.append(tile_ids[lowest_bit.bit_length() - 1])
+            bitset ^= lowest_bit
+        return ids
+
+    coord_bitsets = {}  # {coord: bitset of the tile_ids at coord}
+    for coord, ids in coord_tile_ids_map.items():
+        coord_bitsets[coord] = get_tile_ids_bitset(ids)
+
+    # {DIRECTION: [bitset of the tile_ids adjacent in DIRECTION to the i-th tile_id]}, starting from the given adjacencies
+    adjacency_bitsets = {}
+    for direction in DIRECTIONS:
+        adjacency_bitsets[direction] = [get_tile_ids_bitset(tile_id_constraints_dict[tile_id]['adjacent'][direction])
+                                        for tile_id in tile_ids]
+
+    for coord, ids in coord_tile_ids_map.items():
+        for direction in DIRECTIONS:
+            neighbor_coord = (coord[0] + (direction[0] * TILE_DIM), coord[1] + (direction[1] * TILE_DIM))
+            neighbor_bitset = coord_bitsets.get(neighbor_coord, 0)  # tile_ids at neighbor coord
+            if neighbor_bitset:
+                for id in ids:  # update adjacent tiles in the cur direction for every tile_id at the current coord
+                    adjacency_bitsets[direction][tile_id_indices[id]] |= neighbor_bitset
 
-    def get_direction_neighbor_coord_map(coord):
-        cur_map = {}
+    for i, tile_id in enumerate(tile_ids):
         for direction in DIRECTIONS:
-            neighbor_x = coord[0] + (direction[0] * TILE_DIM)
-            neighbor_y = coord[1] + (direction[1] * TILE_DIM)
-            cur_map[direction] = (neighbor_x, neighbor_y)
-        return cur_map  # {DIRECTION: neighbor_coord}
+            tile_id_constraints_dict[tile_id]['adjacent'][direction] = get_bitset_tile_ids(adjacency_bitsets[direction][i])
 
-    coord_tile_ids_map_copy = coord_tile_ids_map.copy()  # clone for reference
+    return tile_id_constraints_dict
 
-    for coord, tile_ids in coord_tile_ids_map.items():
-        direction_neighbor_coord_map = get_direction_neighbor_coord_map(coord)
 
-        for direction, neighbor_coord in direction_neighbor_coord_map.items():
-            neighbor_tile_ids = coord_tile_ids_map_copy.get(neighbor_coord)  # get tile_ids at neighbor coord
-            if neighbor_tile_ids is not None and len(neighbor_tile_ids) > 0:
+def add_coord_tile_ids_adjacencies(tile_id_constraints_dict, coord_tile_ids_map, level_coord_tile_ids_map):
+    # Merges a new level's {coord: tile_ids} map into the combined coord_tile_ids_map of a tileset and adds the
+    # adjacencies of the merged tile_ids (the ones populate_tile_id_constraints_adjacencies would add for the merged map),
+    # only visiting the new level's coords. Returns the added adjacencies {(tile_id, DIRECTION): [adjacent tile_ids]}
+    tile_id_indices = {}
+    for i, tile_id in enumerate(tile_id_constraints_dict.keys()):
+        tile_id_indices[tile_id] = i
+
+    added_coord_tile_ids = {}  # {coord: tile_ids merged into coord_tile_ids_map at coord}
+    for coord, ids in level_coord_tile_ids_map.items():
+        if coord_tile_ids_map.get(coord) is None:
+            coord_tile_ids_map[coord] = []
+        for id in ids:
+            if id not in coord_tile_ids_map[coord]:
+                coord_tile_ids_map[coord].append(id)
+                added_coord_tile_ids.setdefault(coord, []).append(id)
+
+    # Merged tile_ids get the tile_ids at their neighbor coords, and the tile_ids at the opposite neighbor coords get them
+    candidate_adjacencies = {}  # {(tile_id, DIRECTION): set of adjacent tile_ids}
+    for coord, added_ids in added_coord_tile_ids.items():
+        for direction in DIRECTIONS:
+            neighbor_coord = (coord[0] + (direction[0] * TILE_DIM), coord[1] + (direction[1] * TILE_DIM))
+            for id in added_ids:
+                candidate_adjacencies.setdefault((id, direction), set()).update(coord_tile_ids_map.get(neighbor_coord, []))
+            opposite_coord = (coord[0] - (direction[0] * TILE_DIM), coord[1] - (direction[1] * TILE_DIM))
+            for id in coord_tile_ids_map.get(opposite_coord, []):
+                candidate_adjacencies.setdefault((id, direction), set()).update(added_ids)
 
-                for id in tile_ids:  # update adjacent tiles in the cur direction for every tile_id at the current coord
-                    tile_adjacency_direction_dict = tile_id_constraints_dict[id]['adjacent'][direction]
-                    tile_adjacency_direction_dict = list(set(tile_adjacency_direction_dict + neighbor_tile_ids))
-                    tile_id_constraints_dict[id]['adjacent'][direction] = tile_adjacency_direction_dict
+    added_adjacencies = {}
+    for (tile_id, direction), candidate_ids in candidate_adjacencies.items():
+        adjacent_ids = tile_id_constraints_dict[tile_id]['adjacent'][direction]
+        new_ids = candidate_ids.difference(adjacent_ids)
+        if len(new_ids) > 0:  # keep the adjacent tile_ids in tile_id order
+            adjacent_ids += new_ids
+            adjacent_ids.sort(key=lambda id: tile_id_indices[id])
+            added_adjacencies[(tile_id, direction)] = sorted(new_ids, key=lambda id: tile_id_indices[id])
 
-    return tile_id_constraints_dict
+    return added_adjacencies
 
 
 def main(save_filename, metatile_id_map_file, id_metatile_map_file, metatile_coords_dict_files, player_img):
@@ -102,21 +168,11 @@ def main(save_filename, metatile_id_map_file, id_metatile_map_file, metatile_coo
     id_metatile_map = read_pickle(id_metatile_map_file)
     metatile_coords_dicts = [read_pickle(file) for file in metatile_coords_dict_files]
 
-    coord_metatiles_dict = get_coord_metatiles_dict(metatile_coords_dicts)
-    coord_tile_ids_map = get_coord_tile_ids_map(metatile_id_map, coord_metatiles_dict)
+    coord_tile_ids_map = get_coord_tile_ids_map(metatile_id_map, metatile_coords_dicts)
 
     tile_id_constraints_dict = {}
     for tile_id, metatile_str in id_metatile_map.items():
-        metatile = Metatile.from_str(metatile_str)
-        tile_id_constraints_dict[tile_id] = {
-            "type": metatile.type,
-            "graph": metatile.graph_as_dict,
-            "games": metatile.games,
-            "levels": metatile.levels,
-            "adjacent": {
-                TOP: [], BOTTOM: [], LEFT: [], RIGHT: [], TOP_LEFT: [], BOTTOM_LEFT: [], TOP_RIGHT: [], BOTTOM_RIGHT: []
-            }
-        }
+        tile_id_constraints_dict[tile_id] = get_tile_constraints(Metatile.from_str(metatile_str))
     tile_id_constraints_dict = populate_tile_id_constraints_adjacencies(tile_id_constraints_dict, coord_tile_ids_map)
 
     end_time = datetime.now()
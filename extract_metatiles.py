@@ -4,13 +4,16 @@ Enumerate the state space of a level and extract level metatiles
 
 # Note: use pypy3 to run; use pip_pypy3 to install third-party packages (e.g. networkx)
 
-import networkx as nx
 from datetime import datetime
 import argparse
+import numpy as np
 
-from model.metatile import Metatile, METATILE_TYPES
+from model.metatile import Metatile, MetatileGraph, METATILE_TYPES
 from model.level import Level, TILE_DIM
+from model.metatile_library import MetatileLibrary
+from model.state_graph import read_state_graph
 from enumerate import parse_state_graph_filename
+from minimize_state_graph import get_state_map_file, read_state_map
 import utils
 
 
@@ -30,26 +33,52 @@ def get_metatile_coords_dict_file(state_graph_file, player_img):
     return metatile_coords_dict_file
 
 
-def get_metatile_coord_states_map(state_graph, all_possible_coords):
-    metatile_coord_states_map = {}
-    for coord in all_possible_coords:
-        metatile_coord_states_map[coord] = []
-
-    for node in state_graph.nodes():
-        state_dict = eval(node)
-        state_coord = (state_dict['x'], state_dict['y'])
-        metatile_coord = Metatile.get_metatile_coord_from_state_coord(state_coord, TILE_DIM)
-        if metatile_coord_states_map.get(metatile_coord) is None:
-            continue  # state not on screen (e.g. falling down a pit) - ignore since we only care about tiles on screen
-        else:
-            metatile_coord_states_map[metatile_coord].append(node)
-    return metatile_coord_states_map
+def get_metatile_coord_graphs(state_graph, all_possible_coords):
+    # Buckets the edges of the state graph by the metatile their source state is in: each metatile graph has the states
+    # in the metatile, their out edges and the edges' dest states, normalized to the metatile's coord.
+    # Returns {metatile_coord: MetatileGraph}
+    states = np.asarray(state_graph.states, dtype=np.int64)
+    x_index, y_index = state_graph.state_fields.index('x'), state_graph.state_fields.index('y')
+    targets = np.asarray(state_graph.targets, dtype=np.int64)
+    actions = np.asarray(state_graph.actions)
+    edge_sources = np.repeat(np.arange(state_graph.num_states()), np.diff(state_graph.offsets))
+
+    # Index of the metatile each state is in (-1 if the state is not on screen, e.g. falling down a pit - ignore since
+    # we only care about tiles on screen), with metatile coords rounded like Metatile.get_metatile_coord_from_state_coord
+    coord_indices = {}
+    for coord_index, coord in enumerate(all_possible_coords):
+        coord_indices[coord] = coord_index
+    metatile_xs = (np.trunc(states[:, x_index] / TILE_DIM).astype(np.int64) * TILE_DIM).tolist()
+    metatile_ys = (np.trunc(states[:, y_index] / TILE_DIM).astype(np.int64) * TILE_DIM).tolist()
+    node_coord_indices = np.array([coord_indices.get(metatile_coord, -1)
+                                   for metatile_coord in zip(metatile_xs, metatile_ys)], dtype=np.int64)
+    edge_coord_indices = node_coord_indices[edge_sources]
+
+    # Nodes and edges sorted by metatile, so each metatile's nodes and edges are one slice
+    node_order = np.argsort(node_coord_indices, kind='stable')
+    node_bounds = np.searchsorted(node_coord_indices[node_order], np.arange(len(all_possible_coords) + 1))
+    edge_order = np.argsort(edge_coord_indices, kind='stable')
+    edge_bounds = np.searchsorted(edge_coord_indices[edge_order], np.arange(len(all_possible_coords) + 1))
+
+    metatile_coord_graphs = {}
+    for coord_index, coord in enumerate(all_possible_coords):
+        metatile_edges = edge_order[edge_bounds[coord_index]:edge_bounds[coord_index + 1]]
+        metatile_nodes = np.union1d(node_order[node_bounds[coord_index]:node_bounds[coord_index + 1]],
+                                    targets[metatile_edges])
+        state_records = states[metatile_nodes]
+        state_records[:, x_index] -= coord[0]
+        state_records[:, y_index] -= coord[1]
+        edges = np.stack([np.searchsorted(metatile_nodes, edge_sources[metatile_edges]),
+                          np.searchsorted(metatile_nodes, targets[metatile_edges])], axis=1)
+        metatile_coord_graphs[coord] = MetatileGraph.from_arrays(state_records, edges, actions[metatile_edges],
+                                                                 state_graph.action_strs)
+
+    return metatile_coord_graphs
 
 
 def construct_metatile(metatile_coord, game, level, level_start_coord, level_goal_coords_dict, level_platform_coords_dict,
                        level_bonus_coords_dict, level_one_way_platform_coords_dict, level_hazard_coords_dict,
-                       level_wall_coords_dict, level_permeable_wall_coords_dict,
-                       state_graph, metatile_coord_states_map):
+                       level_wall_coords_dict, level_permeable_wall_coords_dict, metatile_graph):
 
     # Determine metatile type
     if metatile_coord == level_start_coord:
@@ -71,33 +100,21 @@ def construct_metatile(metatile_coord, game, level, level_start_coord, level_goa
     else:
         metatile_type = 'empty'
 
-    # Construct metatile graph
-    metatile_graph = nx.DiGraph()
-    states_in_metatile = metatile_coord_states_map.get(metatile_coord)
-
-    for state in states_in_metatile:
-        subgraph = state_graph.edge_subgraph(state_graph.edges(state)).copy()
-        metatile_graph = nx.compose(metatile_graph, subgraph)  # join graphs
-
-    # Normalize metatile_graph to metatile_coord
-    if len(states_in_metatile) > 0:
-        metatile_graph = Metatile.get_normalized_graph(metatile_graph, metatile_coord, normalize=True)
-
-    # Construct new Metatile obj
-    metatile_graph_as_dict = nx.to_dict_of_dicts(metatile_graph)
-    return Metatile(metatile_type, metatile_graph_as_dict, games=[game], levels=[level])
+    # Construct new Metatile obj (metatile_graph is already normalized to metatile_coord)
+    return Metatile(metatile_type, metatile_graph, games=[game], levels=[level])
 
 
 def extract_metatiles(state_graph_files, unique_metatiles_file, metatile_coords_dict_file):
 
     all_metatiles = []
-    unique_metatiles = []
+    unique_metatiles = {}  # {content hash: unique metatile}, in the order the metatiles were last seen
     metatile_coords_dict = {}
+    metatile_str_hashes = {}  # {metatile str: content hash} for the keys of metatile_coords_dict
 
     for state_graph_file in state_graph_files:
 
         # Load in the state graph
-        state_graph = nx.read_gpickle(state_graph_file)
+        state_graph = read_state_graph(state_graph_file)
 
         # Extract game and level from state graph filename
         level_info = parse_state_graph_filename(state_graph_file)
@@ -117,7 +134,7 @@ def extract_metatiles(state_graph_files, unique_metatiles_file, metatile_coords_
 
         # Extract metatiles from level
         all_possible_coords = level_obj.get_all_possible_coords()
-        metatile_coord_states_map = get_metatile_coord_states_map(state_graph, all_possible_coords)
+        metatile_coord_graphs = get_metatile_coord_graphs(state_graph, all_possible_coords)
 
         for metatile_coord in all_possible_coords:
 
@@ -131,46 +148,45 @@ def extract_metatiles(state_graph_files, unique_metatiles_file, metatile_coords_
                                               level_hazard_coords_dict=hazard_coords_dict,
                                               level_wall_coords_dict=wall_coords_dict,
                                               level_permeable_wall_coords_dict = permeable_wall_coords_dict,
-                                              state_graph=state_graph,
-                                              metatile_coord_states_map=metatile_coord_states_map)
+                                              metatile_graph=metatile_coord_graphs[metatile_coord])
 
             # Add new_metatile to list of all_metatiles
             all_metatiles.append(new_metatile)
 
-            # Update unique_metatiles list
-            if new_metatile not in unique_metatiles:
-                unique_metatiles.append(new_metatile)  # add new metatile
+            # Update unique_metatiles
+            content_hash = new_metatile.get_content_hash()
+            if unique_metatiles.get(content_hash) is None:
+                unique_metatiles[content_hash] = new_metatile  # add new metatile
             else:
-                metatile_idx = unique_metatiles.index(new_metatile)
-                existing_metatile = unique_metatiles.pop(metatile_idx)  # remove old metatile
+                existing_metatile = unique_metatiles.pop(content_hash)  # remove old metatile
                 new_metatile = existing_metatile.merge_games_and_levels(new_metatile)  # merge metatile games and levels
-                unique_metatiles.append(new_metatile)  # add new (merged) metatile
+                unique_metatiles[content_hash] = new_metatile  # add new (merged) metatile
 
             # Create {metatile: coords} dictionary
             if metatile_coords_dict_file is not None:  # only one state graph file given => only one game per metatile
                 new_metatile_str = new_metatile.to_str()
                 if metatile_coords_dict.get(new_metatile_str) is None:
                     metatile_coords_dict[new_metatile_str] = [metatile_coord]
+                    metatile_str_hashes[new_metatile_str] = content_hash
                 else:
                     metatile_coords_dict[new_metatile_str].append(metatile_coord)
 
     # Save unique_metatiles to file
+    unique_metatiles = list(unique_metatiles.values())
     utils.write_pickle(unique_metatiles_file, unique_metatiles)
 
     # Create {unique_metatile: coords} dictionary
     if metatile_coords_dict_file is not None:
-        unique_metatile_coords_dict = {}
-        ordered_metatiles = []
-        ordered_coords_lists = []
-
+        content_hash_coords = {}  # {content hash: coords of the metatiles with that hash}
         for metatile_str, coords in metatile_coords_dict.items():
-            ordered_metatiles.append(Metatile.from_str(metatile_str))
-            ordered_coords_lists.append(coords)
+            content_hash = metatile_str_hashes[metatile_str]
+            if content_hash_coords.get(content_hash) is None:
+                content_hash_coords[content_hash] = []
+            content_hash_coords[content_hash] += coords
+
+        unique_metatile_coords_dict = {}
         for unique_metatile in unique_metatiles:
-            unique_metatile_str = unique_metatile.to_str()
-            unique_metatile_coords_dict[unique_metatile_str] = []
-            for idx in utils.get_all_indices(unique_metatile, ordered_metatiles):
-                unique_metatile_coords_dict[unique_metatile_str] += ordered_coords_lists[idx]
+            unique_metatile_coords_dict[unique_metatile.to_str()] = content_hash_coords[unique_metatile.get_content_hash()]
 
         utils.write_pickle(metatile_coords_dict_file, unique_metatile_coords_dict)  # save to file
 
@@ -190,14 +206,14 @@ def get_metatile_stats_dict(all_metatiles, unique_metatiles):
     for metatile in all_metatiles:
         stats_dict["all_metatiles"] += 1
         stats_dict["all_%s_metatiles" % metatile.type] += 1
-        has_graph = bool(metatile.graph_as_dict)
+        has_graph = not metatile.graph.is_empty()
         if has_graph:
             stats_dict["all_metatiles_with_graphs"] += 1
 
     for unique_metatile in unique_metatiles:
         stats_dict["unique_metatiles"] += 1
         stats_dict["unique_%s_metatiles" % unique_metatile.type] += 1
-        has_graph = bool(unique_metatile.graph_as_dict)
+        has_graph = not unique_metatile.graph.is_empty()
         if has_graph:
             stats_dict["unique_metatiles_with_graphs"] += 1
 
@@ -208,6 +224,13 @@ def main(save_filename, player_img, print_stats, state_graph_files):
 
     unique_metatiles_file = get_unique_metatiles_file(save_filename, player_img)
 
+    # The states of a minimized state graph are bisimulation blocks of the level (see minimize_state_graph.py), so
+    # its metatiles can not be extracted together with (and linked to) the metatiles of other levels
+    minimized_state_graph_files = [file for file in state_graph_files if get_state_map_file(file) is not None]
+    if len(minimized_state_graph_files) > 0 and len(state_graph_files) > 1:
+        utils.error_exit("Minimized state graphs can not be combined with other state graphs: %s" %
+                         str(minimized_state_graph_files))
+
     # Only construct metatile_coords dictionary if extracting metatiles from ONE state graph (one level)
     if len(state_graph_files) == 1:
         metatile_coords_dict_file = get_metatile_coords_dict_file(state_graph_files[0], player_img)
@@ -218,6 +241,17 @@ def main(save_filename, player_img, print_stats, state_graph_files):
     print("Extracting metatiles from %d state graphs..." % len(state_graph_files))
     start_time = datetime.now()
     all_metatiles, unique_metatiles = extract_metatiles(state_graph_files, unique_metatiles_file, metatile_coords_dict_file)
+
+    # Register the level's unique metatiles in the metatile library (only if extracting metatiles from ONE level)
+    if len(state_graph_files) == 1:
+        level_info = parse_state_graph_filename(state_graph_files[0])
+        state_map_file = None
+        if len(minimized_state_graph_files) > 0:
+            state_map_file, state_map = read_state_map(state_graph_files[0])
+            print("Minimized level: %d states in %d blocks" % (len(state_map), len(set(state_map.values()))))
+        MetatileLibrary(player_img).register_level(level_info['game'], level_info['level'], unique_metatiles,
+                                                   state_map_file=state_map_file)
+
     end_time = datetime.now()
     runtime = str(end_time-start_time)
     print("Runtime: %s\n" % runtime)
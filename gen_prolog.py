@@ -1,9 +1,10 @@
-import networkx as nx
 import re
 import os
 import argparse
 
-from model.metatile import METATILE_TYPES
+from model.level import TILE_DIM
+from model.metatile import METATILE_TYPES, STATE_X_INDEX, STATE_Y_INDEX, MetatileGraph
+from extract_constraints import DIRECTIONS
 from stopwatch import Stopwatch
 import utils
 
@@ -29,7 +30,125 @@ def parse_constraints_filepath(constraints_filename):
     return level_saved_files_dir, prolog_filename
 
 
-def main(tile_constraints_file, debug, print_pl, save):
+def get_tile_state_id(state_record, state_ids):
+    # Tile offset (DX, DY) of a state record normalized to a metatile, and the id of the state record relative to that
+    # tile (state_ids = {tile-relative state record: state id}; new state records get the next state id)
+    dx = state_record[STATE_X_INDEX] // TILE_DIM
+    dy = state_record[STATE_Y_INDEX] // TILE_DIM
+    tile_state_record = list(state_record)
+    tile_state_record[STATE_X_INDEX] -= dx * TILE_DIM
+    tile_state_record[STATE_Y_INDEX] -= dy * TILE_DIM
+    state_id = state_ids.setdefault(tuple(tile_state_record), len(state_ids))
+    return dx, dy, state_id
+
+
+def get_state_contents_prolog_statements(state_id_records, first_state_id=0):
+    # state_contents(S, <tile-relative state contents>) facts of the state ids from first_state_id on
+    prolog_statements = ""
+    for state_id in range(first_state_id, len(state_id_records)):
+        state = State.from_key(State.row_to_key(state_id_records[state_id]))
+        prolog_statements += "state_contents(%d,%s).\n" % (state_id, state.to_prolog_contents(tile_coord_vars=False))
+    return prolog_statements
+
+
+def get_tile_prolog_statements(tile_id, tile_constraints, state_ids=None):
+    # Metatile fact and the state and link rules of the tile's metatile graph (or, with the integer state id encoding,
+    # its mt_state(MT,S) and mt_link(MT,S1,DX,DY,S2) facts; see get_tile_state_id for state_ids)
+    prolog_statements = "metatile(%s).\n" % tile_id
+
+    # Retrieve the metatile graph (constraints files saved before MetatileGraph hold a legacy graph dict)
+    metatile_graph = tile_constraints.get('graph')
+    if isinstance(metatile_graph, dict):
+        metatile_graph = MetatileGraph.from_graph_as_dict(metatile_graph)
+
+    if state_ids is not None:
+        tile_state_ids = [get_tile_state_id(state_record, state_ids) for state_record in metatile_graph.state_records]
+        for source, dest in metatile_graph.edges.tolist():
+            src_state_id = tile_state_ids[source][2]  # source states are in the metatile's own tile
+            dx, dy, dest_state_id = tile_state_ids[dest]
+            prolog_statements += "mt_state(%s,%d).\n" % (tile_id, src_state_id)
+            prolog_statements += "mt_link(%s,%d,%d,%d,%d).\n" % (tile_id, src_state_id, dx, dy, dest_state_id)
+        return prolog_statements
+
+    state_contents = [State.from_key(state_key).to_prolog_contents() for state_key in metatile_graph.get_state_keys()]
+
+    # Create state and link rules based on metatile graph
+    for source, dest in metatile_graph.edges.tolist():
+        src_state_contents = state_contents[source]
+        dest_state_contents = state_contents[dest]
+
+        state_rule = "state(%s) :- assignment(TX,TY,%s)." % (src_state_contents, tile_id)
+        link_rule = "link(%s,%s) :- assignment(TX,TY,%s)." % (src_state_contents, dest_state_contents, tile_id)
+        prolog_statements += state_rule + "\n" + link_rule + "\n"
+
+    return prolog_statements
+
+
+def get_legal_prolog_statements(tile_id, direction, adjacent_tile_ids):
+    # Legal tile placement facts for the tile_ids adjacent to tile_id in the given direction (ground facts, so the
+    # grounder does not have to instantiate a rule body per adjacent pair)
+    prolog_statements = ""
+    dx, dy = direction
+    for adjacent_id in adjacent_tile_ids:  # for each adjacent metatile
+        prolog_statements += "legal(%d,%d,%s,%s).\n" % (dx, dy, tile_id, adjacent_id)
+    return prolog_statements
+
+
+def get_metatile_type_ids_map(tile_id_constraints_dict):
+    # Create {metatile_type: tile_ids} map
+    metatile_type_ids_map = {}
+    for t in METATILE_TYPES:
+        metatile_type_ids_map[t] = []
+    for tile_id, tile_constraints in tile_id_constraints_dict.items():
+        metatile_type_ids_map[tile_constraints.get('type')].append(tile_id)
+    return metatile_type_ids_map
+
+
+def get_prolog_info(tile_id_constraints_dict):
+    # all_prolog_info entry of the prolog file generated for the given tile constraints
+    metatile_type_ids_map = get_metatile_type_ids_map(tile_id_constraints_dict)
+
+    # Create {level: tile_ids} map
+    metatile_level_ids_map = {}
+    for tile_id, tile_constraints in tile_id_constraints_dict.items():
+        for level in tile_constraints.get('levels'):
+            if metatile_level_ids_map.get(level) is None:
+                metatile_level_ids_map[level] = [tile_id]
+            else:
+                metatile_level_ids_map[level].append(tile_id)
+
+    # Get bonus tile id if exists
+    bonus_tile_ids = metatile_type_ids_map.get("bonus")
+
+    return {
+        "block_tile_ids": [metatile_type_ids_map.get("block")[0]],
+        "start_tile_ids": [metatile_type_ids_map.get("start")[0]],
+        "goal_tile_ids": [metatile_type_ids_map.get("goal")[0]],
+        "bonus_tile_ids": [] if len(bonus_tile_ids) == 0 else [bonus_tile_ids[0]],
+        "one_way_platform_tile_ids": metatile_type_ids_map.get("one_way_platform"),
+        "hazard_tile_ids": metatile_type_ids_map.get("hazard"),
+        "wall_tile_ids": metatile_type_ids_map.get("wall"),
+        "permeable_wall_tile_ids": metatile_type_ids_map.get("permeable_wall"),
+        "level_ids_map": metatile_level_ids_map
+    }
+
+
+def get_all_prolog_info_filepath(level_saved_files_dir):
+    return utils.get_filepath("%s/prolog_files" % level_saved_files_dir, "all_prolog_info.pickle")
+
+
+def read_all_prolog_info(level_saved_files_dir):
+    all_prolog_info_filepath = get_all_prolog_info_filepath(level_saved_files_dir)
+    return utils.read_pickle(all_prolog_info_filepath) if os.path.exists(all_prolog_info_filepath) else {}
+
+
+def update_all_prolog_info(level_saved_files_dir, prolog_filename, prolog_info):
+    all_prolog_info_map = read_all_prolog_info(level_saved_files_dir)
+    all_prolog_info_map[prolog_filename] = prolog_info
+    utils.write_pickle(get_all_prolog_info_filepath(level_saved_files_dir), all_prolog_info_map)
+
+
+def main(tile_constraints_file, debug, print_pl, save, direction_wfc=False, state_ids=False):
 
     stopwatch = Stopwatch()
 
@@ -51,82 +170,57 @@ def main(tile_constraints_file, debug, print_pl, save):
     min_assignments = 0 if debug else 1
     prolog_statements += "%d {assignment(TX, TY, MT) : metatile(MT) } 1 :- tile(TX,TY).\n" % min_assignments
 
-    # Create tile adjacency rules
-    adj_rule_prefix = "adj(X1,Y1,X2,Y2,DX,DY) :- tile(X1,Y1), tile(X2,Y2), X2-X1 == DX, Y2-Y1 == DY"
-    horizontal_adj_rule = "%s, |DX| == 1, DY == 0." % adj_rule_prefix
-    vertical_adj_rule = "%s, DX == 0, |DY| == 1." % adj_rule_prefix
-    diagonal_adj_rule = "%s, |DX| == 1, |DY| == 1." % adj_rule_prefix
-    prolog_statements += horizontal_adj_rule + "\n" + vertical_adj_rule + "\n" + diagonal_adj_rule + "\n"
-
-    # Create {metatile_type: tile_ids} map
-    metatile_type_ids_map = {}
-    for t in METATILE_TYPES:
-        metatile_type_ids_map[t] = []
-
-    # Create {level: tile_ids} map
-    metatile_level_ids_map = {}
+    # Create tile adjacency rules (or derive the adjacent tiles from the neighbor directions of each tile)
+    if direction_wfc:
+        for dx, dy in DIRECTIONS:
+            prolog_statements += "direction(%d,%d).\n" % (dx, dy)
+        prolog_statements += "adj(X1,Y1,X1+DX,Y1+DY,DX,DY) :- tile(X1,Y1), direction(DX,DY), tile(X1+DX,Y1+DY).\n"
+    else:
+        adj_rule_prefix = "adj(X1,Y1,X2,Y2,DX,DY) :- tile(X1,Y1), tile(X2,Y2), X2-X1 == DX, Y2-Y1 == DY"
+        horizontal_adj_rule = "%s, |DX| == 1, DY == 0." % adj_rule_prefix
+        vertical_adj_rule = "%s, DX == 0, |DY| == 1." % adj_rule_prefix
+        diagonal_adj_rule = "%s, |DX| == 1, |DY| == 1." % adj_rule_prefix
+        prolog_statements += horizontal_adj_rule + "\n" + vertical_adj_rule + "\n" + diagonal_adj_rule + "\n"
 
     # Get generic state strs in prolog format
     generic_state = State.generic_prolog_contents()
     generic_src_state = State.generic_prolog_contents(index=1)
     generic_dest_state = State.generic_prolog_contents(index=2)
 
+    # {tile-relative state record: state id} of the integer state id encoding
+    tile_state_ids = {} if state_ids else None
+
     # Add prolog facts and rules based on the given tile constraints
     for tile_id, tile_constraints in tile_id_constraints_dict.items():
 
-        # Create metatile fact
-        prolog_statements += "metatile(%s).\n" % tile_id
-
-        # Populate {metatile_type: tile_ids} map
-        metatile_type = tile_constraints.get('type')
-        metatile_type_ids_map[metatile_type].append(tile_id)
-
-        # Populate {level: tile_ids} map
-        metatile_levels = tile_constraints.get('levels')
-        for level in metatile_levels:
-            if metatile_level_ids_map.get(level) is None:
-                metatile_level_ids_map[level] = [tile_id]
-            else:
-                metatile_level_ids_map[level].append(tile_id)
-
-        # Retrieve the metatile graph
-        metatile_graph = nx.DiGraph(tile_constraints.get('graph'))
-
-        # Create state and link rules based on metatile graph
-        for edge in metatile_graph.edges():
-            src_state = State.from_str(edge[0])
-            src_state_contents = src_state.to_prolog_contents()
-            dest_state = State.from_str(edge[1])
-            dest_state_contents = dest_state.to_prolog_contents()
-
-            state_rule = "state(%s) :- assignment(TX,TY,%s)." % (src_state_contents, tile_id)
-            link_rule = "link(%s,%s) :- assignment(TX,TY,%s)." % (src_state_contents, dest_state_contents, tile_id)
-            prolog_statements += state_rule + "\n" + link_rule + "\n"
+        # Create metatile fact and state and link rules
+        prolog_statements += get_tile_prolog_statements(tile_id, tile_constraints, state_ids=tile_state_ids)
 
         # Create legal tile placement rules based on valid adjacent tiles
         for direction, adjacent_tiles in tile_constraints.get("adjacent").items():  # for each adjacent dir
-            dx, dy = direction
-
-            for adjacent_id in adjacent_tiles:  # for each adjacent metatile
-                legal_statement = "legal(DX, DY, MT1, MT2) :- DX == %d, DY == %d, metatile(MT1), metatile(MT2), " \
-                                  "MT1 == %s, MT2 == %s." % (dx, dy, tile_id, adjacent_id)
-                prolog_statements += legal_statement + "\n"
-
-    # Add rule for valid links
-    link_exists_rule = ":- link(%s,%s), state(%s), not state(%s).\n" % (generic_src_state, generic_dest_state, generic_src_state, generic_dest_state)
-    prolog_statements += link_exists_rule
-
-    # Get block, start, and goal tile_ids
-    block_tile_id = metatile_type_ids_map.get("block")[0]
-    start_tile_id = metatile_type_ids_map.get("start")[0]
-    goal_tile_id = metatile_type_ids_map.get("goal")[0]
-    hazard_tile_ids = metatile_type_ids_map.get("hazard")
-    wall_tile_ids = metatile_type_ids_map.get("wall")
-    permeable_wall_tile_ids = metatile_type_ids_map.get("permeable_wall")
-
-    # Get bonus tile id if exists
-    bonus_tile_ids = metatile_type_ids_map.get("bonus")
-    bonus_tile_id = None if len(bonus_tile_ids) == 0 else bonus_tile_ids[0]
+            prolog_statements += get_legal_prolog_statements(tile_id, direction, adjacent_tiles)
+
+    if state_ids:
+        # States of the assigned tiles are (TX,TY,S) triples, with the tile-relative contents of S in its state_contents
+        prolog_statements += get_state_contents_prolog_statements(list(tile_state_ids.keys()))
+        prolog_statements += "state(TX,TY,S) :- assignment(TX,TY,MT), mt_state(MT,S).\n"
+        prolog_statements += "link(TX,TY,S1,TX+DX,TY+DY,S2) :- assignment(TX,TY,MT), mt_link(MT,S1,DX,DY,S2).\n"
+        prolog_statements += "start_state(S) :- state_contents(S,%s), %s.\n" % (generic_state, State.generic_start_reachability_expression())
+        prolog_statements += "goal_state(S) :- state_contents(S,%s), %s.\n" % (generic_state, State.generic_goal_reachability_expression())
+
+        # Add rule for valid links
+        prolog_statements += ":- link(TX1,TY1,S1,TX2,TY2,S2), state(TX1,TY1,S1), not state(TX2,TY2,S2).\n"
+    else:
+        # Add rule for valid links
+        link_exists_rule = ":- link(%s,%s), state(%s), not state(%s).\n" % (generic_src_state, generic_dest_state, generic_src_state, generic_dest_state)
+        prolog_statements += link_exists_rule
+
+    # Get start and goal tile_ids
+    prolog_info = get_prolog_info(tile_id_constraints_dict)
+    if state_ids:
+        prolog_info["state_id_records"] = list(tile_state_ids.keys())
+    start_tile_id = prolog_info.get("start_tile_ids")[0]
+    goal_tile_id = prolog_info.get("goal_tile_ids")[0]
 
     # Limit number of tiles of specified tile_id
     limit_tile_id_rule = "MIN { assignment(X,Y,MT) : metatile(MT), tile(X,Y) } MAX :- limit(MT, MIN, MAX)."
@@ -134,20 +228,28 @@ def main(tile_constraints_file, debug, print_pl, save):
     prolog_statements += "limit(%s, 1, 1).\n" % start_tile_id
     prolog_statements += "limit(%s, 1, 1).\n" % goal_tile_id
 
-    # Add state reachable rule
-    state_reachable_rule = "reachable(%s) :- link(%s,%s), state(%s), state(%s), reachable(%s)." % (
-        generic_dest_state, generic_src_state, generic_dest_state, generic_src_state, generic_dest_state, generic_src_state
-    )
-    prolog_statements += state_reachable_rule + "\n"
+    if state_ids:
+        # Add state reachable rule
+        prolog_statements += "reachable(TX2,TY2,S2) :- link(TX1,TY1,S1,TX2,TY2,S2), state(TX1,TY1,S1), " \
+                             "state(TX2,TY2,S2), reachable(TX1,TY1,S1).\n"
+
+        # Start states are inherently reachable
+        prolog_statements += "reachable(TX,TY,S) :- state(TX,TY,S), start_state(S).\n"
 
-    # Start states are inherently reachable
-    prolog_statements += "reachable(%s) :- state(%s), %s.\n" % (generic_state, generic_state, State.generic_start_reachability_expression())
+        # Goal states must be reachable
+        prolog_statements += ":- state(TX,TY,S), not reachable(TX,TY,S), goal_state(S).\n"
+    else:
+        # Add state reachable rule
+        state_reachable_rule = "reachable(%s) :- link(%s,%s), state(%s), state(%s), reachable(%s)." % (
+            generic_dest_state, generic_src_state, generic_dest_state, generic_src_state, generic_dest_state, generic_src_state
+        )
+        prolog_statements += state_reachable_rule + "\n"
 
-    # Goal states must be reachable
-    prolog_statements += ":- state(%s), not reachable(%s), %s.\n" % (generic_state, generic_state, State.generic_goal_reachability_expression())
+        # Start states are inherently reachable
+        prolog_statements += "reachable(%s) :- state(%s), %s.\n" % (generic_state, generic_state, State.generic_start_reachability_expression())
 
-    # Add rules for placing one_way_platform tiles
-    one_way_platform_tile_ids = metatile_type_ids_map.get("one_way_platform")
+        # Goal states must be reachable
+        prolog_statements += ":- state(%s), not reachable(%s), %s.\n" % (generic_state, generic_state, State.generic_goal_reachability_expression())
 
     # ASP WFC algorithm rule
     wfc_rule = ":- adj(X1,Y1,X2,Y2,DX,DY), assignment(X1,Y1,MT1), not 1 { assignment(X2,Y2,MT2) : legal(DX,DY,MT1,MT2) }."
@@ -160,39 +262,79 @@ def main(tile_constraints_file, debug, print_pl, save):
     if print_pl:
         print(prolog_statements)
 
-    # Update all_prolog_info file
-    all_prolog_info_filepath = utils.get_filepath("%s/prolog_files" % level_saved_files_dir,
-                                                  "all_prolog_info.pickle")
-    all_prolog_info_map = utils.read_pickle(all_prolog_info_filepath) if os.path.exists(
-        all_prolog_info_filepath) else {}
-
-    all_prolog_info_map[prolog_filename] = {
-        "block_tile_ids": [block_tile_id],
-        "start_tile_ids": [start_tile_id],
-        "goal_tile_ids": [goal_tile_id],
-        "bonus_tile_ids": [] if bonus_tile_id is None else [bonus_tile_id],
-        "one_way_platform_tile_ids": one_way_platform_tile_ids,
-        "hazard_tile_ids": hazard_tile_ids,
-        "wall_tile_ids": wall_tile_ids,
-        "permeable_wall_tile_ids": permeable_wall_tile_ids,
-        "level_ids_map": metatile_level_ids_map
-    }
-
     if save:
         utils.write_file(prolog_filepath, prolog_statements)
-        utils.write_pickle(all_prolog_info_filepath, all_prolog_info_map)
+        update_all_prolog_info(level_saved_files_dir, prolog_filename, prolog_info)
 
     runtime = stopwatch.stop()
 
     return prolog_filepath, runtime
 
 
+def add_prolog_delta(tile_constraints_file, new_tile_ids, added_adjacencies, delta_filename):
+    # Appends the prolog statements for tiles and adjacencies added to an existing tileset (see
+    # combine_constraints.py --incremental) to the tileset's prolog file, and saves them as a separate delta file.
+    # new_tile_ids are the last tile_ids of the tile constraints; added_adjacencies = {(tile_id, direction): tile_ids}
+
+    stopwatch = Stopwatch()
+
+    print("Generating prolog delta for constraints file: %s ..." % tile_constraints_file)
+    stopwatch.start()
+
+    level_saved_files_dir, prolog_filename = parse_constraints_filepath(tile_constraints_file)
+    prolog_filepath = utils.get_filepath("%s/prolog_files" % level_saved_files_dir, "%s.pl" % prolog_filename)
+    prolog_delta_filepath = utils.get_filepath("%s/prolog_files/deltas/%s" % (level_saved_files_dir, prolog_filename),
+                                               "%s.pl" % delta_filename)
+    if not os.path.exists(prolog_filepath):
+        utils.error_exit("Missing prolog file to add the delta to: %s" % prolog_filepath)
+
+    tile_id_constraints_dict = utils.read_pickle(tile_constraints_file)
+
+    # Keep the state ids of a prolog file generated with the integer state id encoding
+    state_id_records = read_all_prolog_info(level_saved_files_dir).get(prolog_filename, {}).get("state_id_records")
+    tile_state_ids = None
+    if state_id_records is not None:
+        tile_state_ids = {}
+        for state_record in state_id_records:
+            tile_state_ids[tuple(state_record)] = len(tile_state_ids)
+
+    # Create prolog statements for the new tiles and adjacencies
+    prolog_statements = ""
+    num_tile_ids = len(tile_id_constraints_dict)
+    if len(new_tile_ids) > 0:
+        prolog_statements += "dim_metatiles(%d..%d).\n" % (num_tile_ids - len(new_tile_ids) + 1, num_tile_ids)
+    for tile_id in new_tile_ids:
+        prolog_statements += get_tile_prolog_statements(tile_id, tile_id_constraints_dict[tile_id],
+                                                        state_ids=tile_state_ids)
+    for (tile_id, direction), adjacent_tiles in added_adjacencies.items():
+        prolog_statements += get_legal_prolog_statements(tile_id, direction, adjacent_tiles)
+    prolog_info = get_prolog_info(tile_id_constraints_dict)
+    if tile_state_ids is not None:
+        prolog_statements += get_state_contents_prolog_statements(list(tile_state_ids.keys()),
+                                                                  first_state_id=len(state_id_records))
+        prolog_info["state_id_records"] = list(tile_state_ids.keys())
+    prolog_statements = utils.get_unique_lines(prolog_statements)
+
+    utils.write_file(prolog_delta_filepath, prolog_statements)
+    with open(prolog_filepath, 'a') as file:
+        file.write(prolog_statements)
+    print("Appended %d prolog statements to: %s\n" % (len(prolog_statements.splitlines()), prolog_filepath))
+
+    update_all_prolog_info(level_saved_files_dir, prolog_filename, prolog_info)
+
+    runtime = stopwatch.stop()
+
+    return prolog_filepath, prolog_delta_filepath, runtime
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Generate prolog file')
     parser.add_argument('tile_constraints_file', type=str, help="File path of the tile constraints dictionary to use")
     parser.add_argument('--debug', const=True, nargs='?', type=bool, default=False, help='Allow empty tiles if no suitable assignment can be found')
     parser.add_argument('--print_pl', const=True, nargs='?', type=bool, default=False, help='Print prolog statements to console')
     parser.add_argument('--save', const=True, nargs='?', type=bool, default=False, help='Save generated prolog file')
+    parser.add_argument('--direction_wfc', const=True, nargs='?', type=bool, default=False, help='Derive the adj tile pairs from direction facts for the 8 neighbor directions of each tile')
+    parser.add_argument('--state_ids', const=True, nargs='?', type=bool, default=False, help='Encode states as integer ids relative to their tile, with reachability over (TX,TY,state id) triples (smaller prolog files, same ground program size)')
     args = parser.parse_args()
 
-    main(args.tile_constraints_file, args.debug, args.print_pl, args.save)
+    main(args.tile_constraints_file, args.debug, args.print_pl, args.save, args.direction_wfc, args.state_ids)
@@ -3,7 +3,6 @@ Returns a map of the states associated with each metatile for a given level {met
 """
 
 import argparse
-import networkx as nx
 from datetime import datetime
 
 from utils import read_pickle, write_pickle, get_filepath
@@ -40,8 +39,7 @@ def main(save_filename, unique_metatiles_file, player_img, print_stats):
 
     for metatile in unique_metatiles:
         metatile_str = metatile.to_str()
-        metatile_graph = nx.DiGraph(metatile.graph_as_dict)
-        num_states = len(metatile_graph.nodes())
+        num_states = metatile.graph.num_states()
         metatile_num_states_dict[metatile_str] = num_states
 
     write_pickle(metatile_num_states_dict_file, metatile_num_states_dict)
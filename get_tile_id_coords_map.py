@@ -19,7 +19,7 @@ def main(game, level, metatile_coords_dict_file, metatile_id_map_file, player_im
         metatile_id = metatile_id_map.get(metatile_str)
         if metatile_id is None:
             error_exit("metatile_str not found in metatile_id_map")
-        has_graph = bool(metatile.graph_as_dict)
+        has_graph = not metatile.graph.is_empty()
         extra_info = ""
         if not has_graph:
             extra_info += "E"  # metatile graph is empty
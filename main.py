@@ -29,7 +29,8 @@ def save_process_runtimes(process_key, process_runtimes):
 
 
 def main(environment, game, level, player_img, use_graph, draw_all_labels, draw_dup_labels, draw_path, show_score,
-         process, gen_prolog, dimensions, structure, summary, runtime, prolog):
+         process, gen_prolog, dimensions, structure, summary, runtime, prolog, workers, minimize,
+         detect_mirror):
 
     # Set environment variable
     if environment not in ENVIRONMENTS:
@@ -98,9 +99,15 @@ def main(environment, game, level, player_img, use_graph, draw_all_labels, draw_
         process_runtimes = []
 
         import enumerate
-        state_graph_file, runtime = enumerate.main(game, level, player_img)
+        state_graph_file, runtime = enumerate.main(game, level, player_img, workers=workers,
+                                                   detect_mirror=detect_mirror)
         process_runtimes.append(('enumerate', runtime))
 
+        if minimize:
+            import minimize_state_graph
+            state_graph_file, runtime = minimize_state_graph.main(state_graph_file)
+            process_runtimes.append(('minimize_state_graph', runtime))
+
         import extract_metatiles
         unique_metatiles_file, metatile_coords_dict_file, runtime = extract_metatiles.main(save_filename=level,
                                                                                            player_img=player_img,
@@ -166,8 +173,13 @@ if __name__ == "__main__":
     parser.add_argument('--summary', const=True, nargs='?', type=bool, help="Print level tile summmary stats", default=False)
     parser.add_argument('--runtime', const=True, nargs='?', type=bool, help="Print process script runtimes", default=False)
     parser.add_argument('--prolog', const=True, nargs='?', type=bool, help="Print prolog dictionary info for level", default=False)
+    parser.add_argument('--workers', type=int, help="Number of processes used to enumerate states with --process", default=1)
+    parser.add_argument('--minimize', const=True, nargs='?', type=bool, help="Merge bisimilar states of the enumerated state graph with --process", default=False)
+    parser.add_argument('--detect_mirror', const=True, nargs='?', type=bool, help="Mirror the state graph of an already processed level if this level is its mirror", default=False)
     args = parser.parse_args()
 
     main(args.environment, args.game, args.level, args.player_img,
          args.use_graph, args.draw_all_labels, args.draw_dup_labels, args.draw_path, args.show_score,
-         args.process, args.gen_prolog, args.dimensions, args.structure, args.summary, args.runtime, args.prolog)
+         args.process, args.gen_prolog, args.dimensions, args.structure, args.summary, args.runtime, args.prolog,
+         args.workers, args.minimize,
+         args.detect_mirror)
@@ -0,0 +1,182 @@
+"""
+Minimize an enumerated state graph by merging bisimilar states (states with identical futures)
+"""
+
+import os
+import re
+import argparse
+import datetime
+import numpy as np
+
+from model.level import TILE_DIM
+from model.state_graph import StateGraph
+from utils import get_filepath, read_pickle, write_pickle, error_exit
+
+# State fields that are not part of a state's label (x and y are replaced by the state's tile)
+DYNAMICS_FIELDS = ['x', 'y', 'movex', 'movey']
+
+
+def get_minimized_state_graph_file(state_graph_file):
+    match = re.match(r'level_saved_files_([^/]+)/enumerated_state_graphs(_r\d+)?/([^/]+)/([a-zA-Z0-9_-]+)\.csr',
+                     state_graph_file)
+    if match is None:
+        error_exit("Not an enumerated state graph file: %s" % state_graph_file)
+    player_img, resolution_suffix, game, level = match.groups(default='')
+    minimized_state_graph_file = get_filepath("level_saved_files_%s/minimized_state_graphs%s/%s" %
+                                              (player_img, resolution_suffix, game), "%s.csr" % level)
+    state_map_file = get_filepath("level_saved_files_%s/minimized_state_maps%s/%s" %
+                                  (player_img, resolution_suffix, game), "%s.pickle" % level)
+    return minimized_state_graph_file, state_map_file
+
+
+def get_state_map_file(minimized_state_graph_file):
+    # Returns None if minimized_state_graph_file is not a minimized state graph
+    match = re.match(r'level_saved_files_([^/]+)/minimized_state_graphs(_r\d+)?/([^/]+)/([a-zA-Z0-9_-]+)\.csr',
+                     minimized_state_graph_file)
+    if match is None:
+        return None
+    player_img, resolution_suffix, game, level = match.groups(default='')
+    return "level_saved_files_%s/minimized_state_maps%s/%s/%s.pickle" % (player_img, resolution_suffix, game, level)
+
+
+def read_state_map(minimized_state_graph_file):
+    # Reads the {state_key: block id} map of a minimized state graph (and checks that the map is for the graph)
+    state_map_file = get_state_map_file(minimized_state_graph_file)
+    if state_map_file is None or not os.path.exists(state_map_file):
+        error_exit("Missing state map for minimized state graph: %s" % minimized_state_graph_file)
+    state_map = read_pickle(state_map_file)
+    num_blocks = StateGraph.read(minimized_state_graph_file).num_states()
+    if len(set(state_map.values())) != num_blocks:
+        error_exit("State map %s does not match minimized state graph %s. Re-run 'python minimize_state_graph.py'" %
+                   (state_map_file, minimized_state_graph_file))
+    return state_map_file, state_map
+
+
+def get_state_labels(state_graph):
+    # Labels that merged states must share: the state's tile and every state field other than DYNAMICS_FIELDS
+    # (platformer: onground, is_start, goal_reached, hit_bonus_coord, is_dead)
+    states = np.asarray(state_graph.states)
+    label_columns = [states[:, state_graph.state_fields.index('x')] // TILE_DIM,
+                     states[:, state_graph.state_fields.index('y')] // TILE_DIM]
+    for field_index, field in enumerate(state_graph.state_fields):
+        if field not in DYNAMICS_FIELDS:
+            label_columns.append(states[:, field_index])
+    return np.stack(label_columns, axis=1)
+
+
+def get_successors(state_graph):
+    # successors[node][i] = node reached by action_strs[i] (-1 if the action has no edge)
+    num_actions = len(state_graph.action_strs)
+    successors = np.full((state_graph.num_states(), num_actions), -1, dtype=np.int64)
+    edge_sources = np.repeat(np.arange(state_graph.num_states()), np.diff(state_graph.offsets))
+    for i in range(num_actions):
+        action_edges = (np.asarray(state_graph.actions) & (1 << i)) > 0
+        successors[edge_sources[action_edges], i] = np.asarray(state_graph.targets)[action_edges]
+    return successors
+
+
+def get_bisimulation_blocks(labels, successors):
+    # Partition refinement: start from the blocks of states with the same label, then split blocks until every
+    # state in a block reaches the same blocks with the same actions. Returns block[node].
+    unique_labels, blocks = np.unique(labels, axis=0, return_inverse=True)
+    num_blocks, blocks = len(unique_labels), blocks.reshape(-1)
+    num_rounds = 0
+
+    while True:
+        num_rounds += 1
+        successor_blocks = np.where(successors >= 0, blocks[successors], -1)
+        signatures = np.concatenate([blocks[:, np.newaxis], successor_blocks], axis=1)
+        unique_signatures, refined_blocks = np.unique(signatures, axis=0, return_inverse=True)
+        refined_blocks = refined_blocks.reshape(-1)
+        if len(unique_signatures) == num_blocks:
+            break
+        num_blocks, blocks = len(unique_signatures), refined_blocks
+
+    print("refinement rounds: %d" % num_rounds)
+    return blocks
+
+
+def get_canonical_blocks(states, blocks):
+    # Renumbers the blocks so that neither the block ids nor their representatives depend on the order the states were
+    # enumerated in: each block is represented by its smallest state row and the blocks are numbered in the order of
+    # their representatives. Returns (representatives[block id] = node, block id of every node)
+    state_order = np.lexsort(np.asarray(states).T[::-1])
+    block_first_ranks = np.unique(blocks[state_order], return_index=True)[1]  # rank of each block's smallest state
+    block_order = np.argsort(block_first_ranks)
+    block_ids = np.empty(len(block_order), dtype=np.int64)
+    block_ids[block_order] = np.arange(len(block_order))
+    return state_order[block_first_ranks[block_order]], block_ids[blocks]
+
+
+def get_quotient_graph(state_graph, blocks):
+    # Quotient node i is block i (see get_canonical_blocks): it has the state of the block's representative and an
+    # edge to every block the representative's successors are in. The edges are between blocks, so a quotient edge's
+    # dest state is the representative of the block the physical successor is in, not the successor itself
+    states = np.asarray(state_graph.states)
+    representative_nodes, state_blocks = get_canonical_blocks(states, blocks)
+
+    x_index, y_index = state_graph.state_fields.index('x'), state_graph.state_fields.index('y')
+    offsets = [0]
+    targets = []
+    actions = []
+    weights = []
+    for node in representative_nodes:
+        target_actions = {}  # {dest block: action bitmask}
+        for edge in range(state_graph.offsets[node], state_graph.offsets[node + 1]):
+            target = int(state_blocks[state_graph.targets[edge]])
+            target_actions[target] = target_actions.get(target, 0) | int(state_graph.actions[edge])
+        for target in sorted(target_actions.keys()):
+            target_node = representative_nodes[target]
+            dx = int(states[node, x_index]) - int(states[target_node, x_index])
+            dy = int(states[node, y_index]) - int(states[target_node, y_index])
+            targets.append(target)
+            actions.append(target_actions[target])
+            weights.append(int(np.sqrt(dx * dx + dy * dy)))
+        offsets.append(len(targets))
+
+    quotient_graph = StateGraph(list(state_graph.state_fields), list(state_graph.action_strs),
+                                np.array(states[representative_nodes], dtype=np.int32),
+                                np.array(offsets, dtype=np.int64), np.array(targets, dtype=np.int32),
+                                np.array(actions, dtype=np.uint8), np.array(weights, dtype=np.int32))
+    return quotient_graph, state_blocks
+
+
+def minimize_state_graph(state_graph_file, minimized_state_graph_file, state_map_file):
+    state_graph = StateGraph.read(state_graph_file)
+    print("state graph size:", state_graph.num_states(), state_graph.num_edges())
+
+    blocks = get_bisimulation_blocks(get_state_labels(state_graph), get_successors(state_graph))
+    quotient_graph, state_blocks = get_quotient_graph(state_graph, blocks)
+    print("minimized state graph size:", quotient_graph.num_states(), quotient_graph.num_edges())
+
+    quotient_graph.write(minimized_state_graph_file)
+
+    # {state_key: block id} for every state of the enumerated state graph (block id = node of the minimized graph)
+    state_map = {}
+    for node, block in enumerate(state_blocks.tolist()):
+        state_map[state_graph.get_state_key(node)] = block
+    write_pickle(state_map_file, state_map)
+
+
+def main(state_graph_file):
+
+    start_time = datetime.datetime.now()
+    print("\nMinimizing state graph: %s ..." % state_graph_file)
+
+    if not os.path.exists(state_graph_file):
+        error_exit("Missing state graph: %s" % state_graph_file)
+    minimized_state_graph_file, state_map_file = get_minimized_state_graph_file(state_graph_file)
+    minimize_state_graph(state_graph_file, minimized_state_graph_file, state_map_file)
+
+    end_time = datetime.datetime.now()
+    runtime = str(end_time - start_time)
+    print("Runtime: %s\n" % runtime)
+    return minimized_state_graph_file, runtime
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Minimize an enumerated state graph by merging bisimilar states')
+    parser.add_argument('state_graph_file', type=str, help='File path of the enumerated state graph (.csr)')
+    args = parser.parse_args()
+
+    main(args.state_graph_file)
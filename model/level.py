@@ -112,6 +112,35 @@ class Level:
     def get_all_possible_coords(self):
         return Level.all_possible_coords(self.width, self.height)
 
+    def get_tile_type_grid(self):
+        # Returns tile_type_grid[row][col] = tile type of the tile at (col * TILE_DIM, row * TILE_DIM)
+        num_cols = int(self.width / TILE_DIM)
+        num_rows = int(self.height / TILE_DIM)
+        tile_type_grid = [['empty'] * num_cols for _ in range(num_rows)]
+
+        tile_type_coords = [
+            ('start', [self.start_coord]),
+            ('goal', self.goal_coords),
+            ('block', self.platform_coords),
+            ('bonus', self.bonus_coords),
+            ('one_way_platform', self.one_way_platform_coords),
+            ('hazard', self.hazard_coords),
+            ('wall', self.wall_coords),
+            ('permeable_wall', self.permeable_wall_coords)
+        ]
+        for tile_type, coords in tile_type_coords:
+            for x, y in coords:
+                tile_type_grid[y // TILE_DIM][x // TILE_DIM] = tile_type
+
+        return tile_type_grid
+
+    def is_mirror_of(self, level):
+        # True if this level is the given level flipped horizontally (same tile types, columns in reverse order)
+        if self.game != level.get_game() or self.width != level.get_width() or self.height != level.get_height():
+            return False
+        mirrored_tile_type_grid = [tile_type_row[::-1] for tile_type_row in level.get_tile_type_grid()]
+        return self.get_tile_type_grid() == mirrored_tile_type_grid
+
     @staticmethod
     def get_level_dimensions_in_tiles(game, level):
         level_obj = Level.generate_level_from_file(game, level)
@@ -2,27 +2,194 @@
 Metatile Object that describes each grid cell in a Level
 """
 
-import networkx as nx
+import os
+import hashlib
+import numpy as np
 
 from utils import error_exit, read_pickle, get_filepath
 
+if os.getenv('MAZE'):
+    from model_maze.state import StateMaze as State
+    from model_maze.action import ActionMaze as Action
+else:
+    from model_platformer.state import StatePlatformer as State
+    from model_platformer.action import ActionPlatformer as Action
+
 METATILE_TYPES = ["start", "goal", "block", "bonus", "empty", "one_way_platform", "hazard", "wall", "permeable_wall"]
 
+STATE_X_INDEX = State.ROW_FIELDS.index('x')
+STATE_Y_INDEX = State.ROW_FIELDS.index('y')
+
+STATE_RECORDS = {}  # {state record: state record}, so every metatile graph shares one tuple per distinct state record
+STATE_RECORD_STRS = {}  # {state record: State.to_str()} of the state records written to legacy graph dicts
+STATE_STR_RECORDS = {}  # {State.to_str(): state record} of the state strs read from legacy graph dicts
+METATILE_STRS = {}  # {metatile str: Metatile} of the metatile strs read with Metatile.from_str
+
+
+def intern_state_record(state_record):
+    return STATE_RECORDS.setdefault(state_record, state_record)
+
+
+class MetatileGraph:
+    # Graph of the states in a metatile, normalized to the metatile's coord:
+    # state_records[i] = State.key_to_row() tuple of state i (sorted, so that equal graphs have equal records and arrays)
+    # edges[e] = (source state i, dest state i) of edge e (sorted)
+    # actions[e] = bitmask of the actions that take edge e (bit i => action_strs[i])
+
+    def __init__(self, state_records, edges, actions, action_strs):
+        self.state_records = tuple([intern_state_record(tuple(state_record)) for state_record in state_records])
+        self.edges = np.asarray(edges, dtype=np.int32).reshape((-1, 2))
+        self.actions = np.asarray(actions, dtype=np.uint8)
+        self.action_strs = tuple(action_strs)
+
+    def __setstate__(self, state):
+        # Unpickled state records are separate tuples, so intern them again
+        self.__dict__.update(state)
+        self.state_records = tuple([intern_state_record(state_record) for state_record in self.state_records])
+
+    def num_states(self):
+        return len(self.state_records)
+
+    def num_edges(self):
+        return len(self.edges)
+
+    def is_empty(self):
+        return self.num_states() == 0
+
+    def get_action_strs(self, action_bitmask):
+        return [action_str for i, action_str in enumerate(self.action_strs) if action_bitmask & (1 << i)]
+
+    def get_state_records(self, coord=(0, 0)):
+        # State records un-normalized to the metatile at coord (coord is added to the x and y of every state)
+        state_records = np.array(self.state_records, dtype=np.int64).reshape((self.num_states(), len(State.ROW_FIELDS)))
+        state_records[:, STATE_X_INDEX] += coord[0]
+        state_records[:, STATE_Y_INDEX] += coord[1]
+        return state_records
+
+    def get_state_keys(self, coord=(0, 0)):
+        return [State.row_to_key(state_record) for state_record in self.get_state_records(coord).tolist()]
+
+    def get_state_strs(self, coord=(0, 0)):
+        state_strs = []
+        for state_record in self.get_state_records(coord).tolist():
+            state_record = tuple(state_record)
+            state_str = STATE_RECORD_STRS.get(state_record)
+            if state_str is None:
+                state_str = State.from_key(State.row_to_key(state_record)).to_str()
+                STATE_RECORD_STRS[state_record] = state_str
+            state_strs.append(state_str)
+        return state_strs
+
+    def to_bytes(self):
+        # Canonical byte encoding of the graph (used for metatile content hashes)
+        graph_repr = repr((self.action_strs, self.state_records)).encode('utf-8')
+        return graph_repr + self.edges.tobytes() + self.actions.tobytes()
+
+    def to_graph_as_dict(self):
+        # Legacy form of the graph: {state str: {dest state str: {'action': action strs}}}
+        state_strs = self.get_state_strs()
+        graph_as_dict = {}
+        for state_str in state_strs:
+            graph_as_dict[state_str] = {}
+        for (source, dest), action_bitmask in zip(self.edges.tolist(), self.actions.tolist()):
+            graph_as_dict[state_strs[source]][state_strs[dest]] = {'action': self.get_action_strs(action_bitmask)}
+        return graph_as_dict
+
+    @staticmethod
+    def from_arrays(state_records, edges, actions, action_strs):
+        # Sorts the state records and edges into the canonical order of a MetatileGraph
+        state_records = np.asarray(state_records, dtype=np.int64).reshape((-1, len(State.ROW_FIELDS)))
+        state_order = np.lexsort(state_records.T[::-1])
+        state_ranks = np.empty(len(state_order), dtype=np.int64)
+        state_ranks[state_order] = np.arange(len(state_order))
+        edges = state_ranks[np.asarray(edges, dtype=np.int64).reshape((-1, 2))]
+        edge_order = np.lexsort((edges[:, 1], edges[:, 0]))
+        return MetatileGraph(state_records[state_order].tolist(), edges[edge_order],
+                             np.asarray(actions, dtype=np.uint8)[edge_order], action_strs)
+
+    @staticmethod
+    def from_graph_as_dict(graph_as_dict, action_strs=None):
+        # Converts a legacy graph dict (see to_graph_as_dict); each distinct state str is only evaluated once
+        if action_strs is None:
+            action_strs = [action.to_str() for action in Action.allActions()]
+        action_bits = {}
+        for i, action_str in enumerate(action_strs):
+            action_bits[action_str] = 1 << i
+
+        state_indices = {}  # {state str: state i}
+        for state_str, neighbors in graph_as_dict.items():
+            for node_str in [state_str] + list(neighbors.keys()):
+                if state_indices.get(node_str) is None:
+                    state_indices[node_str] = len(state_indices)
+
+        state_records = []
+        for state_str in state_indices.keys():
+            state_record = STATE_STR_RECORDS.get(state_str)
+            if state_record is None:
+                state_record = tuple(State.key_to_row(State.from_str(state_str).to_key()))
+                STATE_STR_RECORDS[state_str] = state_record
+            state_records.append(state_record)
+
+        edges = []
+        actions = []
+        for state_str, neighbors in graph_as_dict.items():
+            for dest_state_str, edge_attrs in neighbors.items():
+                edges.append((state_indices[state_str], state_indices[dest_state_str]))
+                actions.append(sum([action_bits[action_str] for action_str in set(edge_attrs.get('action', []))]))
+
+        return MetatileGraph.from_arrays(state_records, edges, actions, action_strs)
+
 
 class Metatile:
-    def __init__(self, type, graph_as_dict, games=None, levels=None):
+    __slots__ = ('type', 'graph', 'games', 'levels', 'content_hash')  # no per-instance dict
+
+    def __init__(self, type, graph, games=None, levels=None):
         if type not in METATILE_TYPES:
             error_exit("Given metatile type [%s] must be one of %s" % (type, str(METATILE_TYPES)))
+        if isinstance(graph, dict):  # legacy graph dict
+            graph = MetatileGraph.from_graph_as_dict(graph)
         self.type = type
-        self.graph_as_dict = graph_as_dict
+        self.graph = graph  # MetatileGraph
         self.games = [] if games is None else games
         self.levels = [] if levels is None else levels
+        self.content_hash = None  # computed on first use (see get_content_hash)
+
+    def __getstate__(self):
+        state = {}
+        for slot in Metatile.__slots__:
+            state[slot] = getattr(self, slot)
+        return state
+
+    def __setstate__(self, state):
+        # Metatiles pickled before graphs were stored as a MetatileGraph hold a legacy graph dict (and metatiles
+        # pickled before content hashes existed do not have one)
+        if 'graph_as_dict' in state:
+            state = dict(state)
+            state['graph'] = MetatileGraph.from_graph_as_dict(state.pop('graph_as_dict'))
+            state['content_hash'] = None
+        for slot in Metatile.__slots__:
+            setattr(self, slot, state.get(slot))
 
     def __eq__(self, other):
         if isinstance(other, Metatile):
-            return self.type == other.type and self.graph_as_dict == other.graph_as_dict
+            return self.get_content_hash() == other.get_content_hash()
         return False
 
+    def __hash__(self):
+        return hash(self.get_content_hash())
+
+    @property
+    def graph_as_dict(self):
+        return self.graph.to_graph_as_dict()
+
+    def get_content_hash(self):
+        # Digest of the metatile type and graph (not its games and levels), so equal metatiles have equal hashes
+        if self.content_hash is None:
+            content_hash = hashlib.sha1(("%s|" % self.type).encode('utf-8'))
+            content_hash.update(self.graph.to_bytes())
+            self.content_hash = content_hash.hexdigest()
+        return self.content_hash
+
     def get_games(self):
         return self.games.copy()
 
@@ -34,16 +201,27 @@ class Metatile:
             error_exit("Cannot merge metatiles that have different types or graphs")
         combined_games = list(set(self.get_games() + other.get_games()))
         combined_levels = list(set(self.get_levels() + other.get_levels()))
-        return Metatile(self.type, self.graph_as_dict, games=combined_games, levels=combined_levels)
+        merged_metatile = Metatile(self.type, self.graph, games=combined_games, levels=combined_levels)
+        merged_metatile.content_hash = self.get_content_hash()
+        return merged_metatile
 
     def to_str(self):
+        # Compatibility shim: metatile strs are the keys of the metatile id maps and metatile coords dicts
         graph = str(self.graph_as_dict)
         return "{'type': '%s', 'graph': %s, 'games': %s, 'levels': %s}" % (self.type, graph, str(self.games), str(self.levels))
 
     @staticmethod
     def from_str(string):
-        metatile_dict = eval(string)
-        return Metatile(metatile_dict['type'], metatile_dict['graph'], metatile_dict['games'], metatile_dict['levels'])
+        # Compatibility shim for to_str; each distinct metatile str is only evaluated once
+        metatile = METATILE_STRS.get(string)
+        if metatile is None:
+            metatile_dict = eval(string)
+            metatile = Metatile(metatile_dict['type'], metatile_dict['graph'], metatile_dict['games'],
+                                metatile_dict['levels'])
+            METATILE_STRS[string] = metatile
+        parsed_metatile = Metatile(metatile.type, metatile.graph, metatile.get_games(), metatile.get_levels())
+        parsed_metatile.content_hash = metatile.get_content_hash()
+        return parsed_metatile
 
     @staticmethod
     def get_metatile_coord_from_state_coord(state_coord, tile_dim):
@@ -53,11 +231,11 @@ class Metatile:
 
     @staticmethod
     def get_unique_metatiles(metatiles):
-        unique_metatiles = []
+        unique_metatiles = {}  # {content hash: first metatile with that hash}
         for metatile in metatiles:
-            if metatile not in unique_metatiles:
-                unique_metatiles.append(metatile)
-        return unique_metatiles
+            if unique_metatiles.get(metatile.get_content_hash()) is None:
+                unique_metatiles[metatile.get_content_hash()] = metatile
+        return list(unique_metatiles.values())
 
     @staticmethod
     def get_unique_metatiles_for_level(level, player_img):
@@ -72,29 +250,3 @@ class Metatile:
         for level in levels:
             combined_metatiles += Metatile.get_unique_metatiles_for_level(level, player_img)
         return Metatile.get_unique_metatiles(combined_metatiles)
-
-    @staticmethod
-    def get_normalized_graph(graph, coord, normalize=True):
-
-        normalized_graph = nx.DiGraph()
-        edge_attr_dict = nx.get_edge_attributes(graph, "action")
-        x, y = coord[0], coord[1]
-
-        if not normalize:  # add coord to state x,y if un-normalizing graph
-            x *= -1
-            y *= -1
-
-        for edge in edge_attr_dict.keys():
-            source_dict = eval(edge[0])
-            source_dict['x'] -= x
-            source_dict['y'] -= y
-            source_node = str(source_dict)
-
-            dest_dict = eval(edge[1])
-            dest_dict['x'] -= x
-            dest_dict['y'] -= y
-            dest_node = str(dest_dict)
-
-            normalized_graph.add_edge(source_node, dest_node, action=edge_attr_dict[edge])
-
-        return normalized_graph
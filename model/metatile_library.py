@@ -0,0 +1,106 @@
+"""
+Metatile Library Object (content-addressed store of the unique metatiles of every processed level)
+"""
+
+import os
+import pickle
+
+from model.metatile import Metatile
+from utils import get_filepath, read_pickle, write_pickle
+
+
+class MetatileLibrary:
+    # level_saved_files_<player_img>/metatile_library/
+    #   metatiles.pickle - append-only file of (content hash, Metatile) records, one per distinct metatile (the library
+    #                      metatiles have no games or levels)
+    #   levels/<game>/<level>.pickle - content hashes of the level's unique metatiles (in unique_metatiles file order)
+    #   minimized_levels.pickle - {(game, level): state map file} of the levels extracted from a minimized state graph
+
+    def __init__(self, player_img):
+        self.library_dir = "level_saved_files_%s/metatile_library" % player_img
+        self.metatiles_file = get_filepath(self.library_dir, "metatiles.pickle")
+        self.metatiles = None  # {content hash: Metatile}, read on first use
+        self.minimized_levels_file = get_filepath(self.library_dir, "minimized_levels.pickle")
+
+    def get_level_file(self, game, level):
+        return get_filepath("%s/levels/%s" % (self.library_dir, game), "%s.pickle" % level)
+
+    def has_level(self, game, level):
+        return os.path.exists(self.get_level_file(game, level))
+
+    def get_minimized_levels(self):
+        if not os.path.exists(self.minimized_levels_file):
+            return {}
+        return read_pickle(self.minimized_levels_file)
+
+    def is_minimized(self, game, level):
+        return self.get_minimized_levels().get((game, level)) is not None
+
+    def get_metatiles(self):
+        if self.metatiles is None:
+            self.metatiles = {}
+            if os.path.exists(self.metatiles_file):
+                with open(self.metatiles_file, 'rb') as file:
+                    while True:
+                        try:
+                            content_hash, metatile = pickle.load(file)
+                        except (EOFError, pickle.UnpicklingError):  # end of file (or a partially appended record)
+                            break
+                        self.metatiles[content_hash] = metatile
+        return self.metatiles
+
+    def add_metatiles(self, metatiles):
+        # Appends the metatiles that are not in the library yet
+        library_metatiles = self.get_metatiles()
+        new_metatiles = Metatile.get_unique_metatiles([metatile for metatile in metatiles
+                                                       if library_metatiles.get(metatile.get_content_hash()) is None])
+        if len(new_metatiles) == 0:
+            return
+        with open(self.metatiles_file, 'ab') as file:
+            for metatile in new_metatiles:
+                library_metatile = Metatile(metatile.type, metatile.graph)
+                library_metatile.content_hash = metatile.get_content_hash()
+                pickle.dump((library_metatile.content_hash, library_metatile), file, protocol=pickle.HIGHEST_PROTOCOL)
+                library_metatiles[library_metatile.content_hash] = library_metatile
+        print("Added %d metatiles to: %s" % (len(new_metatiles), self.metatiles_file))
+
+    def register_level(self, game, level, unique_metatiles, state_map_file=None):
+        # Adds the unique metatiles of one level (see extract_metatiles) and replaces the level's content hashes.
+        # state_map_file is the level's state map if the metatiles were extracted from a minimized state graph.
+        self.add_metatiles(unique_metatiles)
+        minimized_levels = self.get_minimized_levels()
+        if minimized_levels.get((game, level)) != state_map_file:
+            if state_map_file is None:
+                del minimized_levels[(game, level)]
+            else:
+                minimized_levels[(game, level)] = state_map_file
+            write_pickle(self.minimized_levels_file, minimized_levels)
+        content_hashes = [metatile.get_content_hash() for metatile in unique_metatiles]
+        return write_pickle(self.get_level_file(game, level), content_hashes)
+
+    def get_level_content_hashes(self, game, level):
+        return read_pickle(self.get_level_file(game, level))
+
+    def get_unique_metatiles(self, game_levels):
+        # Unique metatiles of the given [(game, level)] (union of the levels' content hashes), in the order that
+        # extract_metatiles would list them for the levels' state graphs, with the games and levels that contain them
+        library_metatiles = self.get_metatiles()
+        content_hash_game_levels = {}  # {content hash: [(game, level)]}, in the order the metatiles were last seen
+        for game, level in game_levels:
+            for content_hash in self.get_level_content_hashes(game, level):
+                metatile_game_levels = content_hash_game_levels.pop(content_hash, [])
+                content_hash_game_levels[content_hash] = metatile_game_levels + [(game, level)]
+
+        unique_metatiles = []
+        for content_hash, metatile_game_levels in content_hash_game_levels.items():
+            library_metatile = library_metatiles[content_hash]
+            games, levels = [], []
+            for game, level in metatile_game_levels:
+                if game not in games:
+                    games.append(game)
+                if level not in levels:
+                    levels.append(level)
+            unique_metatile = Metatile(library_metatile.type, library_metatile.graph, games=games, levels=levels)
+            unique_metatile.content_hash = content_hash
+            unique_metatiles.append(unique_metatile)
+        return unique_metatiles
@@ -0,0 +1,165 @@
+"""
+State Graph Object (compressed sparse row arrays that can be memory-mapped from disk)
+"""
+
+import os
+import json
+import numpy as np
+import networkx as nx
+
+from utils import get_directory, check_path_exists, error_exit
+
+if os.getenv('MAZE'):
+    from model_maze.state import StateMaze as State
+    from model_maze.action import ActionMaze as Action
+else:
+    from model_platformer.state import StatePlatformer as State
+    from model_platformer.action import ActionPlatformer as Action
+
+STATE_GRAPH_ARRAYS = ['states', 'offsets', 'targets', 'actions', 'weights']
+STATE_GRAPH_INFO_FILE = "info.json"
+
+
+class StateGraph:
+
+    def __init__(self, state_fields, action_strs, states, offsets, targets, actions, weights):
+        self.state_fields = state_fields  # column names of the states table
+        self.action_strs = action_strs  # bit i of an edge's action bitmask => action_strs[i]
+        self.states = states  # states[node] = State.key_to_row(state_key)
+        self.offsets = offsets  # out edges of node are edges offsets[node] to offsets[node+1]-1
+        self.targets = targets  # targets[edge] = dest node
+        self.actions = actions  # actions[edge] = bitmask of the actions that take the edge
+        self.weights = weights  # weights[edge] = euclidean distance between the edge's states
+        self.node_index = None  # {state_key: node}, built on first lookup
+
+    def num_states(self):
+        return len(self.states)
+
+    def num_edges(self):
+        return len(self.targets)
+
+    def get_state_key(self, node):
+        return State.row_to_key(self.states[node].tolist())
+
+    def get_state(self, node):
+        return State.from_key(self.get_state_key(node))
+
+    def get_node(self, state_key):
+        if self.node_index is None:
+            self.node_index = {}
+            for node in range(self.num_states()):
+                self.node_index[self.get_state_key(node)] = node
+        return self.node_index.get(state_key)
+
+    def get_action_strs(self, action_bitmask):
+        return [action_str for i, action_str in enumerate(self.action_strs) if action_bitmask & (1 << i)]
+
+    def out_edges(self, node):
+        # Returns [(dest node, action strs, weight)]
+        out_edges = []
+        for edge in range(self.offsets[node], self.offsets[node + 1]):
+            out_edges.append((int(self.targets[edge]), self.get_action_strs(int(self.actions[edge])),
+                              int(self.weights[edge])))
+        return out_edges
+
+    @staticmethod
+    def from_key_graph(key_graph, action_strs):
+        # Converts a networkx graph with State.to_key() nodes (see enumerate.enumerate_states) to a StateGraph
+        if len(action_strs) > 8:
+            error_exit("StateGraph action bitmasks support at most 8 actions")
+        action_bits = {}
+        for i, action_str in enumerate(action_strs):
+            action_bits[action_str] = 1 << i
+
+        state_keys = list(key_graph.nodes())
+        nodes = {}
+        for node, state_key in enumerate(state_keys):
+            nodes[state_key] = node
+
+        states = np.array([State.key_to_row(state_key) for state_key in state_keys], dtype=np.int32)
+        states = states.reshape((len(state_keys), len(State.ROW_FIELDS)))
+        offsets = np.zeros(len(state_keys) + 1, dtype=np.int64)
+        targets = []
+        actions = []
+        weights = []
+
+        for node, state_key in enumerate(state_keys):
+            for next_state_key, edge_data in key_graph.adj[state_key].items():
+                targets.append(nodes[next_state_key])
+                actions.append(sum([action_bits[action_str] for action_str in edge_data['action']]))
+                weights.append(edge_data['weight'])
+            offsets[node + 1] = len(targets)
+
+        return StateGraph(list(State.ROW_FIELDS), list(action_strs), states, offsets,
+                          np.array(targets, dtype=np.int32), np.array(actions, dtype=np.uint8),
+                          np.array(weights, dtype=np.int32))
+
+    def to_key_graph(self):
+        # Inverse of from_key_graph: networkx DiGraph with State.to_key() nodes (in node order)
+        key_graph = nx.DiGraph()
+        state_keys = [self.get_state_key(node) for node in range(self.num_states())]
+        key_graph.add_nodes_from(state_keys)
+        for node in range(self.num_states()):
+            for next_node, action_strs, weight in self.out_edges(node):
+                key_graph.add_edge(state_keys[node], state_keys[next_node], weight=weight, action=action_strs)
+        return key_graph
+
+    def to_nx_graph(self):
+        # Legacy format: networkx DiGraph with State.to_str() nodes and 'weight' and 'action' edge attributes
+        graph = nx.DiGraph()
+        state_strs = [self.get_state(node).to_str() for node in range(self.num_states())]
+        graph.add_nodes_from(state_strs)
+        for node in range(self.num_states()):
+            for next_node, action_strs, weight in self.out_edges(node):
+                graph.add_edge(state_strs[node], state_strs[next_node], weight=weight, action=action_strs)
+        return graph
+
+    def write(self, state_graph_file):
+        # state_graph_file is a directory holding one .npy file per array
+        get_directory(state_graph_file)
+        for array_name in STATE_GRAPH_ARRAYS:
+            np.save(os.path.join(state_graph_file, "%s.npy" % array_name), getattr(self, array_name))
+        with open(os.path.join(state_graph_file, STATE_GRAPH_INFO_FILE), 'w') as file:
+            json.dump({"state_fields": self.state_fields, "action_strs": self.action_strs}, file, indent=2)
+        print("Saved to:", state_graph_file)
+        return state_graph_file
+
+    @staticmethod
+    def read(state_graph_file, mmap=True):
+        check_path_exists(state_graph_file)
+        with open(os.path.join(state_graph_file, STATE_GRAPH_INFO_FILE), 'r') as file:
+            info = json.load(file)
+        if info['state_fields'] != list(State.ROW_FIELDS):
+            error_exit("State graph %s has state fields %s, expected %s" % (state_graph_file, info['state_fields'],
+                                                                             list(State.ROW_FIELDS)))
+        arrays = {}
+        for array_name in STATE_GRAPH_ARRAYS:
+            arrays[array_name] = np.load(os.path.join(state_graph_file, "%s.npy" % array_name),
+                                         mmap_mode='r' if mmap else None)
+        return StateGraph(info['state_fields'], info['action_strs'], **arrays)
+
+    @staticmethod
+    def get_array_files(state_graph_file):
+        array_files = [os.path.join(state_graph_file, "%s.npy" % array_name) for array_name in STATE_GRAPH_ARRAYS]
+        return array_files + [os.path.join(state_graph_file, STATE_GRAPH_INFO_FILE)]
+
+
+def read_state_graph(state_graph_file):
+    # Reads a StateGraph (also converts legacy .gpickle files with State.to_str() nodes)
+    if state_graph_file.endswith(".gpickle"):
+        check_path_exists(state_graph_file)
+        graph = nx.read_gpickle(state_graph_file)
+        state_keys = {}
+        for state_str in graph.nodes():
+            state_keys[state_str] = State.from_str(state_str).to_key()
+        action_strs = [action.to_str() for action in Action.allActions()]
+        return StateGraph.from_key_graph(nx.relabel_nodes(graph, state_keys), action_strs)
+    return StateGraph.read(state_graph_file)
+
+
+def read_state_graph_as_nx(state_graph_file):
+    # Adapter for consumers of the legacy networkx state graph (also reads legacy .gpickle files)
+    if state_graph_file.endswith(".gpickle"):
+        check_path_exists(state_graph_file)
+        return nx.read_gpickle(state_graph_file)
+    return StateGraph.read(state_graph_file).to_nx_graph()
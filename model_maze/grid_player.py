@@ -0,0 +1,160 @@
+"""
+Grid Player Model Object (reachable maze states computed with numpy arrays over the level's tile grid)
+"""
+
+import numpy as np
+
+from model.level import TILE_DIM
+from model_maze.state import StateMaze
+from model_maze.action import ActionMaze
+
+NO_TILE = -1
+
+# (dx, dy) of each action direction, in tiles
+ACTION_TILE_MOVES = {
+    ActionMaze.NONE: (0, 0),
+    ActionMaze.NORTH: (0, -1),
+    ActionMaze.SOUTH: (0, 1),
+    ActionMaze.EAST: (1, 0),
+    ActionMaze.WEST: (-1, 0)
+}
+
+
+class GridPlayerMaze:
+    # Every maze move is a whole tile, so the player's positions form a lattice with one position per tile (offset
+    # from the tile corner by the player's half width/height). PlayerMaze.next_state only depends on the position of
+    # a (non goal reached) state, so the collisions of every lattice position are computed once with array
+    # operations, the reachable positions are found with a breadth-first wavefront over the lattice, and the next
+    # states of each reachable position are looked up from the arrays.
+
+    def __init__(self, player_model, action_set):
+        self.half_player_w = player_model.half_player_w
+        self.half_player_h = player_model.half_player_h
+        self.action_moves = np.array([ACTION_TILE_MOVES[action.direction] for action in action_set], dtype=np.int64)
+
+        level = player_model.level
+        num_tile_cols = int(level.get_width() / TILE_DIM)
+        num_tile_rows = int(level.get_height() / TILE_DIM)
+        min_x, max_x = 0 + self.half_player_w, level.get_width() - self.half_player_w
+        min_y, max_y = 0 + self.half_player_h, level.get_height() - self.half_player_h
+
+        # Lattice of the positions TILE_DIM moves away from the start position, with a ring of off screen positions
+        # (moves off screen are blocked, but still check for bonus tile collisions)
+        start_state = player_model.get_start_state()
+        self.lattice_x0 = min_x + (start_state.x - min_x) % TILE_DIM - TILE_DIM
+        self.lattice_y0 = min_y + (start_state.y - min_y) % TILE_DIM - TILE_DIM
+        lattice_xs = np.arange(self.lattice_x0, max_x + 2 * TILE_DIM, TILE_DIM)
+        lattice_ys = np.arange(self.lattice_y0, max_y + 2 * TILE_DIM, TILE_DIM)
+        self.lattice_x, self.lattice_y = np.meshgrid(lattice_xs, lattice_ys)
+        in_bounds = (self.lattice_x >= min_x) & (self.lattice_x <= max_x) & \
+                    (self.lattice_y >= min_y) & (self.lattice_y <= max_y)
+
+        # First tile (in level coords order, i.e. row-major) of each tile type overlapped at each lattice position
+        tile_grids = {}
+        for tile_type, tile_coords in [('block', level.get_platform_coords()), ('bonus', level.get_bonus_coords()),
+                                       ('goal', level.get_goal_coords())]:
+            tile_grid = np.zeros((num_tile_rows, num_tile_cols), dtype=bool)
+            for tile_x, tile_y in tile_coords:
+                tile_grid[tile_y // TILE_DIM, tile_x // TILE_DIM] = True
+            tile_grids[tile_type] = tile_grid
+        self.first_block = self.get_first_overlapped_tiles(tile_grids['block'])
+        self.first_bonus = self.get_first_overlapped_tiles(tile_grids['bonus'])
+        self.first_goal = self.get_first_overlapped_tiles(tile_grids['goal'])
+
+        self.blocked = ~in_bounds | (self.first_block[0] != NO_TILE) | (self.first_bonus[0] != NO_TILE)
+
+    def get_first_overlapped_tiles(self, tile_grid):
+        # Returns (rows, cols) of the first tile set in tile_grid that the player overlaps at each lattice position
+        # (NO_TILE if there is none), matching PlayerMaze.collide
+        num_tile_rows, num_tile_cols = tile_grid.shape
+        min_cols = (self.lattice_x - self.half_player_w) // TILE_DIM
+        max_cols = (self.lattice_x + self.half_player_w - 1) // TILE_DIM
+        min_rows = (self.lattice_y - self.half_player_h) // TILE_DIM
+        max_rows = (self.lattice_y + self.half_player_h - 1) // TILE_DIM
+
+        first_rows = np.full(self.lattice_x.shape, NO_TILE, dtype=np.int64)
+        first_cols = np.full(self.lattice_x.shape, NO_TILE, dtype=np.int64)
+        for row_offset in range(int((max_rows - min_rows).max()) + 1):
+            for col_offset in range(int((max_cols - min_cols).max()) + 1):
+                rows, cols = min_rows + row_offset, min_cols + col_offset
+                valid = (rows <= max_rows) & (cols <= max_cols) & (rows >= 0) & (rows < num_tile_rows) & \
+                        (cols >= 0) & (cols < num_tile_cols)
+                overlapped = np.zeros(self.lattice_x.shape, dtype=bool)
+                overlapped[valid] = tile_grid[rows[valid], cols[valid]]
+                first = overlapped & (first_rows == NO_TILE)
+                first_rows[first], first_cols[first] = rows[first], cols[first]
+        return first_rows, first_cols
+
+    def get_lattice_index(self, x, y):
+        return (y - self.lattice_y0) // TILE_DIM, (x - self.lattice_x0) // TILE_DIM
+
+    def get_expanded_positions(self, start_state):
+        # Breadth-first wavefront over the lattice: returns the positions whose states take actions, i.e. the start
+        # position and the unblocked positions reachable from it without stopping on a goal tile
+        stops = self.first_goal[0] != NO_TILE
+        start_index = self.get_lattice_index(start_state.x, start_state.y)
+        reached = np.zeros(self.blocked.shape, dtype=bool)
+        reached[start_index] = True
+        frontier = reached.copy()
+        while frontier.any():
+            next_frontier = np.zeros(frontier.shape, dtype=bool)
+            next_frontier[1:, :] |= frontier[:-1, :]
+            next_frontier[:-1, :] |= frontier[1:, :]
+            next_frontier[:, 1:] |= frontier[:, :-1]
+            next_frontier[:, :-1] |= frontier[:, 1:]
+            next_frontier &= ~self.blocked & ~reached
+            reached |= next_frontier
+            frontier = next_frontier & ~stops
+        reached &= ~stops
+        reached[start_index] = True
+        return reached
+
+    def get_state_transitions(self, start_state):
+        # Returns {state_key: [next_state_key for each action]} for every state reachable from start_state
+        position_rows, position_cols = np.nonzero(self.get_expanded_positions(start_state))
+        target_rows = position_rows[:, np.newaxis] + self.action_moves[:, 1]
+        target_cols = position_cols[:, np.newaxis] + self.action_moves[:, 0]
+        moved = ~self.blocked[target_rows, target_cols]
+        next_rows = np.where(moved, target_rows, position_rows[:, np.newaxis])
+        next_cols = np.where(moved, target_cols, position_cols[:, np.newaxis])
+
+        next_xs = self.lattice_x[next_rows, next_cols].tolist()
+        next_ys = self.lattice_y[next_rows, next_cols].tolist()
+        goal_rows, goal_cols = self.first_goal[0][next_rows, next_cols], self.first_goal[1][next_rows, next_cols]
+        bonus_rows, bonus_cols = self.first_bonus[0][target_rows, target_cols], \
+            self.first_bonus[1][target_rows, target_cols]
+        goal_coords = GridPlayerMaze.get_tile_coords(goal_rows, goal_cols)
+        bonus_coords = GridPlayerMaze.get_tile_coords(bonus_rows, bonus_cols)
+
+        position_next_state_keys = {}  # {lattice index: [next_state_key for each action]}
+        for i, position_index in enumerate(zip(position_rows.tolist(), position_cols.tolist())):
+            position_next_state_keys[position_index] = [
+                (next_x, next_y, False, goal_coord, bonus_coord)
+                for next_x, next_y, goal_coord, bonus_coord in zip(next_xs[i], next_ys[i], goal_coords[i],
+                                                                   bonus_coords[i])]
+
+        start_state_key = start_state.to_key()
+        state_transitions = {start_state_key: position_next_state_keys[self.get_lattice_index(start_state.x,
+                                                                                               start_state.y)]}
+        unexplored_state_keys = [start_state_key]
+        while len(unexplored_state_keys) > 0:
+            for next_state_key in state_transitions[unexplored_state_keys.pop()]:
+                if next_state_key in state_transitions:
+                    continue
+                next_state = StateMaze.from_key(next_state_key)
+                if next_state.goal_reached:
+                    state_transitions[next_state_key] = [next_state_key] * len(self.action_moves)
+                else:
+                    next_index = self.get_lattice_index(next_state.x, next_state.y)
+                    state_transitions[next_state_key] = position_next_state_keys[next_index]
+                unexplored_state_keys.append(next_state_key)
+        return state_transitions
+
+    @staticmethod
+    def get_tile_coords(rows, cols):
+        # [[tile coord or None]] from arrays of tile rows and cols (NO_TILE => None)
+        tile_coords = []
+        for tile_rows, tile_cols in zip(rows.tolist(), cols.tolist()):
+            tile_coords.append([None if row == NO_TILE else (col * TILE_DIM, row * TILE_DIM)
+                                for row, col in zip(tile_rows, tile_cols)])
+        return tile_coords
@@ -41,6 +41,13 @@ class PlayerMaze:
                 return tile_coord
         return None
 
+    def get_action_classes(self, state, action_set):
+        # Groups the indices of the actions in action_set that always lead to the same next state from the given
+        # state (every action leaves a goal reached state the same way)
+        if state.goal_reached:
+            return [list(range(len(action_set)))]
+        return [[i] for i in range(len(action_set))]
+
     def next_state(self, state, action):
         new_state = state.clone()
         if new_state.goal_reached:
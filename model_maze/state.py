@@ -3,8 +3,31 @@ Player State Object
 """
 from model.level import TILE_DIM
 
+# goal_reached and hit_bonus_coord hold a tile coord, None, or False; encoded as (x, y) rows in the state graph table
+NONE_COORD = (-1, -1)
+FALSE_COORD = (-2, -2)
+
+
+def encode_coord(coord):
+    if coord is None:
+        return NONE_COORD
+    if coord is False:
+        return FALSE_COORD
+    return coord
+
+
+def decode_coord(x, y):
+    if (x, y) == NONE_COORD:
+        return None
+    if (x, y) == FALSE_COORD:
+        return False
+    return x, y
+
 
 class StateMaze:
+    ROW_FIELDS = ('x', 'y', 'is_start', 'goal_reached_x', 'goal_reached_y', 'hit_bonus_x', 'hit_bonus_y')
+    __slots__ = ('x', 'y', 'is_start', 'goal_reached', 'hit_bonus_coord')  # no per-instance dict
+
     def __init__(self, x, y, is_start, goal_reached, hit_bonus_coord):
         self.x = x  # x coord of center of player
         self.y = y  # y coord of center of player
@@ -15,6 +38,31 @@ class StateMaze:
     def clone(self):
         return StateMaze(self.x, self.y, self.is_start, self.goal_reached, self.hit_bonus_coord)
 
+    def to_key(self):
+        # compact hashable encoding used for enumeration bookkeeping (see to_str for the persisted form)
+        return self.x, self.y, self.is_start, self.goal_reached, self.hit_bonus_coord
+
+    @staticmethod
+    def from_key(key):
+        return StateMaze(*key)
+
+    @staticmethod
+    def get_sink_key(key):
+        # Maze states are already one per tile, so terminal (goal reached) states have no canonical sink to collapse to
+        return key
+
+    @staticmethod
+    def key_to_row(key):
+        # integer row for the state graph states table (see model/state_graph.py)
+        x, y, is_start, goal_reached, hit_bonus_coord = key
+        return [x, y, int(is_start)] + list(encode_coord(goal_reached)) + list(encode_coord(hit_bonus_coord))
+
+    @staticmethod
+    def row_to_key(row):
+        x, y, is_start, goal_reached_x, goal_reached_y, hit_bonus_x, hit_bonus_y = row
+        return (x, y, bool(is_start), decode_coord(goal_reached_x, goal_reached_y),
+                decode_coord(hit_bonus_x, hit_bonus_y))
+
     def to_str(self):
         string = "{"
         string += "'x': " + str(self.x) + ", "
@@ -31,10 +79,11 @@ class StateMaze:
         return StateMaze(state_dict['x'], state_dict['y'], state_dict['is_start'], state_dict['goal_reached'],
                          state_dict['hit_bonus_coord'])
 
-    def to_prolog_contents(self):
+    def to_prolog_contents(self, tile_coord_vars=True):
+        # tile_coord_vars: x and y are offset by the coords of the tile at (TX, TY) (otherwise they are given as is)
         prolog_contents = [
-            "%d+TX*%d" % (self.x, TILE_DIM),
-            "%d+TY*%d" % (self.y, TILE_DIM),
+            "%d+TX*%d" % (self.x, TILE_DIM) if tile_coord_vars else "%d" % self.x,
+            "%d+TY*%d" % (self.y, TILE_DIM) if tile_coord_vars else "%d" % self.y,
             "%d" % self.is_start,
             "%d" % self.goal_reached,
             "\"%s\"" % str(self.hit_bonus_coord)
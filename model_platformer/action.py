@@ -21,6 +21,10 @@ class ActionPlatformer:
             action_string = "X"
         return action_string
 
+    def mirror(self):
+        # The action that moves the player the same way in a horizontally mirrored level
+        return ActionPlatformer(self.right, self.left, self.jump)
+
     @staticmethod
     def allActions():
         action_set = []
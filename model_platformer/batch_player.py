@@ -0,0 +1,290 @@
+"""
+Batch Player Model Object (vectorized next states for many platformer states at once)
+"""
+
+import numpy as np
+
+from model.level import TILE_DIM
+from model_platformer.player import SOLID_TILE_TYPES, BLOCK_TILE_TYPES, BONUS_TILE_TYPES, \
+    ONE_WAY_PLATFORM_TILE_TYPES, HAZARD_TILE_TYPES, GOAL_TILE_TYPES
+from model_platformer.state import StatePlatformer, HIT_BONUS_COORDS
+from model_platformer.action import ActionPlatformer
+
+# Tile types of each occupancy grid (index into BatchPlayerPlatformer.tile_grids)
+GRID_TILE_TYPES = [HAZARD_TILE_TYPES, SOLID_TILE_TYPES, BLOCK_TILE_TYPES, BONUS_TILE_TYPES,
+                   ONE_WAY_PLATFORM_TILE_TYPES, GOAL_TILE_TYPES]
+HAZARD_GRID, SOLID_GRID, BLOCK_GRID, BONUS_GRID, ONE_WAY_PLATFORM_GRID, GOAL_GRID = range(len(GRID_TILE_TYPES))
+
+HIT_BONUS_N = HIT_BONUS_COORDS.index('N')
+HIT_BONUS_NE = HIT_BONUS_COORDS.index('NE')
+HIT_BONUS_NW = HIT_BONUS_COORDS.index('NW')
+
+
+class BatchPlayerPlatformer:
+    # Computes PlayerPlatformer.next_state for every (state, action) pair of a batch of states with numpy arrays.
+    # Each state and distinct action class is a lane; the lanes step through the same per-pixel movement as
+    # PlayerPlatformer.step_x/step_y together, dropping the lanes that have stopped moving.
+
+    def __init__(self, player_model):
+        self.gravity = player_model.gravity
+        self.steps = player_model.steps
+        self.max_vel = player_model.max_vel
+        self.half_player_w = player_model.half_player_w
+        self.half_player_h = player_model.half_player_h
+        self.level_width = player_model.level.get_width()
+        self.level_height = player_model.level.get_height()
+        self.use_kid_icarus_rules = player_model.level.get_game() == "kid_icarus"
+        self.kid_icarus_level_width = int(self.level_width - 2 * TILE_DIM)
+        self.player_model = player_model  # snaps next states for coarse (resolution > 1) enumeration
+
+        # Occupancy grids[grid][row][col] of each GRID_TILE_TYPES entry, padded with a level's worth of empty tiles
+        # on each side so that bounding boxes off screen (or on the other side of a kid icarus wrap) need no clamping
+        num_tile_rows = player_model.num_tile_rows
+        num_tile_cols = player_model.num_tile_cols
+        self.pad_rows = num_tile_rows + 2
+        self.pad_cols = num_tile_cols + 2
+        self.tile_grids = np.zeros((len(GRID_TILE_TYPES), num_tile_rows + 2 * self.pad_rows,
+                                    num_tile_cols + 2 * self.pad_cols), dtype=np.int64)
+        for grid, tile_types in enumerate(GRID_TILE_TYPES):
+            for row, tile_type_row in enumerate(player_model.tile_type_grid):
+                for col, tile_type in enumerate(tile_type_row):
+                    if tile_type in tile_types:
+                        self.tile_grids[grid, row + self.pad_rows, col + self.pad_cols] = 1
+
+        # Summed area tables, so the number of tiles in any block of rows and cols is four lookups
+        self.summed_tile_grids = np.zeros((len(GRID_TILE_TYPES), self.tile_grids.shape[1] + 1,
+                                           self.tile_grids.shape[2] + 1), dtype=np.int64)
+        self.summed_tile_grids[:, 1:, 1:] = self.tile_grids.cumsum(1).cumsum(2)
+
+        # Max number of tile cols/rows the player's bounding box can overlap
+        self.max_overlap_cols = (2 * self.half_player_w - 1) // TILE_DIM + 2
+        self.max_overlap_rows = (2 * self.half_player_h - 1) // TILE_DIM + 2
+
+        # Only one action of each class of equivalent actions gets a lane (see PlayerPlatformer.get_action_classes):
+        # action_representatives[state_class][action] is the action whose lane gives the action's next state, with
+        # state classes 0: in the air, 1: on the ground, 2: goal reached or dead
+        action_set = ActionPlatformer.allActions()
+        self.action_representatives = np.zeros((3, len(action_set)), dtype=np.int64)
+        for state_class, (onground, is_dead) in enumerate([(False, False), (True, False), (False, True)]):
+            state = StatePlatformer(0, 0, 0, 0, onground, False, False, '', is_dead)
+            for action_class in player_model.get_action_classes(state, action_set):
+                self.action_representatives[state_class, action_class] = action_class[0]
+
+        self.action_movex = np.array([-self.steps if action.left and not action.right else
+                                      self.steps if action.right and not action.left else 0
+                                      for action in action_set], dtype=np.int64)
+        self.action_jump = np.array([action.jump for action in action_set], dtype=bool)
+
+    def get_overlapped_tile_ranges(self, x, y):
+        # Padded (min_row, max_row, min_col, max_col) of the tiles overlapped by the player's bounding box
+        min_col = (x - self.half_player_w) // TILE_DIM + self.pad_cols
+        max_col = (x + self.half_player_w - 1) // TILE_DIM + self.pad_cols
+        min_row = (y - self.half_player_h) // TILE_DIM + self.pad_rows
+        max_row = (y + self.half_player_h - 1) // TILE_DIM + self.pad_rows
+        return min_row, max_row, min_col, max_col
+
+    def collide_grids(self, x, y, grids):
+        # Returns collided[i][lane] for each of the given grids: whether the player at (x, y) overlaps a tile
+        min_row, max_row, min_col, max_col = self.get_overlapped_tile_ranges(x, y)
+        grids = np.array(grids)[:, np.newaxis]
+        summed_tile_grids = self.summed_tile_grids
+        return (summed_tile_grids[grids, max_row + 1, max_col + 1] - summed_tile_grids[grids, min_row, max_col + 1] -
+                summed_tile_grids[grids, max_row + 1, min_col] + summed_tile_grids[grids, min_row, min_col]) > 0
+
+    def get_nearest_tile(self, x, y, grid):
+        # Returns (tile_x, tile_y) of the grid's tile nearest to the player at (x, y) (which must overlap one), with
+        # ties going to the first tile in row-major order (same as PlayerPlatformer.collide for a single tile type)
+        min_row, max_row, min_col, max_col = self.get_overlapped_tile_ranges(x, y)
+        found = np.zeros(len(x), dtype=bool)
+        nearest_dist = np.zeros(len(x), dtype=np.int64)
+        tile_x = np.zeros(len(x), dtype=np.int64)
+        tile_y = np.zeros(len(x), dtype=np.int64)
+        for drow in range(self.max_overlap_rows):
+            row = min_row + drow
+            for dcol in range(self.max_overlap_cols):
+                col = min_col + dcol
+                hit = (row <= max_row) & (col <= max_col) & (self.tile_grids[grid, row, col] > 0)
+                coord_x = (col - self.pad_cols) * TILE_DIM
+                coord_y = (row - self.pad_rows) * TILE_DIM
+                dist = (x - (coord_x + TILE_DIM // 2)) ** 2 + (y - (coord_y + TILE_DIM // 2)) ** 2
+                nearer = hit & (~found | (dist < nearest_dist))
+                tile_x = np.where(nearer, coord_x, tile_x)
+                tile_y = np.where(nearer, coord_y, tile_y)
+                nearest_dist = np.where(nearer, dist, nearest_dist)
+                found |= hit
+        return tile_x, tile_y
+
+    def collide_grids_with_wrap(self, x, y, grids):
+        # kid icarus: for the lanes that did not collide, check if the wrap would collide on the other side
+        collided = self.collide_grids(x, y, grids)
+        checked_x = np.broadcast_to(x, collided.shape).copy()  # x at which each collision was checked
+        if self.use_kid_icarus_rules:
+            min_x = 0 + int(TILE_DIM * 1.5)
+            max_x = self.level_width - int(TILE_DIM * 1.5)
+            not_collided = ~collided
+            for wrap_side, wrapped_x in [(x <= min_x, x + self.kid_icarus_level_width),
+                                         (x >= max_x, x - self.kid_icarus_level_width)]:
+                if not wrap_side.any():
+                    continue
+                wrap = not_collided & wrap_side
+                collided = np.where(wrap, self.collide_grids(wrapped_x, y, grids), collided)
+                checked_x = np.where(wrap, wrapped_x, checked_x)
+        return collided, checked_x
+
+    def move_x(self, lanes):
+        # Vectorized PlayerPlatformer.step_x (see move_x_one_pixel); each iteration only updates the moving lanes
+        x, y, movex = lanes['x'], lanes['y'], lanes['movex']
+        moving = np.nonzero(~lanes['done'] & (movex != 0))[0]
+
+        for ii in range(self.steps):
+            if len(moving) == 0:
+                break
+            old_x = x[moving]
+            new_x = old_x + np.sign(movex[moving])
+            cur_y = y[moving]
+
+            # Handle hazard tile collisions
+            hazard = self.collide_grids(new_x, cur_y, [HAZARD_GRID])[0]
+            dead = moving[hazard]
+            x[dead] = new_x[hazard]
+            lanes['is_dead'][dead] = True
+            lanes['done'][dead] = True
+            alive = ~hazard
+            moving, old_x, new_x, cur_y = moving[alive], old_x[alive], new_x[alive], cur_y[alive]
+
+            # Handle block tile collisions
+            tile_collision = self.collide_grids_with_wrap(new_x, cur_y, [SOLID_GRID])[0][0]
+
+            if self.use_kid_icarus_rules:
+                # handle wrap
+                new_x = np.where(~tile_collision & (new_x < TILE_DIM), new_x + self.kid_icarus_level_width, new_x)
+                new_x = np.where(~tile_collision & (new_x >= self.level_width - TILE_DIM),
+                                 new_x - self.kid_icarus_level_width, new_x)
+            else:
+                # Handle moving off the screen
+                min_x, max_x = 0 + self.half_player_w, self.level_width - self.half_player_w
+                tile_collision |= (new_x < min_x) | (new_x > max_x)
+
+            x[moving] = np.where(tile_collision, old_x, new_x)
+            movex[moving[tile_collision]] = 0
+            moving = moving[~tile_collision]
+
+    def move_y(self, lanes):
+        # Vectorized PlayerPlatformer.step_y (see move_y_one_pixel); each iteration only updates the moving lanes.
+        # As in PlayerPlatformer.sweep_y, a lane that hits a tile is re-checked once at its current position (with
+        # movey 0), after which the remaining iterations of step_y can not change its state.
+        x, y, movey = lanes['x'], lanes['y'], lanes['movey']
+        num_pixels = np.abs(movey)
+        moving = np.nonzero(~lanes['done'] & (num_pixels > 0))[0]
+        rechecking = np.zeros(len(moving), dtype=bool)
+        min_y = 0 + self.half_player_h
+
+        for jj in range(self.max_vel):
+            remaining = num_pixels[moving] > jj
+            moving, rechecking = moving[remaining], rechecking[remaining]
+            if len(moving) == 0:
+                break
+            cur_x = x[moving]
+            old_y = y[moving]
+            cur_movey = movey[moving]
+            new_y = old_y + np.sign(cur_movey)
+
+            hazard = self.collide_grids(cur_x, new_y, [HAZARD_GRID])[0]
+            dead = moving[hazard]
+            y[dead] = new_y[hazard]
+            lanes['is_dead'][dead] = True
+            lanes['done'][dead] = True
+            alive = ~hazard
+            moving, rechecking = moving[alive], rechecking[alive]
+            cur_x, old_y, cur_movey, new_y = cur_x[alive], old_y[alive], cur_movey[alive], new_y[alive]
+
+            # Collide with one-way block tile from above
+            collided, checked_x = self.collide_grids_with_wrap(cur_x, new_y, [BLOCK_GRID, BONUS_GRID,
+                                                                              ONE_WAY_PLATFORM_GRID])
+            block_collision, bonus_collision, one_way_platform_collision = collided
+
+            hit_one_way_platform_tile_from_above = one_way_platform_collision & (cur_movey > 0)
+            one_way_platform_hits = np.nonzero(hit_one_way_platform_tile_from_above)[0]
+            if len(one_way_platform_hits) > 0:
+                one_way_platform_x, one_way_platform_y = self.get_nearest_tile(
+                    checked_x[2][one_way_platform_hits], new_y[one_way_platform_hits], ONE_WAY_PLATFORM_GRID)
+                hit_one_way_platform_tile_from_above[one_way_platform_hits] = \
+                    old_y[one_way_platform_hits] + self.half_player_h <= one_way_platform_y
+            collide = block_collision | bonus_collision | hit_one_way_platform_tile_from_above
+
+            blocked = collide | (new_y < min_y)
+            checked_y = new_y
+            new_y = np.where(blocked, old_y, new_y)
+            blocked_lanes = moving[blocked]
+            lanes['onground'][blocked_lanes] = cur_movey[blocked] > 0
+            movey[blocked_lanes] = 0
+
+            # if bonus tile was hit from below
+            bonus_hits = np.nonzero(blocked & bonus_collision)[0]
+            if len(bonus_hits) > 0:
+                bonus_x, bonus_y = self.get_nearest_tile(checked_x[1][bonus_hits], checked_y[bonus_hits],
+                                                         BONUS_GRID)
+                bonus_hits_x = cur_x[bonus_hits]
+                hit_from_below = new_y[bonus_hits] >= bonus_y + TILE_DIM
+                hit_bonus_coord = np.where(bonus_hits_x >= bonus_x + TILE_DIM, HIT_BONUS_NW,
+                                           np.where(bonus_hits_x < bonus_x, HIT_BONUS_NE, HIT_BONUS_N))
+                lanes['hit_bonus_coord'][moving[bonus_hits[hit_from_below]]] = hit_bonus_coord[hit_from_below]
+
+            # Player is dead if it falls off the screen (e.g. down a pit)
+            fell = new_y >= self.level_height
+            new_y = np.where(fell, self.level_height - 1, new_y)
+            y[moving] = new_y
+            lanes['is_dead'][moving[fell]] = True
+
+            # lanes stop after falling or after re-checking a blocked position
+            keep = ~fell & ~rechecking
+            rechecking = rechecking | blocked
+            moving, rechecking = moving[keep], rechecking[keep]
+
+    def next_state_keys(self, state_keys):
+        # Returns [[next_state_key for each action in ActionPlatformer.allActions()] for each state key]
+        num_actions = len(self.action_movex)
+        states = np.array([StatePlatformer.key_to_row(state_key) for state_key in state_keys], dtype=np.int64)
+        states = states.reshape((len(state_keys), len(StatePlatformer.ROW_FIELDS)))
+        onground = states[:, StatePlatformer.ROW_FIELDS.index('onground')]
+        goal_reached = states[:, StatePlatformer.ROW_FIELDS.index('goal_reached')]
+        is_dead = states[:, StatePlatformer.ROW_FIELDS.index('is_dead')]
+
+        # One lane per distinct action class of each state
+        state_classes = np.where((goal_reached > 0) | (is_dead > 0), 2, onground)
+        action_representatives = self.action_representatives[state_classes]
+        lane_states, lane_actions = np.nonzero(action_representatives == np.arange(num_actions))
+        state_action_lanes = np.zeros((len(state_keys), num_actions), dtype=np.int64)
+        state_action_lanes[lane_states, lane_actions] = np.arange(len(lane_states))
+        state_action_lanes = state_action_lanes[np.arange(len(state_keys))[:, np.newaxis], action_representatives]
+
+        lanes = {}
+        for field_index, field in enumerate(StatePlatformer.ROW_FIELDS):
+            lanes[field] = states[lane_states, field_index]
+        lanes['is_start'][:] = 0
+        lanes['done'] = (lanes['goal_reached'] > 0) | (lanes['is_dead'] > 0)  # done lanes keep their state
+        active = ~lanes['done']
+
+        # Account for gravity
+        movey = np.minimum(lanes['movey'] + self.gravity, self.max_vel)
+        movey = np.where(self.action_jump[lane_actions] & (lanes['onground'] > 0), -self.max_vel, movey)
+        lanes['movey'] = np.where(active, movey, lanes['movey'])
+        lanes['movex'] = np.where(active, self.action_movex[lane_actions], lanes['movex'])
+        lanes['onground'] = np.where(active, 0, lanes['onground'])
+        lanes['hit_bonus_coord'] = np.where(active, 0, lanes['hit_bonus_coord'])
+
+        # Move in x direction, then y direction
+        self.move_x(lanes)
+        self.move_y(lanes)
+
+        # Check if goal reached
+        goal_check = np.nonzero(~lanes['done'])[0]
+        lanes['goal_reached'][goal_check] = self.collide_grids(lanes['x'][goal_check], lanes['y'][goal_check],
+                                                               [GOAL_GRID])[0]
+
+        next_state_rows = np.stack([lanes[field] for field in StatePlatformer.ROW_FIELDS], axis=1).tolist()
+        lane_next_state_keys = [StatePlatformer.row_to_key(row) for row in next_state_rows]
+        if self.player_model.resolution > 1:
+            lane_next_state_keys = [self.player_model.get_snapped_state_key(next_state_key, state_keys[state])
+                                    for next_state_key, state in zip(lane_next_state_keys, lane_states.tolist())]
+        return [[lane_next_state_keys[lane] for lane in action_lanes] for action_lanes in state_action_lanes.tolist()]
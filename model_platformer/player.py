@@ -1,5 +1,6 @@
 from model.level import TILE_DIM
 from model_platformer.state import StatePlatformer
+from math import ceil, gcd
 
 '''
 Player Model Object
@@ -8,10 +9,37 @@ Player Model Object
 HALF_TURTLE_WIDTH = int(74 / 2)
 HALF_TILE_WIDTH = int(TILE_DIM / 2)
 
+# Tile types checked by each collision query (in the same order as the level coords lists they replace)
+SOLID_TILE_TYPES = ('block', 'bonus', 'wall')
+BLOCK_TILE_TYPES = ('block', 'wall')
+BONUS_TILE_TYPES = ('bonus',)
+ONE_WAY_PLATFORM_TILE_TYPES = ('one_way_platform',)
+HAZARD_TILE_TYPES = ('hazard',)
+GOAL_TILE_TYPES = ('goal',)
+SNAP_BLOCKING_TILE_TYPES = SOLID_TILE_TYPES + ONE_WAY_PLATFORM_TILE_TYPES + HAZARD_TILE_TYPES + GOAL_TILE_TYPES
+
+# Outcomes of moving the player along one axis
+MOVE_OK = 0
+MOVE_BLOCKED = 1
+MOVE_DEAD = 2  # hit a hazard tile (stop updating the state)
+MOVE_FELL = 3  # fell off the bottom of the screen
+
+# Tile neighborhood signature chars used to key the transition cache (tile types that collide the same way share a char)
+TILE_SIGNATURE_CHARS = {
+    'block': 'X',
+    'wall': 'X',
+    'bonus': '?',
+    'one_way_platform': 'T',
+    'hazard': 'H',
+    'goal': '!'
+}
+EMPTY_SIGNATURE_CHAR = '-'  # empty, start, and permeable_wall tiles
+OFF_SCREEN_SIGNATURE_CHAR = 'O'
+
 
 class PlayerPlatformer:
 
-    def __init__(self, img, level):
+    def __init__(self, img, level, use_swept_movement=True, transition_cache=None, resolution=1):
         self.gravity = 4 if level.get_game() == 'sample' else 5
         self.steps = 8 if level.get_game() == 'sample' else 10
         self.max_vel = 7 * self.gravity if level.get_game() == 'kid_icarus' else 8 * self.gravity
@@ -20,6 +48,20 @@ class PlayerPlatformer:
         self.half_player_w = HALF_TURTLE_WIDTH if img == 'turtle' else HALF_TILE_WIDTH
 
         self.level = level
+        self.use_swept_movement = use_swept_movement  # False => reference per-pixel movement
+        self.tile_type_grid = level.get_tile_type_grid()  # tile_type_grid[row][col]
+        self.num_tile_rows = len(self.tile_type_grid)
+        self.num_tile_cols = int(level.get_width() / TILE_DIM)
+
+        # Transitions only depend on the tiles within neighborhood_radius tiles of the player's tile
+        self.transition_cache = transition_cache
+        self.neighborhood_radius = max(ceil((self.steps + self.half_player_w) / TILE_DIM),
+                                       ceil((self.max_vel + self.half_player_h) / TILE_DIM))
+        self.tile_signature_rows = self.get_tile_signature_rows()
+
+        # Coarse enumeration: next states are snapped to the resolution pixel lattice (see snap_state)
+        self.resolution = resolution
+
         self.state = None
         self.reset()
 
@@ -33,6 +75,51 @@ class PlayerPlatformer:
     def reset(self):
         self.state = self.get_start_state()
 
+    def get_physics_params_key(self):
+        physics_params_key = "g%d_s%d_v%d_w%d_h%d" % (self.gravity, self.steps, self.max_vel, self.half_player_w,
+                                                      self.half_player_h)
+        if self.level.get_game() == "kid_icarus":
+            physics_params_key += "_kid_icarus"
+        return physics_params_key
+
+    def get_tile_signature_rows(self):
+        # Rows of tile signature chars, padded with neighborhood_radius off screen tiles on each side
+        padding = OFF_SCREEN_SIGNATURE_CHAR * self.neighborhood_radius
+        padded_width = self.num_tile_cols + 2 * self.neighborhood_radius
+        off_screen_rows = [OFF_SCREEN_SIGNATURE_CHAR * padded_width] * self.neighborhood_radius
+
+        tile_signature_rows = []
+        for tile_type_row in self.tile_type_grid:
+            row_chars = ''.join([TILE_SIGNATURE_CHARS.get(tile_type, EMPTY_SIGNATURE_CHAR) for tile_type in tile_type_row])
+            tile_signature_rows.append(padding + row_chars + padding)
+
+        return off_screen_rows + tile_signature_rows + off_screen_rows
+
+    def can_wrap(self, state):
+        # True if a kid icarus move from the state can reach the wrap zone
+        if self.level.get_game() != "kid_icarus":
+            return False
+        min_x = 0 + int(TILE_DIM * 1.5)
+        max_x = self.level.get_width() - int(TILE_DIM * 1.5)
+        return state.x - self.steps <= min_x or state.x + self.steps >= max_x
+
+    def get_transition_key(self, state, action):
+        # Returns None if the transition can not be cached
+        col, offset_x = divmod(state.x, TILE_DIM)
+        row, offset_y = divmod(state.y, TILE_DIM)
+        if not (0 <= col < self.num_tile_cols and 0 <= row < self.num_tile_rows):
+            return None
+
+        if self.can_wrap(state):
+            # transitions that can wrap around also depend on the tiles on the other side of the level
+            return None
+
+        neighborhood_size = 2 * self.neighborhood_radius + 1
+        tile_signature = ''.join([signature_row[col:col + neighborhood_size]
+                                  for signature_row in self.tile_signature_rows[row:row + neighborhood_size]])
+
+        return offset_x, offset_y, state.movey, state.onground, tile_signature, action.to_str()
+
     def is_dead(self):
         return self.state.is_dead
 
@@ -42,20 +129,348 @@ class PlayerPlatformer:
     def get_hit_bonus_coord(self):
         return self.state.hit_bonus_coord
 
-    def collide(self, x, y, tile_coords):
+    def collide(self, x, y, tile_types):
+        # Only the tiles overlapped by the player's bounding box can collide, so look those up in the tile grid
+        min_col = (x - self.half_player_w) // TILE_DIM
+        max_col = (x + self.half_player_w - 1) // TILE_DIM
+        min_row = (y - self.half_player_h) // TILE_DIM
+        max_row = (y + self.half_player_h - 1) // TILE_DIM
+
+        # Clamp to the level bounds (there are no tiles off screen)
+        min_col = 0 if min_col < 0 else min_col
+        max_col = self.num_tile_cols - 1 if max_col >= self.num_tile_cols else max_col
+        min_row = 0 if min_row < 0 else min_row
+        max_row = self.num_tile_rows - 1 if max_row >= self.num_tile_rows else max_row
+
+        # If multiple tiles overlap, return the one nearest to the player (ties go to the tile that comes first in
+        # the level coords lists, i.e. ordered by tile type in tile_types, then row, then col)
         ret = None
-        for tile_coord in tile_coords:
-            x_overlap = tile_coord[0] < (x + self.half_player_w) and (tile_coord[0] + TILE_DIM) > (x - self.half_player_w)
-            y_overlap = tile_coord[1] < (y + self.half_player_h) and (tile_coord[1] + TILE_DIM) > (y - self.half_player_h)
-            if x_overlap and y_overlap:
-                if ret is None:
-                    ret = tile_coord
-                else:
-                    if (x - (tile_coord[0] + TILE_DIM//2))**2 + (y - (tile_coord[1] + TILE_DIM//2))**2 < (x - (ret[0] + TILE_DIM//2))**2 + (y - (ret[1] + TILE_DIM//2))**2:
+        ret_rank = None
+        for row in range(min_row, max_row + 1):
+            tile_type_row = self.tile_type_grid[row]
+            for col in range(min_col, max_col + 1):
+                tile_type = tile_type_row[col]
+                if tile_type in tile_types:
+                    tile_coord = (col * TILE_DIM, row * TILE_DIM)
+                    dist = (x - (tile_coord[0] + TILE_DIM//2))**2 + (y - (tile_coord[1] + TILE_DIM//2))**2
+                    rank = (dist, tile_types.index(tile_type))
+                    if ret is None or rank < ret_rank:
                         ret = tile_coord
+                        ret_rank = rank
         return ret
 
+    def move_x_one_pixel(self, new_state, use_kid_icarus_rules):
+        old_x = new_state.x
+        if new_state.movex < 0:
+            new_state.x -= 1
+        elif new_state.movex > 0:
+            new_state.x += 1
+
+        # Handle hazard tile collisions
+        hazard_collision_coord = self.collide(new_state.x, new_state.y, HAZARD_TILE_TYPES)
+        if hazard_collision_coord is not None:
+            new_state.is_dead = True
+            new_state.is_start = False
+            return MOVE_DEAD
+
+        # Handle block tile collisions
+        tile_collision_coord = self.collide(new_state.x, new_state.y, SOLID_TILE_TYPES)
+
+        # kid icarus wrap
+        if use_kid_icarus_rules:
+            min_x = 0 + int(TILE_DIM * 1.5)
+            max_x = self.level.get_width() - int(TILE_DIM * 1.5)
+            kid_icarus_level_width = int(self.level.get_width() - 2 * TILE_DIM)
+
+            # check if wrap would collide on other side
+            if tile_collision_coord is None:
+                if new_state.x <= min_x:
+                    tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, SOLID_TILE_TYPES)
+                if new_state.x >= max_x:
+                    tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, SOLID_TILE_TYPES)
+
+            # handle wrap
+            if tile_collision_coord is None:
+                if new_state.x < TILE_DIM:
+                    new_state.x += kid_icarus_level_width
+                if new_state.x >= self.level.get_width() - TILE_DIM:
+                    new_state.x -= kid_icarus_level_width
+
+        if not use_kid_icarus_rules:
+            # Handle moving off the screen
+            min_x, max_x = 0 + self.half_player_w, self.level.get_width() - self.half_player_w
+            move_off_screen_left = new_state.x < min_x
+            move_off_screen_right = new_state.x > max_x
+            move_off_screen_x = move_off_screen_left or move_off_screen_right
+
+            if move_off_screen_x:
+                tile_collision_coord = True  # no tile, but act like a tile was collided with
+
+        if tile_collision_coord is not None:
+            new_state.x = old_x
+            new_state.movex = 0
+            return MOVE_BLOCKED
+
+        return MOVE_OK
+
+    def move_y_one_pixel(self, new_state, use_kid_icarus_rules):
+        move_status = MOVE_OK
+        min_y = 0 + self.half_player_h
+
+        old_y = new_state.y
+        if new_state.movey < 0:
+            new_state.y -= 1
+        elif new_state.movey > 0:
+            new_state.y += 1
+
+        hazard_collision_coord = self.collide(new_state.x, new_state.y, HAZARD_TILE_TYPES)
+        if hazard_collision_coord is not None:
+            new_state.is_dead = True
+            new_state.is_start = False
+            return MOVE_DEAD
+
+        # Collide with one-way block tile from above
+        block_tile_collision_coord = self.collide(new_state.x, new_state.y, BLOCK_TILE_TYPES)
+        bonus_tile_collision_coord = self.collide(new_state.x, new_state.y, BONUS_TILE_TYPES)
+        one_way_platform_tile_collision_coord = self.collide(new_state.x, new_state.y, ONE_WAY_PLATFORM_TILE_TYPES)
+
+        # kid icarus wrap
+        if use_kid_icarus_rules:
+            min_x = 0 + int(TILE_DIM * 1.5)
+            max_x = self.level.get_width() - int(TILE_DIM * 1.5)
+            kid_icarus_level_width = int(self.level.get_width() - 2 * TILE_DIM)
+
+            # check if wrap would collide on other side
+            if block_tile_collision_coord is None:
+                if new_state.x <= min_x:
+                    block_tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, BLOCK_TILE_TYPES)
+                if new_state.x >= max_x:
+                    block_tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, BLOCK_TILE_TYPES)
+
+            if bonus_tile_collision_coord is None:
+                if new_state.x <= min_x:
+                    bonus_tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, BONUS_TILE_TYPES)
+                if new_state.x >= max_x:
+                    bonus_tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, BONUS_TILE_TYPES)
+
+            if one_way_platform_tile_collision_coord is None:
+                if new_state.x <= min_x:
+                    one_way_platform_tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, ONE_WAY_PLATFORM_TILE_TYPES)
+                if new_state.x >= max_x:
+                    one_way_platform_tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, ONE_WAY_PLATFORM_TILE_TYPES)
+
+        hit_one_way_platform_tile_from_above = one_way_platform_tile_collision_coord is not None and new_state.movey > 0 and old_y + self.half_player_h <= one_way_platform_tile_collision_coord[1]
+        collide = block_tile_collision_coord is not None or bonus_tile_collision_coord is not None or hit_one_way_platform_tile_from_above
+
+        move_off_screen_y = new_state.y < min_y
+
+        if collide or move_off_screen_y:
+            new_state.y = old_y
+            new_state.onground = new_state.movey > 0
+            new_state.movey = 0
+            move_status = MOVE_BLOCKED
+
+            # if bonus tile was hit from below
+            if bonus_tile_collision_coord is not None and new_state.y >= bonus_tile_collision_coord[1] + TILE_DIM:
+                if new_state.x >= bonus_tile_collision_coord[0] + TILE_DIM:
+                    new_state.hit_bonus_coord = 'NW'
+                elif new_state.x < bonus_tile_collision_coord[0]:
+                    new_state.hit_bonus_coord = 'NE'
+                else:
+                    new_state.hit_bonus_coord = 'N'
+
+        # Player is dead if it falls off the screen (e.g. down a pit)
+        if new_state.y >= self.level.get_height():
+            new_state.y = self.level.get_height() - 1
+            new_state.is_dead = True
+            return MOVE_FELL
+
+        return move_status
+
+    def step_x(self, new_state, use_kid_icarus_rules):
+        # Reference movement: move and check for collisions one pixel at a time
+        for ii in range(abs(new_state.movex)):
+            move_status = self.move_x_one_pixel(new_state, use_kid_icarus_rules)
+            if move_status != MOVE_OK:
+                return move_status
+        return MOVE_OK
+
+    def step_y(self, new_state, use_kid_icarus_rules):
+        # Reference movement: move and check for collisions one pixel at a time (after hitting a tile, movey is 0 and
+        # the remaining iterations re-check the player's current position)
+        for jj in range(abs(new_state.movey)):
+            move_status = self.move_y_one_pixel(new_state, use_kid_icarus_rules)
+            if move_status in [MOVE_DEAD, MOVE_FELL]:
+                return move_status
+        return MOVE_OK
+
+    @staticmethod
+    def get_sweep_event_pixels(pos, direction, num_pixels, half_size, boundaries):
+        # Returns the sorted pixel offsets in [1, num_pixels] at which a box centered at pos moving in the given
+        # direction can start colliding with something: the first pixel, every pixel where the box's leading edge
+        # enters a new row/col of tiles, and every pixel where pos reaches one of the given boundaries. Between
+        # these pixels the box only leaves tiles, so the per-pixel collision checks can not change outcome.
+        event_pixels = {1}
+
+        if direction > 0:
+            next_tile_index = (pos + half_size - 1) // TILE_DIM + 1
+            first_entry_pixel = next_tile_index * TILE_DIM + 1 - half_size - pos
+        else:
+            next_tile_index = (pos - half_size) // TILE_DIM
+            first_entry_pixel = pos - (next_tile_index * TILE_DIM - 1 + half_size)
+        event_pixels.update(range(first_entry_pixel, num_pixels + 1, TILE_DIM))
+
+        for boundary in boundaries:
+            boundary_pixel = (boundary - pos) * direction
+            if 1 <= boundary_pixel <= num_pixels:
+                event_pixels.add(boundary_pixel)
+
+        return sorted(event_pixels)
+
+    def sweep_x(self, new_state, use_kid_icarus_rules):
+        # Swept movement: only run the per-pixel checks at the pixels where a collision can first occur
+        num_pixels = abs(new_state.movex)
+        if num_pixels == 0:
+            return MOVE_OK
+
+        direction = 1 if new_state.movex > 0 else -1
+        start_x = new_state.x
+        end_x = start_x + direction * num_pixels
+
+        if use_kid_icarus_rules:
+            # wrapping can move the player mid-sweep, so step through moves that reach the wrap zone
+            min_x = 0 + int(TILE_DIM * 1.5)
+            max_x = self.level.get_width() - int(TILE_DIM * 1.5)
+            if min(start_x + direction, end_x) <= min_x or max(start_x + direction, end_x) >= max_x:
+                return self.step_x(new_state, use_kid_icarus_rules)
+            boundaries = []
+        else:
+            min_x, max_x = 0 + self.half_player_w, self.level.get_width() - self.half_player_w
+            boundaries = [min_x - 1, max_x + 1]  # first positions off screen
+
+        for pixel in PlayerPlatformer.get_sweep_event_pixels(start_x, direction, num_pixels, self.half_player_w,
+                                                             boundaries):
+            new_state.x = start_x + direction * (pixel - 1)
+            move_status = self.move_x_one_pixel(new_state, use_kid_icarus_rules)
+            if move_status != MOVE_OK:
+                return move_status
+
+        new_state.x = end_x
+        return MOVE_OK
+
+    def sweep_y(self, new_state, use_kid_icarus_rules):
+        # Swept movement: only run the per-pixel checks at the pixels where a collision can first occur
+        num_pixels = abs(new_state.movey)
+        if num_pixels == 0:
+            return MOVE_OK
+
+        if use_kid_icarus_rules:
+            # collisions are also checked on the other side of the wrap
+            min_x = 0 + int(TILE_DIM * 1.5)
+            max_x = self.level.get_width() - int(TILE_DIM * 1.5)
+            if new_state.x <= min_x or new_state.x >= max_x:
+                return self.step_y(new_state, use_kid_icarus_rules)
+
+        direction = 1 if new_state.movey > 0 else -1
+        start_y = new_state.y
+        min_y = 0 + self.half_player_h
+        boundaries = [min_y - 1, self.level.get_height()]  # first positions off screen
+
+        for pixel in PlayerPlatformer.get_sweep_event_pixels(start_y, direction, num_pixels, self.half_player_h,
+                                                             boundaries):
+            new_state.y = start_y + direction * (pixel - 1)
+            move_status = self.move_y_one_pixel(new_state, use_kid_icarus_rules)
+            if move_status == MOVE_BLOCKED:
+                if pixel < num_pixels:
+                    # movey is now 0, so every remaining pixel re-checks the same position with the same outcome
+                    move_status = self.move_y_one_pixel(new_state, use_kid_icarus_rules)
+                return move_status
+            if move_status != MOVE_OK:
+                return move_status
+
+        new_state.y = start_y + direction * num_pixels
+        return MOVE_OK
+
+    def get_action_classes(self, state, action_set):
+        # Groups the indices of the actions in action_set that always lead to the same next state from the given
+        # state: pressing left and right moves like no horizontal input, jumping has no effect off the ground, and
+        # every action leaves a goal reached or dead state the same way (see compute_next_state)
+        action_classes = {}  # {action effect: [action indices]}
+        for i, action in enumerate(action_set):
+            if state.goal_reached or state.is_dead:
+                action_effect = None
+            else:
+                action_effect = (action.left and not action.right, action.right and not action.left,
+                                 action.jump and state.onground)
+            if action_classes.get(action_effect) is None:
+                action_classes[action_effect] = [i]
+            else:
+                action_classes[action_effect].append(i)
+        return list(action_classes.values())
+
+    def get_move_quantum(self):
+        # Unless blocked, the player moves in steps pixel increments in x and in multiples of gravity in y, so a
+        # resolution lattice only coarsens the enumeration if its spacing is a multiple of both
+        return self.steps * self.gravity // gcd(self.steps, self.gravity)
+
+    def can_snap_to(self, x, y):
+        if self.level.get_game() != "kid_icarus":
+            if x < self.half_player_w or x > self.level.get_width() - self.half_player_w:
+                return False
+        if y < self.half_player_h or y >= self.level.get_height():
+            return False
+        return self.collide(x, y, SNAP_BLOCKING_TILE_TYPES) is None
+
+    def snap_state(self, state, prev_state=None):
+        # Moves a non-terminal state onto the resolution pixel lattice: each coord goes to the nearest lattice coord
+        # where the player does not overlap a tile it collides with (or stays put if there is none). Ground and
+        # ceiling contact coords are tile_coord +/- half the player height, so they are on every lattice that
+        # divides TILE_DIM / 2.
+        if state.goal_reached or state.is_dead:
+            return state
+        direction_x = 0 if prev_state is None else state.x - prev_state.x
+        direction_y = 0 if prev_state is None else state.y - prev_state.y
+        for x in StatePlatformer.get_lattice_coords(state.x, self.resolution, direction_x):
+            if self.can_snap_to(x, state.y):
+                state.x = x
+                break
+        for y in StatePlatformer.get_lattice_coords(state.y, self.resolution, direction_y):
+            if self.can_snap_to(state.x, y):
+                state.y = y
+                break
+        return state
+
+    def get_snapped_state_key(self, state_key, prev_state_key):
+        return self.snap_state(StatePlatformer.from_key(state_key), StatePlatformer.from_key(prev_state_key)).to_key()
+
     def next_state(self, state, action):
+        new_state = self.next_full_resolution_state(state, action)
+        if self.resolution > 1:
+            self.snap_state(new_state, state)
+        return new_state
+
+    def next_full_resolution_state(self, state, action):
+        # Transitions are cached at full resolution (and snapped afterwards), so the cache is shared by all resolutions
+        if self.transition_cache is None or state.goal_reached or state.is_dead:
+            return self.compute_next_state(state, action)
+
+        transition_key = self.get_transition_key(state, action)
+        if transition_key is None:
+            return self.compute_next_state(state, action)
+
+        relative_next_state = self.transition_cache.get(transition_key)
+        if relative_next_state is None:
+            new_state = self.compute_next_state(state, action)
+            self.transition_cache.add(transition_key, (new_state.x - state.x, new_state.y - state.y, new_state.movex,
+                                                       new_state.movey, new_state.onground, new_state.goal_reached,
+                                                       new_state.hit_bonus_coord, new_state.is_dead))
+            return new_state
+
+        dx, dy, movex, movey, onground, goal_reached, hit_bonus_coord, is_dead = relative_next_state
+        return StatePlatformer(state.x + dx, state.y + dy, movex, movey, onground, False, goal_reached,
+                               hit_bonus_coord, is_dead)
+
+    def compute_next_state(self, state, action):
         new_state = state.clone()
         
         new_state.is_start = False
@@ -63,10 +478,6 @@ class PlayerPlatformer:
         if new_state.goal_reached or new_state.is_dead:
             return new_state
 
-        # Get level bounds
-        min_x, max_x = 0 + self.half_player_w, self.level.get_width() - self.half_player_w
-        min_y, max_y = 0 + self.half_player_h, self.level.get_height() - self.half_player_h
-
         # Account for gravity
         new_state.movey += self.gravity
         if new_state.movey > self.max_vel:
@@ -88,131 +499,23 @@ class PlayerPlatformer:
         use_kid_icarus_rules = self.level.get_game() == "kid_icarus"
 
         # Move in x direction
-        for ii in range(abs(new_state.movex)):
-            old_x = new_state.x
-            if new_state.movex < 0:
-                new_state.x -= 1
-            elif new_state.movex > 0:
-                new_state.x += 1
-
-            # Handle hazard tile collisions
-            hazard_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_hazard_coords())
-            if hazard_collision_coord is not None:
-                new_state.is_dead = True
-                new_state.is_start = False
-                return new_state
-
-            # Handle block tile collisions
-            tile_collision_coord = self.collide(new_state.x, new_state.y,
-                                                self.level.get_platform_coords() +
-                                                self.level.get_bonus_coords() +
-                                                self.level.get_wall_coords())
-
-            # kid icarus wrap
-            if use_kid_icarus_rules:
-                min_x = 0 + int(TILE_DIM * 1.5)
-                max_x = self.level.get_width() - int(TILE_DIM * 1.5)
-                kid_icarus_level_width = int(self.level.get_width() - 2 * TILE_DIM)
-
-                # check if wrap would collide on other side
-                if tile_collision_coord is None:
-                    if new_state.x <= min_x:
-                        tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, self.level.get_platform_coords() + self.level.get_bonus_coords() + self.level.get_wall_coords())
-                    if new_state.x >= max_x:
-                        tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, self.level.get_platform_coords() + self.level.get_bonus_coords() + self.level.get_wall_coords())
-
-                # handle wrap
-                if tile_collision_coord is None:
-                    if new_state.x < TILE_DIM:
-                        new_state.x += kid_icarus_level_width
-                    if new_state.x >= self.level.get_width() - TILE_DIM:
-                        new_state.x -= kid_icarus_level_width
-
-            if not use_kid_icarus_rules:
-                # Handle moving off the screen
-                move_off_screen_left = new_state.x < min_x
-                move_off_screen_right = new_state.x > max_x
-                move_off_screen_x = move_off_screen_left or move_off_screen_right
-
-                if move_off_screen_x:
-                    tile_collision_coord = True # no tile, but act like a tile was collided with
-                
-            if tile_collision_coord is not None:
-                new_state.x = old_x
-                new_state.movex = 0
-                break
+        if self.use_swept_movement:
+            move_status = self.sweep_x(new_state, use_kid_icarus_rules)
+        else:
+            move_status = self.step_x(new_state, use_kid_icarus_rules)
+        if move_status == MOVE_DEAD:
+            return new_state
 
         # Move in y direction
-        for jj in range(abs(new_state.movey)):
-            old_y = new_state.y
-            if new_state.movey < 0:
-                new_state.y -= 1
-            elif new_state.movey > 0:
-                new_state.y += 1
-
-            hazard_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_hazard_coords())
-            if hazard_collision_coord is not None:
-                new_state.is_dead = True
-                new_state.is_start = False
-                return new_state
-
-            # Collide with one-way block tile from above
-            block_tile_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_platform_coords() + self.level.get_wall_coords())
-            bonus_tile_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_bonus_coords())
-            one_way_platform_tile_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_one_way_platform_coords())
-
-            # kid icarus wrap
-            if use_kid_icarus_rules:
-                min_x = 0 + int(TILE_DIM * 1.5)
-                max_x = self.level.get_width() - int(TILE_DIM * 1.5)
-                kid_icarus_level_width = int(self.level.get_width() - 2 * TILE_DIM)
-
-                # check if wrap would collide on other side
-                if block_tile_collision_coord is None:
-                    if new_state.x <= min_x:
-                        block_tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, self.level.get_platform_coords() + self.level.get_wall_coords())
-                    if new_state.x >= max_x:
-                        block_tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, self.level.get_platform_coords() + self.level.get_wall_coords())
-
-                if bonus_tile_collision_coord is None:
-                    if new_state.x <= min_x:
-                        bonus_tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, self.level.get_bonus_coords())
-                    if new_state.x >= max_x:
-                        bonus_tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, self.level.get_bonus_coords())
-
-                if one_way_platform_tile_collision_coord is None:
-                    if new_state.x <= min_x:
-                        one_way_platform_tile_collision_coord = self.collide(new_state.x + kid_icarus_level_width, new_state.y, self.level.get_one_way_platform_coords())
-                    if new_state.x >= max_x:
-                        one_way_platform_tile_collision_coord = self.collide(new_state.x - kid_icarus_level_width, new_state.y, self.level.get_one_way_platform_coords())
-
-            hit_one_way_platform_tile_from_above = one_way_platform_tile_collision_coord is not None and new_state.movey > 0 and old_y + self.half_player_h <= one_way_platform_tile_collision_coord[1]
-            collide = block_tile_collision_coord is not None or bonus_tile_collision_coord is not None or hit_one_way_platform_tile_from_above
-
-            move_off_screen_y = new_state.y < min_y
-
-            if collide or move_off_screen_y:
-                new_state.y = old_y
-                new_state.onground = new_state.movey > 0
-                new_state.movey = 0
-
-                # if bonus tile was hit from below
-                if bonus_tile_collision_coord is not None and new_state.y >= bonus_tile_collision_coord[1] + TILE_DIM:
-                    if new_state.x >= bonus_tile_collision_coord[0] + TILE_DIM:
-                        new_state.hit_bonus_coord = 'NW'
-                    elif new_state.x < bonus_tile_collision_coord[0]:
-                        new_state.hit_bonus_coord = 'NE'
-                    else:
-                        new_state.hit_bonus_coord = 'N'
-
-            # Player is dead if it falls off the screen (e.g. down a pit)
-            if new_state.y >= self.level.get_height():
-                new_state.y = self.level.get_height() - 1
-                new_state.is_dead = True
-                break
+        if self.use_swept_movement:
+            move_status = self.sweep_y(new_state, use_kid_icarus_rules)
+        else:
+            move_status = self.step_y(new_state, use_kid_icarus_rules)
+        if move_status == MOVE_DEAD:
+            return new_state
 
         # Check if goal reached
-        goal_tile_collision_coord = self.collide(new_state.x, new_state.y, self.level.get_goal_coords())
+        goal_tile_collision_coord = self.collide(new_state.x, new_state.y, GOAL_TILE_TYPES)
         new_state.goal_reached = goal_tile_collision_coord is not None
 
         return new_state
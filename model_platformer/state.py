@@ -3,8 +3,14 @@ Player State Object
 """
 from model.level import TILE_DIM
 
+HIT_BONUS_COORDS = ['', 'N', 'NE', 'NW']
+MIRROR_HIT_BONUS_COORDS = {'': '', 'N': 'N', 'NE': 'NW', 'NW': 'NE'}
+
 
 class StatePlatformer:
+    ROW_FIELDS = ('x', 'y', 'movex', 'movey', 'onground', 'is_start', 'goal_reached', 'hit_bonus_coord', 'is_dead')
+    __slots__ = ROW_FIELDS  # no per-instance dict (states are created for every simulated step)
+
     def __init__(self, x, y, movex, movey, onground, is_start, goal_reached, hit_bonus_coord, is_dead):
         self.x = x  # x coord of center of player
         self.y = y  # y coord of center of player
@@ -20,6 +26,60 @@ class StatePlatformer:
         return StatePlatformer(self.x, self.y, self.movex, self.movey, self.onground, self.is_start, self.goal_reached,
                                self.hit_bonus_coord, self.is_dead)
 
+    def to_key(self):
+        # compact hashable encoding used for enumeration bookkeeping (see to_str for the persisted form)
+        return (self.x, self.y, self.movex, self.movey, self.onground, self.is_start, self.goal_reached,
+                self.hit_bonus_coord, self.is_dead)
+
+    @staticmethod
+    def from_key(key):
+        return StatePlatformer(*key)
+
+    @staticmethod
+    def get_sink_key(key):
+        # Terminal (goal reached or dead) states only ever transition to themselves, so they can be collapsed onto one
+        # canonical sink per tile, keeping the flags the solver checks per tile (onground, goal_reached,
+        # hit_bonus_coord, is_dead). Non-terminal state keys are returned as is.
+        x, y, movex, movey, onground, is_start, goal_reached, hit_bonus_coord, is_dead = key
+        if not (goal_reached or is_dead):
+            return key
+        sink_x = int(x / TILE_DIM) * TILE_DIM + TILE_DIM // 2
+        sink_y = int(y / TILE_DIM) * TILE_DIM + TILE_DIM // 2
+        return sink_x, sink_y, 0, 0, onground, False, goal_reached, hit_bonus_coord, is_dead
+
+    @staticmethod
+    def get_mirror_key(key, level_width):
+        # Key of the state in the horizontally mirrored level: the player's bounding box covers pixels x - half_w to
+        # x + half_w - 1, which mirror to the box centered at level_width - x
+        x, y, movex, movey, onground, is_start, goal_reached, hit_bonus_coord, is_dead = key
+        return (level_width - x, y, -movex, movey, onground, is_start, goal_reached,
+                MIRROR_HIT_BONUS_COORDS[hit_bonus_coord], is_dead)
+
+    @staticmethod
+    def get_lattice_coords(coord, resolution, direction=0):
+        # Coords of the resolution pixel lattice around coord, nearest first (ties go in the given direction of
+        # movement, so that moves of half the lattice spacing do not get snapped back)
+        lower_coord = coord - coord % resolution
+        if lower_coord == coord:
+            return [coord]
+        upper_coord = lower_coord + resolution
+        if coord - lower_coord < upper_coord - coord or (coord - lower_coord == upper_coord - coord and direction <= 0):
+            return [lower_coord, upper_coord]
+        return [upper_coord, lower_coord]
+
+    @staticmethod
+    def key_to_row(key):
+        # integer row for the state graph states table (see model/state_graph.py)
+        x, y, movex, movey, onground, is_start, goal_reached, hit_bonus_coord, is_dead = key
+        return [x, y, movex, movey, int(onground), int(is_start), int(goal_reached),
+                HIT_BONUS_COORDS.index(hit_bonus_coord), int(is_dead)]
+
+    @staticmethod
+    def row_to_key(row):
+        x, y, movex, movey, onground, is_start, goal_reached, hit_bonus_coord, is_dead = row
+        return (x, y, movex, movey, bool(onground), bool(is_start), bool(goal_reached),
+                HIT_BONUS_COORDS[hit_bonus_coord], bool(is_dead))
+
     def to_str(self):
         string = "{"
         string += "'x': " + str(self.x) + ", "
@@ -41,10 +101,11 @@ class StatePlatformer:
                                state_dict['onground'], state_dict['is_start'], state_dict['goal_reached'],
                                state_dict['hit_bonus_coord'], state_dict['is_dead'])
 
-    def to_prolog_contents(self):
+    def to_prolog_contents(self, tile_coord_vars=True):
+        # tile_coord_vars: x and y are offset by the coords of the tile at (TX, TY) (otherwise they are given as is)
         prolog_contents = [
-            "%d+TX*%d" % (self.x, TILE_DIM),
-            "%d+TY*%d" % (self.y, TILE_DIM),
+            "%d+TX*%d" % (self.x, TILE_DIM) if tile_coord_vars else "%d" % self.x,
+            "%d+TY*%d" % (self.y, TILE_DIM) if tile_coord_vars else "%d" % self.y,
             "%d" % self.movex,
             "%d" % self.movey,
             "%d" % self.onground,
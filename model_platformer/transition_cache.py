@@ -0,0 +1,54 @@
+"""
+Transition Cache Object
+"""
+
+import os
+
+from utils import get_filepath, read_pickle, write_pickle
+
+
+class TransitionCache:
+    # Memoized platformer transitions, keyed on the player's in-tile offset, movey, onground, the signature of the
+    # tiles around the player and the action. Values are next states relative to the player's tile, so an entry is
+    # reused wherever the same local tile pattern appears (in any level with the same physics params).
+
+    def __init__(self, physics_params_key, transitions=None):
+        self.physics_params_key = physics_params_key
+        self.transitions = {} if transitions is None else transitions  # {transition_key: relative_next_state}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, transition_key):
+        relative_next_state = self.transitions.get(transition_key)
+        if relative_next_state is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return relative_next_state
+
+    def add(self, transition_key, relative_next_state):
+        self.transitions[transition_key] = relative_next_state
+
+    def get_stats_str(self):
+        lookups = self.hits + self.misses
+        hit_perc = 0 if lookups == 0 else self.hits / lookups * 100
+        return "transition cache: %d entries, %d hits / %d lookups (%d%%)" % (len(self.transitions), self.hits,
+                                                                               lookups, hit_perc)
+
+    @staticmethod
+    def get_transition_cache_file(player_img, physics_params_key):
+        transition_cache_dir = "level_saved_files_%s/transition_caches" % player_img
+        return get_filepath(transition_cache_dir, "%s.pickle" % physics_params_key)
+
+    @staticmethod
+    def load(player_img, physics_params_key):
+        transition_cache_file = TransitionCache.get_transition_cache_file(player_img, physics_params_key)
+        if os.path.exists(transition_cache_file):
+            transitions = read_pickle(transition_cache_file)
+        else:
+            transitions = None
+        return TransitionCache(physics_params_key, transitions)
+
+    def save(self, player_img):
+        transition_cache_file = TransitionCache.get_transition_cache_file(player_img, self.physics_params_key)
+        return write_pickle(transition_cache_file, self.transitions)
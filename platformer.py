@@ -16,6 +16,7 @@ from view.tile import Tile
 from view.camera import Camera
 from model.level import TILE_DIM, MAX_WIDTH, MAX_HEIGHT
 from model.level import Level
+from model.state_graph import read_state_graph_as_nx
 from utils import read_pickle, error_exit, shortest_path_xy
 
 COLORS = {
@@ -94,7 +95,7 @@ def main(game, level, player_img, use_graph, draw_all_labels, draw_dup_labels, d
     level_obj = Level.generate_level_from_file(game, level)
 
     # Level saved files
-    state_graph_file = "level_saved_files_%s/enumerated_state_graphs/%s/%s.gpickle" % (player_img, game, level)
+    state_graph_file = "level_saved_files_%s/enumerated_state_graphs/%s/%s.csr" % (player_img, game, level)
 
     if game == "generated" and os.path.exists("level_saved_files_%s/generated_level_paths/%s.pickle" % (player_img, level)):
         generated_level_path_coords = read_pickle("level_saved_files_%s/generated_level_paths/%s.pickle" % (player_img, level))
@@ -103,7 +104,7 @@ def main(game, level, player_img, use_graph, draw_all_labels, draw_dup_labels, d
 
     if use_graph and os.path.exists(state_graph_file):
         print("***** USING ENUMERATED STATE GRAPH *****")
-        state_graph = nx.read_gpickle(state_graph_file)
+        state_graph = read_state_graph_as_nx(state_graph_file)
     else:
         print("***** USING MANUAL CONTROLS *****")
         state_graph = None
@@ -155,7 +156,7 @@ def main(game, level, player_img, use_graph, draw_all_labels, draw_dup_labels, d
             goal_coord = generated_level_path_coords[-1]
 
         elif os.path.exists(state_graph_file):
-            graph = nx.read_gpickle(state_graph_file)
+            graph = read_state_graph_as_nx(state_graph_file)
             shortest_path_dict = shortest_path_xy(graph)
             path_coords = shortest_path_dict.get("path_coords")
             start_coord = shortest_path_dict.get("start_coord")
@@ -241,7 +241,8 @@ def main(prolog_file, config_file, max_sol, threads, print_level, save, validate
                     level_ids_map=prolog_file_info.get('level_ids_map'),
                     print_level=print_level,
                     save=save,
-                    validate=validate)
+                    validate=validate,
+                    state_ids=prolog_file_info.get('state_id_records') is not None)
 
     # Set up keyboard interrupt handlers
     signal.signal(signal.SIGINT, handler=lambda s, f: keyboard_interrupt_handler(signal=s, frame=f, solver=solver))
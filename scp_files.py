@@ -6,6 +6,7 @@ import os
 import argparse
 
 from utils import error_exit, get_directory, get_filepath
+from model.state_graph import StateGraph
 
 INSTANCE_URL = "ec2-user@ec2-54-196-135-201.compute-1.amazonaws.com"
 PEM_FILEPATH = "platformer.pem"
@@ -25,9 +26,10 @@ TRIAL_DIRS = ['level_structural_layers/generated',
 def get_processed_level_files(player_img, game, levels):
     processed_files = ['all_levels_process_info.pickle', 'level_saved_files_%s/prolog_files/all_prolog_info.pickle' % player_img]
     for level in levels:
+        state_graph_file = 'level_saved_files_%s/enumerated_state_graphs/%s/%s.csr' % (player_img, game, level)
+        processed_files += StateGraph.get_array_files(state_graph_file)
         processed_files += [
             'process_console_output/%s.txt' % level,
-            'level_saved_files_%s/enumerated_state_graphs/%s/%s.gpickle' % (player_img, game, level),
             'level_saved_files_%s/unique_metatiles/%s.pickle' % (player_img, level),
             'level_saved_files_%s/metatile_coords_dicts/%s/%s.pickle' % (player_img, game, level),
             'level_saved_files_%s/id_metatile_maps/%s.pickle' % (player_img, level),
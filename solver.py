@@ -11,13 +11,17 @@ from datetime import datetime
 from model.level import TILE_DIM, TILE_CHARS
 from model.metatile import Metatile
 from model_platformer.state import StatePlatformer as State
+from model_platformer.action import ActionPlatformer as Action
+from model.state_graph import StateGraph
 from stopwatch import Stopwatch
-from utils import get_filepath, read_pickle, write_pickle, write_file, error_exit, get_unique_lines
+from utils import get_filepath, read_pickle, write_pickle, write_file, error_exit, get_unique_lines, \
+    euclidean_distance
 
 
 class Solver:
 
-    def __init__(self, prolog_file, config, config_filename, tile_ids, level_ids_map, print_level, save, validate):
+    def __init__(self, prolog_file, config, config_filename, tile_ids, level_ids_map, print_level, save, validate,
+                 state_ids=False):
         self.prolog_file = prolog_file
         self.config_filename = config_filename
         self.level_w = config.get('level_w')
@@ -35,6 +39,7 @@ class Solver:
         self.require_all_bonus_tiles_reachable = config.get('require_all_bonus_tiles_reachable')  # bool
         self.tile_ids = tile_ids                                                # { tile_type: list-of-tile-ids }
         self.level_ids_map = level_ids_map                                      # { level: list-of-tile-ids }
+        self.state_ids = state_ids                                              # bool (integer state id encoding)
         self.print_level = print_level
         self.save = save
         self.validate = validate
@@ -133,15 +138,23 @@ class Solver:
             reachable_platform_ids = block_tile_id if level_has_one_way_tiles else ';'.join([block_tile_id] + one_way_tile_ids)
             tmp_prolog_statements += "tile_above_block(TX,TY) :- tile(TX,TY), assignment(TX,TY,ID1), ID1 != %s, ID1 != %s, ID1 != %s, tile(TX,TY+1), assignment(TX,TY+1,ID2), ID2 == (%s).\n" % \
                                      (goal_tile_id, block_tile_id, wall_tile_id, reachable_platform_ids)
-            tmp_prolog_statements += "tile_has_reachable_ground_state(TX,TY) :- tile(TX,TY), reachable(%s), %s, TX==X/%d, TY==Y/%d.\n"  % (generic_state, State.generic_ground_reachability_expression(), TILE_DIM, TILE_DIM)
+            if self.state_ids:
+                tmp_prolog_statements += "tile_has_reachable_ground_state(TX,TY) :- tile(TX,TY), reachable(TX,TY,S), state_contents(S,%s), %s.\n" % (generic_state, State.generic_ground_reachability_expression())
+            else:
+                tmp_prolog_statements += "tile_has_reachable_ground_state(TX,TY) :- tile(TX,TY), reachable(%s), %s, TX==X/%d, TY==Y/%d.\n"  % (generic_state, State.generic_ground_reachability_expression(), TILE_DIM, TILE_DIM)
             tmp_prolog_statements += ":- tile_above_block(TX,TY), not tile_has_reachable_ground_state(TX,TY).\n"
 
         # Bonus tiles must have a reachable bonus state in the tile below them
         if self.require_all_bonus_tiles_reachable and level_has_bonus_tiles:
             tmp_prolog_statements += "tile_below_bonus(TX,TY) :- tile(TX,TY), tile(TX,TY-1), assignment(TX,TY-1,%s).\n" % bonus_tile_id
-            tmp_prolog_statements += "tile_has_reachable_bonus_state(TX,TY) :- tile(TX,TY), reachable(%s), %s, TX==X/%d, TY==Y/%d.\n" % (
-                generic_state, State.generic_bonus_reachability_expression(), TILE_DIM, TILE_DIM
-            )
+            if self.state_ids:
+                tmp_prolog_statements += "tile_has_reachable_bonus_state(TX,TY) :- tile(TX,TY), reachable(TX,TY,S), state_contents(S,%s), %s.\n" % (
+                    generic_state, State.generic_bonus_reachability_expression()
+                )
+            else:
+                tmp_prolog_statements += "tile_has_reachable_bonus_state(TX,TY) :- tile(TX,TY), reachable(%s), %s, TX==X/%d, TY==Y/%d.\n" % (
+                    generic_state, State.generic_bonus_reachability_expression(), TILE_DIM, TILE_DIM
+                )
             tmp_prolog_statements += ":- tile_below_bonus(TX,TY), not tile_has_reachable_bonus_state(TX,TY).\n"
 
         # ----- ADD START/GOAL ON_GROUND RULES -----
@@ -334,6 +347,51 @@ class Solver:
         match = match.group(1)
         return match.split(',')
 
+    @staticmethod
+    def get_state_id_contents_dict(model_str):
+        # {state id: tile-relative state contents} from the state_contents facts of the integer state id encoding (None
+        # if the model uses the default state encoding)
+        state_contents_facts = Solver.get_facts_as_list(model_str, fact_name='state_contents')
+        if len(state_contents_facts) == 0:
+            return None
+        state_id_contents_dict = {}
+        for state_contents_fact in state_contents_facts:
+            state_contents = Solver.get_fact_contents_as_list(state_contents_fact)
+            state_id_contents_dict[state_contents[0]] = state_contents[1:]
+        return state_id_contents_dict
+
+    @staticmethod
+    def get_tile_state_contents(state_id_contents_dict, tile_x, tile_y, state_id):
+        # State contents of the state with the given id in the tile at (tile_x, tile_y)
+        state_contents = state_id_contents_dict[state_id].copy()
+        x_idx = State.prolog_state_contents_x_index()
+        y_idx = State.prolog_state_contents_y_index()
+        state_contents[x_idx] = str(int(state_contents[x_idx]) + int(tile_x) * TILE_DIM)
+        state_contents[y_idx] = str(int(state_contents[y_idx]) + int(tile_y) * TILE_DIM)
+        return state_contents
+
+    @staticmethod
+    def get_reachable_contents(model_str):
+        # State contents of the model's reachable facts (reachable(TX,TY,S) facts of the integer state id encoding are
+        # converted to the contents of the state in their tile)
+        reachable_facts = Solver.get_facts_as_list(model_str, fact_name='reachable')
+        reachable_contents = [Solver.get_fact_contents_as_list(fact) for fact in reachable_facts]
+        state_id_contents_dict = Solver.get_state_id_contents_dict(model_str)
+        if state_id_contents_dict is None:
+            return reachable_contents
+        return [Solver.get_tile_state_contents(state_id_contents_dict, *contents) for contents in reachable_contents]
+
+    @staticmethod
+    def get_link_contents(model_str):
+        # (source state contents, dest state contents) of the model's link facts
+        link_facts = Solver.get_facts_as_list(model_str, fact_name='link')
+        link_contents = [Solver.get_fact_contents_as_list(fact) for fact in link_facts]
+        state_id_contents_dict = Solver.get_state_id_contents_dict(model_str)
+        if state_id_contents_dict is None:
+            return [(contents[:len(contents)//2], contents[len(contents)//2:]) for contents in link_contents]
+        return [(Solver.get_tile_state_contents(state_id_contents_dict, *contents[:3]),
+                 Solver.get_tile_state_contents(state_id_contents_dict, *contents[3:])) for contents in link_contents]
+
     def process_answer_set(self, model_str):
         player_img, prolog_filename = Solver.parse_prolog_filepath(self.prolog_file)
         answer_set_filename = self.get_cur_answer_set_filename(prolog_filename)
@@ -413,8 +471,7 @@ class Solver:
                 assignments_dict[(tile_x, tile_y)] = tile_id
 
             # Get reachable fact contents from model_str
-            reachable_facts = Solver.get_facts_as_list(model_str, fact_name='reachable')
-            reachable_contents = [Solver.get_fact_contents_as_list(fact) for fact in reachable_facts]
+            reachable_contents = Solver.get_reachable_contents(model_str)
 
             # Check that all platforms are reachable
             if check_onground:
@@ -499,10 +556,7 @@ class Solver:
         graph = nx.Graph()
 
         # Add nodes from reachable facts
-        reachable_facts = Solver.get_facts_as_list(model_str, fact_name='reachable')
-
-        for reachable_fact in reachable_facts:
-            reachable_contents = Solver.get_fact_contents_as_list(reachable_fact)
+        for reachable_contents in Solver.get_reachable_contents(model_str):
             reachable_node = str(reachable_contents)
             graph.add_node(reachable_node)
             if reachable_contents[is_start_idx] == '1':
@@ -517,12 +571,8 @@ class Solver:
             error_exit('No reachable goal states found in model str')
 
         # Add edges from link facts
-        link_facts = Solver.get_facts_as_list(model_str, fact_name='link')
-        for link_fact in link_facts:
-            link_contents = Solver.get_fact_contents_as_list(link_fact)
-            src_node = str(link_contents[:len(link_contents)//2])
-            dest_node = str(link_contents[len(link_contents)//2:])
-            graph.add_edge(src_node, dest_node)
+        for src_contents, dest_contents in Solver.get_link_contents(model_str):
+            graph.add_edge(str(src_contents), str(dest_contents))
 
         # Check if valid path exists from start to goal
         for start_node in start_nodes:
@@ -543,18 +593,26 @@ class Solver:
         id_metatile_map = read_pickle(id_metatile_file)
         state_graph = nx.DiGraph()
         for (tile_x, tile_y), tile_id in assignments_dict.items():
-            metatile = Metatile.from_str(id_metatile_map.get(tile_id))
-            metatile_graph = nx.DiGraph(metatile.graph_as_dict)
-            if nx.is_empty(metatile_graph):
-                pass
-            else:
-                unnormalized_graph = Metatile.get_normalized_graph(metatile_graph,
-                                                                   coord=(tile_x*TILE_DIM, tile_y*TILE_DIM),
-                                                                   normalize=False)
-                state_graph = nx.compose(state_graph, unnormalized_graph)
+            metatile_graph = Metatile.from_str(id_metatile_map.get(tile_id)).graph
+            state_strs = metatile_graph.get_state_strs(coord=(tile_x*TILE_DIM, tile_y*TILE_DIM))
+            for (source, dest), action_bitmask in zip(metatile_graph.edges.tolist(), metatile_graph.actions.tolist()):
+                state_graph.add_edge(state_strs[source], state_strs[dest],
+                                     action=metatile_graph.get_action_strs(action_bitmask))
 
         return state_graph
 
+    @staticmethod
+    def to_state_graph(state_graph):
+        # Converts a constructed state graph (State.to_str() nodes) to a StateGraph, with the same edge weights as an
+        # enumerated state graph
+        state_keys = {}
+        for node in state_graph.nodes():
+            state_keys[node] = State.from_str(node).to_key()
+        key_graph = nx.relabel_nodes(state_graph, state_keys)
+        for state_key, next_state_key, edge_data in key_graph.edges(data=True):
+            edge_data['weight'] = euclidean_distance(state_key[:2], next_state_key[:2])
+        return StateGraph.from_key_graph(key_graph, [action.to_str() for action in Action.allActions()])
+
     @staticmethod
     def get_state_graph_valid_path(assignments_dict, player_img, prolog_filename, answer_set_filename, save=True):
 
@@ -562,8 +620,8 @@ class Solver:
         id_metatile_file = "level_saved_files_%s/id_metatile_maps/%s.pickle" % (player_img, prolog_filename)
         state_graph = Solver.construct_state_graph(assignments_dict, id_metatile_file)
         if save:
-            state_graph_file = get_filepath('level_saved_files_%s/enumerated_state_graphs/generated' % player_img, '%s.gpickle' % answer_set_filename)
-            nx.write_gpickle(state_graph, state_graph_file)
+            state_graph_file = get_filepath('level_saved_files_%s/enumerated_state_graphs/generated' % player_img, '%s.csr' % answer_set_filename)
+            Solver.to_state_graph(state_graph).write(state_graph_file)
 
         # Check for valid path from start to goal state
         start_nodes = []
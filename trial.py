@@ -42,7 +42,7 @@ def main(game, levels, process, solve, trial, max_sol, threads):
         level_model_str_file_format = "level_saved_files_block/generated_level_model_strs/%s.txt"
         level_assignments_dict_file_format = "level_saved_files_block/generated_level_assignments_dicts/%s.pickle"
         level_valid_path_file_format = "level_saved_files_block/generated_level_paths/%s.pickle"
-        level_state_graph_file_format = "level_saved_files_block/enumerated_state_graphs/generated/%s.gpickle"
+        level_state_graph_file_format = "level_saved_files_block/enumerated_state_graphs/generated/%s.csr"
 
         solve_dir = utils.get_directory("solver_console_output")
         sol_order = list(range(max_sol))
@@ -85,6 +85,8 @@ def main(game, levels, process, solve, trial, max_sol, threads):
                                                 level_valid_path_file_format % cur_answer_set_filename))
 
                     if sol != 0 and os.path.exists(level_state_graph_file_format % default_answer_set_filename):
+                        # .csr state graphs are directories: replace (not move into) an existing one
+                        os.system("rm -rf %s" % level_state_graph_file_format % cur_answer_set_filename)
                         os.system("mv %s %s" % (level_state_graph_file_format % default_answer_set_filename,
                                                 level_state_graph_file_format % cur_answer_set_filename))
 
@@ -31,7 +31,7 @@ def get_metatile_labels(coord_id_map, coord_metatile_map):
         if not id == '':
             metatile_label = id[1:]  # remove t-prefix from metatile id
             metatile = coord_metatile_map.get(coord)
-            graph_is_empty = not bool(metatile.graph_as_dict)
+            graph_is_empty = metatile.graph.is_empty()
             if graph_is_empty:
                 metatile_label += "E"  # add E to label if metatile graph is empty
             if label_coords_dict.get(metatile_label) is None: